@@ -0,0 +1,143 @@
+"""Benchmark concurrent /chat throughput against a stubbed LLM.
+
+Runs a burst of concurrent conversations through the FastAPI app in-process
+and reports throughput, request latency and /health latency while the burst
+is in flight. The LLM is replaced with a stub that sleeps for a fixed time,
+so the numbers only reflect how the request path schedules work.
+
+``--blocking`` makes the stub sleep synchronously inside its async call,
+which reproduces the old request path where ``chain.invoke`` ran directly
+on the event loop. Run once with and once without it to compare:
+
+    python -m backend.benchmarks.chat_concurrency --blocking
+    python -m backend.benchmarks.chat_concurrency
+
+MongoDB is taken from ``MONGODB_URI``; pass ``--mongomock`` to use an
+in-memory stand-in instead (requires the ``mongomock`` package).
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Any, List, Optional
+
+import httpx
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from backend.benchmarks.utils import connect_benchmark_db, percentile
+
+
+class StubChatModel(BaseChatModel):
+    """Chat model that answers with a fixed reply after a fixed delay."""
+
+    latency: float = 0.5
+    blocking: bool = False
+    reply: str = "אני כאן איתך."
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _result(self) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return self._result()
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        if self.blocking:
+            time.sleep(self.latency)
+        else:
+            await asyncio.sleep(self.latency)
+        return self._result()
+
+
+async def run_benchmark(concurrency: int, requests: int, latency: float, blocking: bool):
+    """Fire ``requests`` chat turns with at most ``concurrency`` in flight."""
+    from backend.main import app, chatbot_service
+
+    chatbot_service.reload(llm=StubChatModel(latency=latency, blocking=blocking))
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        # Open the conversations up front so every measured turn calls the LLM
+        session_ids = []
+        for _ in range(concurrency):
+            response = await client.post("/chat", json={"message": "היי", "entry_source": "direct"})
+            session_ids.append(response.json()["session_id"])
+
+        semaphore = asyncio.Semaphore(concurrency)
+        chat_latencies = []
+        health_latencies = []
+        done = asyncio.Event()
+
+        async def one_turn(i):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(
+                    "/chat",
+                    # A distinct message per turn, so no turn is answered as a duplicate
+                    json={"message": f"מה שלומך? ({i})", "session_id": session_ids[i % concurrency]},
+                )
+                response.raise_for_status()
+                chat_latencies.append(time.perf_counter() - start)
+
+        async def probe_health():
+            # Measured from when the probe asked to wake up, so time spent
+            # waiting for a blocked event loop is included
+            while not done.is_set():
+                start = time.perf_counter()
+                await asyncio.sleep(0.05)
+                await client.get("/health")
+                health_latencies.append(time.perf_counter() - start - 0.05)
+
+        prober = asyncio.create_task(probe_health())
+        start = time.perf_counter()
+        await asyncio.gather(*(one_turn(i) for i in range(requests)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await prober
+
+    return elapsed, chat_latencies, health_latencies
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.5, help="Stub LLM latency in seconds")
+    parser.add_argument("--blocking", action="store_true", help="Block the event loop during LLM calls")
+    parser.add_argument("--mongomock", action="store_true", help="Use an in-memory MongoDB stand-in")
+    args = parser.parse_args(argv)
+
+    connect_benchmark_db(use_mongomock=args.mongomock)
+
+    elapsed, chat_latencies, health_latencies = asyncio.run(
+        run_benchmark(args.concurrency, args.requests, args.latency, args.blocking)
+    )
+
+    mode = "blocking" if args.blocking else "async"
+    print(f"mode={mode} concurrency={args.concurrency} requests={args.requests} llm_latency={args.latency}s")
+    print(f"throughput: {len(chat_latencies) / elapsed:.1f} req/s ({elapsed:.2f}s total)")
+    print(
+        "chat latency: "
+        f"mean={statistics.mean(chat_latencies) * 1000:.0f}ms "
+        f"p95={percentile(chat_latencies, 95) * 1000:.0f}ms"
+    )
+    if health_latencies:
+        print(
+            "/health latency under load: "
+            f"p50={percentile(health_latencies, 50) * 1000:.0f}ms "
+            f"max={max(health_latencies) * 1000:.0f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
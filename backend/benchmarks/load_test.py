@@ -0,0 +1,254 @@
+"""End-to-end load test of the chat API against the fake LLM.
+
+Simulates concurrent users who open a conversation, send a series of
+messages (optionally over /chat/stream) and browse /conversations, with the
+app running in-process, the deterministic FakeChatModel in place of
+Gemini/OpenAI and an in-memory MongoDB stand-in. Reports p50/p95/p99
+latency and requests/sec per endpoint, plus time-to-first-token when
+streaming.
+
+    python -m backend.benchmarks.load_test --users 50 --turns 6 --stream
+    python -m backend.benchmarks.load_test --json-out results.json
+    python -m backend.benchmarks.load_test --baseline results.json
+
+In-process requests are answered in full before the client sees them, so
+time-to-first-token is only meaningful with ``--url`` pointing at a running
+server (started with ``DEFAULT_MODEL=fake``); the fake model options below
+then have to be given to that server through the FAKE_LLM_* settings.
+
+With ``--baseline`` the run fails (exit code 1) if any endpoint's p95 is
+more than ``--max-regression`` slower than in the baseline results.
+``--tool-script`` and ``--transcript`` are passed to the fake model to
+exercise the agent's tool path or replay recorded traffic.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+
+# Must be set before the settings module is imported
+os.environ.setdefault("DEFAULT_MODEL", "fake")
+os.environ.setdefault("EMBEDDING_MODEL", "local")
+
+import httpx
+
+from backend.benchmarks.utils import connect_benchmark_db, percentile
+from backend.services.fake_llm import FakeChatModel, load_transcript
+from backend.services.prompt_cache import PromptCachingChatModel, get_prompt_cache
+
+
+USER_MESSAGES = [
+    "היי, אני לא בטוחה למה הגעתי לכאן",
+    "בן הזוג שלי בודק את הטלפון שלי כל ערב",
+    "הוא אומר שזה כי אכפת לו, אבל אני מרגישה לחוצה",
+    "כבר כמה חודשים שאני לא נפגשת עם החברות שלי",
+    "כן, אשמח לשמוע סיפור של מישהי אחרת",
+    "זה מזכיר לי מאוד את מה שקורה אצלי",
+    "אני לא יודעת מה לעשות עם זה",
+    "תודה שאת מקשיבה לי",
+]
+
+
+class Recorder:
+    """Collects request latencies per endpoint."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def timed(self, name, request):
+        start = time.perf_counter()
+        try:
+            response = await request
+            response.raise_for_status()
+        except Exception as e:
+            self.errors[name] += 1
+            print(f"{name} failed: {e}", file=sys.stderr)
+            return None
+        self.latencies[name].append(time.perf_counter() - start)
+        return response
+
+
+async def stream_turn(client, recorder, session_id, message):
+    """Send one turn over /chat/stream, recording TTFT and total latency."""
+    start = time.perf_counter()
+    first_token = None
+    try:
+        async with client.stream(
+            "POST", "/chat/stream", json={"message": message, "session_id": session_id}
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if first_token is None and line == "event: token":
+                    first_token = time.perf_counter() - start
+                elif line == "event: error":
+                    raise RuntimeError("stream reported an error")
+    except Exception as e:
+        recorder.errors["POST /chat/stream"] += 1
+        print(f"POST /chat/stream failed: {e}", file=sys.stderr)
+        return
+    recorder.latencies["POST /chat/stream"].append(time.perf_counter() - start)
+    if first_token is not None:
+        recorder.latencies["/chat/stream TTFT"].append(first_token)
+
+
+async def virtual_user(client, recorder, user_index, turns, stream, think_time):
+    """One user's session: open a conversation, chat, and browse history."""
+    response = await recorder.timed(
+        "POST /chat",
+        client.post("/chat", json={"message": "היי", "entry_source": "direct"}),
+    )
+    if response is None:
+        return
+    session_id = response.json()["session_id"]
+
+    for turn in range(turns):
+        message = USER_MESSAGES[(user_index + turn) % len(USER_MESSAGES)]
+        if stream:
+            await stream_turn(client, recorder, session_id, message)
+        else:
+            await recorder.timed(
+                "POST /chat",
+                client.post("/chat", json={"message": message, "session_id": session_id}),
+            )
+
+        if turn % 3 == 2:
+            listing = await recorder.timed(
+                "GET /conversations", client.get("/conversations", params={"limit": 10})
+            )
+            if listing is not None and listing.json():
+                conversation_id = listing.json()[0]["id"]
+                await recorder.timed(
+                    "GET /conversation/{id}", client.get(f"/conversation/{conversation_id}")
+                )
+        if think_time:
+            await asyncio.sleep(think_time)
+
+
+def in_process_client(args):
+    """Client for the app running in this process with the configured fake model."""
+    from backend.main import app, chatbot_service
+
+    tool_script = []
+    if args.tool_script:
+        with open(args.tool_script, encoding="utf-8") as f:
+            tool_script = json.load(f)
+
+    fake = FakeChatModel(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        tool_script=tool_script,
+        transcript=load_transcript(args.transcript) if args.transcript else {},
+    )
+    chatbot_service.reload(
+        llm=PromptCachingChatModel(inner=fake, prompt_cache=get_prompt_cache("fake", fake.model_name))
+    )
+
+    transport = httpx.ASGITransport(app=app)
+    return httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None)
+
+
+async def run_load_test(args):
+    recorder = Recorder()
+    if args.url:
+        limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+        client = httpx.AsyncClient(base_url=args.url, timeout=None, limits=limits)
+    else:
+        client = in_process_client(args)
+
+    async with client:
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(
+                virtual_user(client, recorder, i, args.turns, args.stream, args.think_time)
+                for i in range(args.users)
+            )
+        )
+        elapsed = time.perf_counter() - start
+    return recorder, elapsed
+
+
+def summarize(recorder, elapsed):
+    """Compute per-endpoint latency percentiles and throughput."""
+    results = {}
+    for name, values in sorted(recorder.latencies.items()):
+        results[name] = {
+            "count": len(values),
+            "errors": recorder.errors.get(name, 0),
+            "rps": len(values) / elapsed,
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+        }
+    for name, count in recorder.errors.items():
+        results.setdefault(name, {"count": 0, "errors": count})
+    return results
+
+
+def compare_to_baseline(results, baseline, max_regression):
+    """Return the endpoints whose p95 regressed beyond the allowed ratio."""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous or "p95_ms" not in current or not previous.get("p95_ms"):
+            continue
+        ratio = current["p95_ms"] / previous["p95_ms"]
+        if ratio > 1 + max_regression:
+            regressions.append((name, previous["p95_ms"], current["p95_ms"], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="Concurrent simulated users")
+    parser.add_argument("--turns", type=int, default=6, help="Messages sent per user")
+    parser.add_argument("--stream", action="store_true", help="Send turns over /chat/stream")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Seconds between a user's turns")
+    parser.add_argument("--latency", type=float, default=0.3, help="Fake LLM time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="Fake LLM output rate")
+    parser.add_argument("--tool-script", help="JSON file of fake LLM tool-call rules")
+    parser.add_argument("--transcript", help="JSONL transcript for the fake LLM to replay")
+    parser.add_argument("--url", help="Load test a running server instead of the app in-process")
+    parser.add_argument("--mongodb-uri", help="Use a real MongoDB instead of the in-memory stand-in")
+    parser.add_argument("--json-out", help="Write results to this file")
+    parser.add_argument("--baseline", help="Results file from a previous run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed p95 slowdown, e.g. 0.2 = 20%%")
+    args = parser.parse_args()
+
+    if not args.url:
+        connect_benchmark_db(use_mongomock=not args.mongodb_uri, uri=args.mongodb_uri)
+    recorder, elapsed = asyncio.run(run_load_test(args))
+    results = summarize(recorder, elapsed)
+
+    total = sum(len(values) for name, values in recorder.latencies.items() if "TTFT" not in name)
+    print(f"{args.users} users x {args.turns} turns in {elapsed:.2f}s ({total / elapsed:.1f} req/s)")
+    print(f"{'endpoint':<26}{'count':>7}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name, stats in results.items():
+        if "p50_ms" not in stats:
+            print(f"{name:<26}{0:>7}{stats['errors']:>8}")
+            continue
+        print(
+            f"{name:<26}{stats['count']:>7}{stats['errors']:>8}{stats['rps']:>9.1f}"
+            f"{stats['p50_ms']:>9.0f}{stats['p95_ms']:>9.0f}{stats['p99_ms']:>9.0f}"
+        )
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.max_regression)
+        for name, before, after, ratio in regressions:
+            print(f"REGRESSION {name}: p95 {before:.0f}ms -> {after:.0f}ms ({ratio - 1:+.0%})")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Benchmark login throughput and /chat latency during a burst of logins.
+
+Fires concurrent logins at the FastAPI app in-process while a steady
+stream of /chat turns (against a stubbed LLM) measures how long other
+requests wait. Logins that find the password hasher's queue full get 503
+and are counted as rejected.
+
+``--inline`` verifies passwords directly on the event loop, which
+reproduces the old login path. Run once with and once without it to
+compare:
+
+    python -m backend.benchmarks.login_storm --inline
+    python -m backend.benchmarks.login_storm
+
+MongoDB is taken from ``MONGODB_URI``; pass ``--mongomock`` to use an
+in-memory stand-in instead (requires the ``mongomock`` package).
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import httpx
+
+from backend.benchmarks.chat_concurrency import StubChatModel
+from backend.benchmarks.utils import connect_benchmark_db, percentile
+from backend.db.models.user_doc import User
+from backend.services import password_hashing
+from backend.services.password_hashing import PasswordHasher
+
+PASSWORD = "benchmark-password"
+
+
+class InlineHasher(PasswordHasher):
+    """Hashes on the calling thread, like the login path before the pool."""
+
+    async def _run(self, func, *args):
+        return func(*args)
+
+
+def create_users(count, hasher):
+    # One hash for everyone: only the logins are measured
+    hashed_password = hasher.context.hash(PASSWORD)
+    now = datetime.now(tz=timezone.utc)
+    User.objects(email__startswith="bench").delete()
+    User.objects.insert(
+        [
+            User(email=f"bench{i}@example.com", hashed_password=hashed_password, token="-", created_at=now, updated_at=now)
+            for i in range(count)
+        ]
+    )
+
+
+async def run_benchmark(logins: int, concurrency: int, chat_interval: float):
+    from backend.main import app, chatbot_service
+
+    chatbot_service.reload(llm=StubChatModel(latency=0.05))
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        response = await client.post("/chat", json={"message": "היי", "entry_source": "direct"})
+        session_id = response.json()["session_id"]
+
+        semaphore = asyncio.Semaphore(concurrency)
+        login_latencies = []
+        rejected = 0
+        chat_latencies = []
+        done = asyncio.Event()
+
+        async def one_login(i):
+            nonlocal rejected
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(
+                    "/login", json={"email": f"bench{i % concurrency}@example.com", "password": PASSWORD}
+                )
+                if response.status_code == 503:
+                    rejected += 1
+                    return
+                response.raise_for_status()
+                login_latencies.append(time.perf_counter() - start)
+
+        async def chat_turns():
+            # Measured from when the turn asked to start, so time spent
+            # waiting for a blocked event loop is included
+            while not done.is_set():
+                start = time.perf_counter()
+                await asyncio.sleep(chat_interval)
+                response = await client.post("/chat", json={"message": "מה שלומך?", "session_id": session_id})
+                response.raise_for_status()
+                chat_latencies.append(time.perf_counter() - start - chat_interval)
+
+        chatter = asyncio.create_task(chat_turns())
+        start = time.perf_counter()
+        await asyncio.gather(*(one_login(i) for i in range(logins)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await chatter
+
+    return elapsed, login_latencies, rejected, chat_latencies
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50, help="Logins in flight at once")
+    parser.add_argument("--rounds", type=int, default=None, help="bcrypt work factor (default: BCRYPT_ROUNDS)")
+    parser.add_argument("--workers", type=int, default=None, help="Hashing threads (default: PASSWORD_HASH_WORKERS)")
+    parser.add_argument("--max-pending", type=int, default=None, help="Hasher queue limit")
+    parser.add_argument("--chat-interval", type=float, default=0.1, help="Pause between /chat turns in seconds")
+    parser.add_argument("--inline", action="store_true", help="Verify passwords on the event loop")
+    parser.add_argument("--mongomock", action="store_true", help="Use an in-memory MongoDB stand-in")
+    args = parser.parse_args(argv)
+
+    connect_benchmark_db(use_mongomock=args.mongomock)
+    hasher_class = InlineHasher if args.inline else PasswordHasher
+    hasher = hasher_class(rounds=args.rounds, workers=args.workers, max_pending=args.max_pending)
+    password_hashing._hasher = hasher
+    create_users(args.concurrency, hasher)
+
+    elapsed, login_latencies, rejected, chat_latencies = asyncio.run(
+        run_benchmark(args.logins, args.concurrency, args.chat_interval)
+    )
+
+    mode = "inline" if args.inline else "pool"
+    print(
+        f"mode={mode} rounds={hasher.rounds} logins={args.logins} concurrency={args.concurrency} "
+        f"max_pending={hasher.max_pending}"
+    )
+    print(f"login throughput: {len(login_latencies) / elapsed:.1f} logins/s ({elapsed:.2f}s total, {rejected} rejected)")
+    if login_latencies:
+        print(
+            "login latency: "
+            f"mean={statistics.mean(login_latencies) * 1000:.0f}ms "
+            f"p95={percentile(login_latencies, 95) * 1000:.0f}ms"
+        )
+    if chat_latencies:
+        print(
+            f"/chat latency during the storm ({len(chat_latencies)} turns): "
+            f"p50={percentile(chat_latencies, 50) * 1000:.0f}ms "
+            f"p95={percentile(chat_latencies, 95) * 1000:.0f}ms "
+            f"max={max(chat_latencies) * 1000:.0f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Benchmark story search latency on a synthetic corpus.
+
+Builds an index of random stories with the local hashing embeddings and
+times vector and BM25 queries that exclude already recommended stories.
+
+    python -m backend.benchmarks.story_search --stories 50000
+"""
+
+import argparse
+import random
+import time
+
+from backend.benchmarks.utils import percentile
+from backend.services.embeddings import HashingEmbeddings
+from backend.services.story_index import StoryIndex
+
+
+WORDS = (
+    "phone messages friends family money work jealous angry calm quiet checks asks "
+    "controls night weekend apologizes promises texts calls late alone afraid tired "
+    "טלפון הודעות חברות משפחה כסף עבודה קנאה כעס שקט בודק שואל שולט לילה לבד מפחדת"
+).split()
+
+
+def random_text(rng, length):
+    return " ".join(rng.choice(WORDS) for _ in range(length))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stories", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    embeddings = HashingEmbeddings(args.dimensions)
+    stories = [
+        {"id": f"story{i}", "title": random_text(rng, 3), "content": random_text(rng, 60)}
+        for i in range(args.stories)
+    ]
+
+    start = time.perf_counter()
+    index = StoryIndex.build(stories, embeddings, dimensions=args.dimensions)
+    print(f"Indexed {len(index)} stories in {time.perf_counter() - start:.1f}s")
+
+    texts = [random_text(rng, 30) for _ in range(args.queries)]
+    queries = [embeddings.embed_query(text) for text in texts]
+    vector_latencies, lexical_latencies = [], []
+    for text, query in zip(texts, queries):
+        excluded = [f"story{rng.randrange(args.stories)}" for _ in range(10)]
+        start = time.perf_counter()
+        index.search(query, args.k, exclude_ids=excluded)
+        vector_latencies.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        index.lexical.search(text, args.k, exclude_ids=excluded)
+        lexical_latencies.append((time.perf_counter() - start) * 1000)
+
+    for name, latencies in (("Vector", vector_latencies), ("BM25", lexical_latencies)):
+        print(
+            f"{name} search over {len(index)} stories: p50 {percentile(latencies, 50):.2f}ms, "
+            f"p95 {percentile(latencies, 95):.2f}ms, p99 {percentile(latencies, 99):.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""Helpers shared by the benchmark scripts."""
+
+import mongoengine
+
+from backend.config.settings import get_settings
+
+
+def percentile(values, pct):
+    """Return the given percentile of a list of values."""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def connect_benchmark_db(use_mongomock=False, uri=None):
+    """Connect MongoEngine to a scratch database for a benchmark run.
+
+    With ``use_mongomock`` an in-memory stand-in is used instead of a real
+    server (requires the ``mongomock`` package from requirements-dev.txt).
+    """
+    settings = get_settings()
+    db = f"{settings.MONGODB_DB_NAME}_bench"
+    if use_mongomock:
+        import mongomock
+
+        return mongoengine.connect(
+            db=db, host="mongodb://localhost", mongo_client_class=mongomock.MongoClient
+        )
+    return mongoengine.connect(db=db, host=uri or settings.MONGODB_URI)
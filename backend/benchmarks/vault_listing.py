@@ -0,0 +1,82 @@
+"""Benchmark signing the download URLs of a vault listing.
+
+Signs URLs for a synthetic listing with GCS V2 signatures made with a
+throwaway service account key (signing is local, no requests are sent),
+first with an empty cache and then with a warm one.
+
+    python -m backend.benchmarks.vault_listing --objects 3000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from backend.services.storage import GCSStorage, SignedUrlCache
+
+
+def throwaway_credentials(directory):
+    """Write a service account key file that is only good for signing."""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    path = os.path.join(directory, "service_account.json")
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "type": "service_account",
+                "project_id": "benchmark",
+                "private_key_id": "benchmark",
+                "private_key": pem,
+                "client_email": "benchmark@benchmark.iam.gserviceaccount.com",
+                "client_id": "0",
+                "token_uri": "https://oauth2.googleapis.com/token",
+            },
+            f,
+        )
+    return path
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as directory:
+        storage = GCSStorage("benchmark-bucket", throwaway_credentials(directory))
+    cache = SignedUrlCache(storage, timedelta(minutes=30), timedelta(minutes=5))
+    now = datetime.now(tz=timezone.utc)
+    items = [
+        {"name": f"uploads/images/photo{i}.jpg", "generation": i, "updated": now, "size": 0, "content_type": None}
+        for i in range(args.objects)
+    ]
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    await cache.sign_all(items)
+    print(
+        f"Cold listing of {len(items)} objects: {time.perf_counter() - start:.2f}s "
+        f"({time.process_time() - cpu_start:.2f}s CPU)"
+    )
+
+    for _ in range(3):
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        await cache.sign_all(items)
+        print(
+            f"Warm listing of {len(items)} objects: {(time.perf_counter() - start) * 1000:.1f}ms "
+            f"({(time.process_time() - cpu_start) * 1000:.1f}ms CPU)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--objects", type=int, default=3000)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 from functools import lru_cache
 import os
+import secrets
 from dotenv import load_dotenv
 
 # Get the base directory
@@ -20,21 +21,138 @@ class Settings:
     # MongoDB settings
     MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
     MONGODB_DB_NAME = "mirrorme"
+    # Threads available for blocking MongoDB calls made from async handlers
+    MONGODB_EXECUTOR_WORKERS = int(os.getenv("MONGODB_EXECUTOR_WORKERS", "64"))
+
+    # Signs sign-in and upload tokens; the API does not start without it
+    JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 
 
     # Model settings
-    DEFAULT_MODEL = "gemini"  # or "gemini"
+    DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "gemini")  # "gemini", "openai" or "fake"
     OPENAI_MODEL_NAME = "gpt-4.1-mini"
     GEMINI_MODEL_NAME = "gemini-pro"
 
     GEMINI_MODEL_NAME = "gemini-2.0-flash"
 
+    # Secondary provider for hedged requests and failover (unset = primary only)
+    FALLBACK_MODEL = os.getenv("FALLBACK_MODEL")
+    HEDGE_PERCENTILE = 95  # Hedge once the primary is slower than this latency percentile
+    HEDGE_MIN_DELAY_SECONDS = 1.0
+    HEDGE_MAX_DELAY_SECONDS = 8.0
+    HEDGE_DEFAULT_DELAY_SECONDS = 3.0  # Until enough latencies have been observed
+    CIRCUIT_FAILURE_THRESHOLD = 3  # Consecutive errors before a provider is skipped
+    CIRCUIT_COOLDOWN_SECONDS = 30
+
+    # Deterministic fake model (DEFAULT_MODEL = "fake") for offline runs and load tests
+    FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0.3"))  # Seconds before the first token
+    FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "50"))
+    FAKE_LLM_TOOL_SCRIPT = os.getenv("FAKE_LLM_TOOL_SCRIPT")  # JSON list of tool-call rules
+    FAKE_LLM_TRANSCRIPT = os.getenv("FAKE_LLM_TRANSCRIPT")  # JSONL transcript to replay
+    # Record every LLM call to this JSONL file for later replay
+    LLM_TRANSCRIPT_RECORD_PATH = os.getenv("LLM_TRANSCRIPT_RECORD_PATH")
+
+    # Provider-side caching of the static system prompt
+    PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE_ENABLED", "true").lower() == "true"
+    PROMPT_CACHE_TTL_SECONDS = 3600
+    PROMPT_CACHE_REFRESH_MARGIN_SECONDS = 300
+    PROMPT_CACHE_LOG_INTERVAL_SECONDS = 300  # How often the cached-token share is logged (0 = never)
+
+    # Conversation history sent to the LLM
+    HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "6000"))
+    HISTORY_MIN_RECENT_MESSAGES = 4
+
+    # Per-session request ordering and duplicate submissions
+    SESSION_LOCK_BACKEND = os.getenv("SESSION_LOCK_BACKEND", "memory")  # or "mongo"
+    SESSION_LOCK_TIMEOUT_SECONDS = 60
+    SESSION_LOCK_LEASE_SECONDS = 180  # Must outlast the slowest turn and WRITE_BEHIND_WAIT_TIMEOUT_SECONDS
+    IDEMPOTENCY_KEY_TTL_SECONDS = 24 * 60 * 60
+
+    # Write-behind persistence: replies are returned before their turn is stored.
+    # A session's unwritten turns are only visible in the process that queued
+    # them, so with several worker processes SESSION_LOCK_BACKEND must be
+    # "mongo" (the session then stays locked until its turn is stored, after
+    # the reply was sent). The in-process lock is only correct with a single worker.
+    WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "false").lower() == "true"
+    WRITE_BEHIND_BATCH_SIZE = 200  # Turns per bulk write
+    WRITE_BEHIND_FLUSH_INTERVAL_SECONDS = 0.05  # Wait for more turns before writing
+    WRITE_BEHIND_MAX_RETRIES = 5
+    WRITE_BEHIND_RETRY_BACKOFF_SECONDS = 0.2  # Doubled on every retry
+    WRITE_BEHIND_WAIT_TIMEOUT_SECONDS = 60  # Longest a session stays locked for its queued turn
+    WRITE_BEHIND_SHUTDOWN_TIMEOUT_SECONDS = 30
+
+    # Usage reporting: USD per 1M tokens, matched by model name prefix
+    MODEL_PRICES = {
+        "gpt-4.1-mini": {"input": 0.40, "cached_input": 0.10, "output": 1.60},
+        "gemini-2.0-flash": {"input": 0.10, "cached_input": 0.025, "output": 0.40},
+        "fake": {"input": 0.0, "cached_input": 0.0, "output": 0.0},
+    }
+    ADMIN_API_KEY = os.getenv("ADMIN_API_KEY")  # Required by the /admin endpoints
+
+    # Per-turn choice between the plain chat chain and the tools agent
+    TURN_ROUTER_CLASSIFIER = os.getenv("TURN_ROUTER_CLASSIFIER", "false").lower() == "true"
+    STORY_MIN_USER_MESSAGES = 4  # Stories are only offered after this many user messages
+
     # Google Sheets
-    GOOGLE_SHEETS_ID = "your-sheet-id"
+    GOOGLE_SHEETS_ID = os.getenv("GOOGLE_SHEETS_ID", "your-sheet-id")
+    STORY_SHEET_WORKSHEET = os.getenv("STORY_SHEET_WORKSHEET")  # Defaults to the first worksheet
+    STORY_SYNC_SOURCE = os.getenv("STORY_SYNC_SOURCE")  # CSV/XLSX export to sync from instead of the sheet
 
     # Story filters
     MAX_STORIES_TO_RETURN = 5
 
+    # Story retrieval
+    STORIES_PATH = os.getenv("STORIES_PATH", os.path.join(base_dir, "data", "stories.json"))
+    STORY_INDEX_DIR = os.getenv("STORY_INDEX_DIR", os.path.join(base_dir, "data", "story_index"))
+    EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "gemini")  # "gemini", "openai" or "local"
+    GEMINI_EMBEDDING_MODEL_NAME = "models/text-embedding-004"
+    OPENAI_EMBEDDING_MODEL_NAME = "text-embedding-3-small"
+    EMBEDDING_DIMENSIONS = 256  # Vectors are shortened to this size for faster search
+    STORY_QUERY_RECENT_MESSAGES = 3  # User messages added to the tool's query
+    STORY_INDEX_POLL_SECONDS = 30  # How often servers check for a newly synced index (0 = never)
+
+
+    # Vault media storage
+    STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "gcs")  # "gcs" or "local"
+    GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME", "mirrorme-bucket")
+    STORAGE_HTTP_POOL_SIZE = 32  # Kept-alive connections to GCS
+    STORAGE_EXECUTOR_WORKERS = 32  # Threads for blocking storage calls
+    STORAGE_UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024  # Resumable upload chunk; a multiple of 256 KiB
+    VAULT_UPLOAD_CONCURRENCY = 4  # Files of one request stored at the same time
+    VAULT_UPLOAD_BUFFER_CHUNKS = 4  # 1 MiB chunks buffered per file before reading the body pauses
+    VAULT_UPLOAD_PROGRESS_TTL_SECONDS = 600  # Progress of finished uploads is kept this long
+    VAULT_PAGE_SIZE = 100  # Files per vault listing page
+    VAULT_MAX_PAGE_SIZE = 500
+    VAULT_URL_EXPIRY_MINUTES = 30  # Validity of download URLs in vault listings
+    VAULT_URL_REFRESH_MARGIN_MINUTES = 5  # Re-sign cached URLs this long before they expire
+    VAULT_URL_CACHE_SIZE = 100000
+    # Background thumbnails, video posters and audio previews of vault media
+    MEDIA_WORKER_ENABLED = os.getenv("MEDIA_WORKER_ENABLED", "true").lower() == "true"  # Run a worker in the API
+    MEDIA_WORKER_PROCESSES = int(os.getenv("MEDIA_WORKER_PROCESSES", "2"))  # Processes doing the conversions
+    MEDIA_WORKER_CONCURRENCY = 4  # Jobs in progress per worker
+    MEDIA_JOB_POLL_SECONDS = 5
+    MEDIA_JOB_LEASE_SECONDS = 600  # A job not finished in this time is taken over by another worker
+    MEDIA_JOB_MAX_ATTEMPTS = 3
+    MEDIA_JOB_RETRY_SECONDS = 60  # Multiplied by the number of attempts so far
+    THUMBNAIL_SIZE = 320
+    POSTER_SIZE = 640
+    AUDIO_PREVIEW_BITRATE = "64k"
+    FFMPEG_PATH = os.getenv("FFMPEG_PATH", "ffmpeg")
+    VAULT_UPLOAD_URL_EXPIRY_MINUTES = 60  # Validity of direct upload URLs
+    VAULT_UPLOAD_TOKEN_EXPIRY_HOURS = 24  # Time after that to complete the upload
+    VAULT_SESSION_TTL_HOURS = 24  # Resumable upload sessions without new chunks for this long are removed
+    VAULT_SESSION_MAX_PARTS = 10000  # Chunks per session; each is stored as an object until completion
+    VAULT_SESSION_COMPLETE_SECONDS = 3600  # Completion interrupted for this long (e.g. a restart) may be retried
+    VAULT_SESSION_GC_MINUTES = 60  # How often the API removes abandoned sessions (0 = never)
+    LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", os.path.join(base_dir, "data", "storage"))
+    LOCAL_STORAGE_BASE_URL = os.getenv("LOCAL_STORAGE_BASE_URL", "http://localhost:8000/storage")
+    # Signs local download URLs; set it when running several workers
+    LOCAL_STORAGE_SECRET = os.getenv("LOCAL_STORAGE_SECRET") or secrets.token_hex(32)
+
+    # Password hashing
+    BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))  # Work factor; other hashes are redone at login
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+    PASSWORD_HASH_MAX_PENDING = 32  # Hashes running or queued before sign-ins are turned away
 
     # Session settings
     SESSION_EXPIRY_DAYS = 30
@@ -0,0 +1,75 @@
+"""Remove the embedded system prompt from stored conversations.
+
+Conversations used to store the full base system prompt as their first
+message. This migration pops that message, records the hash of the removed
+text in ``prompt_version`` and shifts ``summarized_count`` so it still
+points at the same messages.
+
+    python -m backend.db.migrations.strip_system_prompt [--dry-run]
+"""
+
+import argparse
+
+from pymongo import UpdateOne
+
+from backend.db.models.conversation import Conversation
+from backend.db.mongodb import close_mongo_connection, connect_to_mongo
+from backend.prompts.system_prompts import MirrorMePrompts
+
+
+def strip_system_prompts(batch_size=500, dry_run=False):
+    """Strip the leading system message from every conversation that has one.
+
+    Returns the number of conversations updated (or that would be updated).
+    """
+    collection = Conversation._get_collection()
+    query = {"messages.0.role": "system"}
+    # Only the first message is needed to compute the prompt version
+    projection = {"messages": {"$slice": 1}, "prompt_version": 1, "summarized_count": 1}
+
+    updated = 0
+    operations = []
+    for doc in collection.find(query, projection):
+        update = {"$pop": {"messages": -1}}
+        if not doc.get("prompt_version"):
+            prompt = doc["messages"][0].get("content", "")
+            update["$set"] = {"prompt_version": MirrorMePrompts.hash_prompt(prompt)}
+        if doc.get("summarized_count"):
+            update["$inc"] = {"summarized_count": -1}
+
+        # Re-check the filter so a concurrent run cannot pop a second message
+        operations.append(UpdateOne({"_id": doc["_id"], **query}, update))
+        if len(operations) >= batch_size:
+            updated += _flush(collection, operations, dry_run)
+            operations = []
+
+    if operations:
+        updated += _flush(collection, operations, dry_run)
+    return updated
+
+
+def _flush(collection, operations, dry_run):
+    if dry_run:
+        return len(operations)
+    result = collection.bulk_write(operations, ordered=False)
+    return result.modified_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Strip embedded system prompts from conversations.")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="Count affected conversations without writing")
+    args = parser.parse_args()
+
+    if not connect_to_mongo():
+        raise SystemExit(1)
+    try:
+        count = strip_system_prompts(batch_size=args.batch_size, dry_run=args.dry_run)
+        action = "Would update" if args.dry_run else "Updated"
+        print(f"{action} {count} conversations")
+    finally:
+        close_mongo_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 from datetime import datetime, timezone
-from mongoengine import Document, EmbeddedDocument, StringField, DateTimeField, ListField, DictField, ReferenceField, EmbeddedDocumentListField
+from mongoengine import Document, EmbeddedDocument, StringField, DateTimeField, ListField, DictField, ReferenceField, EmbeddedDocumentListField, IntField
 
 class Message(EmbeddedDocument):
     """Individual message in a conversation."""
@@ -31,6 +31,11 @@ class Conversation(Document):
     
     # Conversation
     messages = EmbeddedDocumentListField(Message)
+    prompt_version = StringField()  # Version of the system prompt (see MirrorMePrompts.get_prompt_version)
+    
+    # Rolling summary of older messages that no longer fit in the LLM context
+    summary = StringField()
+    summarized_count = IntField(default=0)  # Messages already folded into the summary
     
     # Story recommendations
     recommended_story_ids = ListField(StringField())
@@ -43,17 +48,76 @@ class Conversation(Document):
         'indexes': [
             'user',
             'session_id',
-            'created_at'
+            'created_at',
+            'updated_at'
         ]
     }
     
-    def add_message(self, content, role):
+    def add_message(self, content, role, metadata=None):
         """Add a new message to the conversation."""
-        message = Message(content=content, role=role)
+        message = Message(content=content, role=role, metadata=metadata or {})
         self.messages.append(message)
         self.updated_at = datetime.now(tz=timezone.utc)
         return message
     
+    def save_new_messages(self, messages, **fields):
+        """Persist messages added with add_message without rewriting the document.
+
+        Issues a single atomic ``$push`` of the new messages together with a
+        ``$set`` of ``updated_at`` and any extra fields, so the cost of a turn
+        does not grow with the conversation and concurrent appends are kept.
+        """
+        self._get_collection().update_one(*self.new_messages_update(messages, **fields))
+    
+    def new_messages_update(self, messages, write_id=None, **fields):
+        """Return the ``(filter, update)`` that save_new_messages applies.
+
+        With a ``write_id`` the messages are tagged with it and the update
+        only matches if they are not stored yet, so it can be safely retried.
+        """
+        self.updated_at = datetime.now(tz=timezone.utc)
+        fields["updated_at"] = self.updated_at
+
+        to_set = {}
+        for name, value in fields.items():
+            field = self._fields[name]
+            to_set[field.db_field] = field.to_mongo(value) if value is not None else None
+
+        query = {"_id": self.pk}
+        if write_id:
+            for message in messages:
+                message.metadata["write_id"] = write_id
+            query["messages.metadata.write_id"] = {"$ne": write_id}
+
+        update = {
+            "$push": {"messages": {"$each": [message.to_mongo() for message in messages]}},
+            "$set": to_set,
+        }
+        self._clear_changed_fields()
+        return query, update
+    
+    def add_recommended_stories(self, story_ids):
+        """Record stories shown to the user so they are not recommended again."""
+        new_ids = [story_id for story_id in story_ids if story_id not in self.recommended_story_ids]
+        if not new_ids:
+            return
+        self.recommended_story_ids.extend(new_ids)
+        self._get_collection().update_one(
+            {"_id": self.pk}, {"$addToSet": {"recommended_story_ids": {"$each": new_ids}}}
+        )
+        self._clear_changed_fields()
+    
+    def find_reply(self, idempotency_key, lookback=20):
+        """Return the assistant reply to the user message sent with this key, if any."""
+        recent = self.messages[-lookback:]
+        for i, message in enumerate(recent):
+            if message.role == "user" and message.metadata.get("idempotency_key") == idempotency_key:
+                for reply in recent[i + 1:]:
+                    if reply.role == "assistant":
+                        return reply.content
+                return None
+        return None
+    
     def get_langchain_messages(self):
         """Return messages in a format suitable for Langchain."""
         return [msg.to_dict() for msg in self.messages]
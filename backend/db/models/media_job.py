@@ -0,0 +1,40 @@
+from datetime import datetime, timezone
+from mongoengine import Document, StringField, DateTimeField, IntField, ObjectIdField
+
+class MediaJob(Document):
+    """Pending work of the media pipeline.
+
+    One derivative of one blob of contents, or (kind "hash") hashing an
+    item registered before its contents were, to store it by content.
+    """
+    
+    content_hash = StringField()  # VaultBlob the derivative is made from and belongs to
+    item_id = ObjectIdField(required=True)  # VaultItem whose upload queued the job
+    kind = StringField(choices=["hash", "thumbnail", "poster", "audio_preview"], required=True)
+    status = StringField(choices=["pending", "running", "done", "failed"], default="pending")
+    attempts = IntField(default=0)
+    error = StringField()
+    
+    # A pending job runs once run_after has passed; a running one is taken
+    # over by another worker if its lease expires (e.g. after a restart)
+    run_after = DateTimeField(default=lambda: datetime.now(tz=timezone.utc))
+    lease_until = DateTimeField()
+    worker = StringField()
+    
+    created_at = DateTimeField(default=lambda: datetime.now(tz=timezone.utc))
+    updated_at = DateTimeField(default=lambda: datetime.now(tz=timezone.utc))
+    
+    meta = {
+        'collection': 'media_jobs',
+        'indexes': [
+            # Identical files share their derivatives, so they are made once
+            # (jobs queued before that have no hash)
+            {
+                'fields': ['content_hash', 'kind'],
+                'unique': True,
+                'partialFilterExpression': {'content_hash': {'$type': 'string'}},
+            },
+            ('status', 'run_after'),
+            ('status', 'lease_until'),
+        ]
+    }
@@ -0,0 +1,16 @@
+from mongoengine import Document, StringField, DateTimeField
+
+class SessionLock(Document):
+    """Lease held by the worker currently processing a chat session."""
+    
+    session_id = StringField(primary_key=True)
+    owner = StringField(required=True)      # Unique id of the holding worker/request
+    expires_at = DateTimeField(required=True)
+    
+    meta = {
+        'collection': 'session_locks',
+        'indexes': [
+            # Let MongoDB clean up leases left behind by crashed workers
+            {'fields': ['expires_at'], 'expireAfterSeconds': 0}
+        ]
+    }
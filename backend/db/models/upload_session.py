@@ -0,0 +1,40 @@
+from datetime import datetime, timezone
+from mongoengine import Document, StringField, DateTimeField, IntField, ObjectIdField, ListField, DictField
+
+class UploadSession(Document):
+    """A resumable vault upload; chunks received so far are stored as part objects."""
+    
+    session_id = StringField(primary_key=True)  # Random; knowing it is what lets a client resume
+    owner = StringField()
+    category = StringField(required=True)
+    filename = StringField(required=True)
+    content_type = StringField()
+    size = IntField()  # Total size declared by the client, if known
+    
+    offset = IntField(default=0)  # Bytes received so far
+    parts = ListField(DictField())  # {"name", "offset", "size"} in order
+    status = StringField(choices=["open", "completing", "done"], default="open")
+    item_id = ObjectIdField(required=True)  # VaultItem created on completion
+    
+    lease_until = DateTimeField()  # While completing
+    expires_at = DateTimeField(required=True)  # Removed after this unless more chunks arrive
+    created_at = DateTimeField(default=lambda: datetime.now(tz=timezone.utc))
+    updated_at = DateTimeField(default=lambda: datetime.now(tz=timezone.utc))
+    
+    meta = {
+        'collection': 'upload_sessions',
+        'indexes': [
+            'expires_at',
+        ]
+    }
+    
+    def to_dict(self):
+        return {
+            "session_id": self.session_id,
+            "status": self.status,
+            "filename": self.filename,
+            "category": self.category,
+            "offset": self.offset,
+            "size": self.size,
+            "expires_at": self.expires_at.isoformat(),
+        }
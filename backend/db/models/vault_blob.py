@@ -0,0 +1,32 @@
+from datetime import datetime, timezone
+from mongoengine import Document, StringField, DateTimeField, IntField, BooleanField, DictField
+
+class VaultBlob(Document):
+    """Contents stored once for every vault item with the same SHA-256."""
+    
+    content_hash = StringField(primary_key=True)  # Hex SHA-256 of the contents
+    object_name = StringField(required=True)  # Name in the storage backend
+    size = IntField()
+    content_type = StringField()  # As sent by the first uploader
+    generation = IntField()
+    ref_count = IntField(default=0)  # Vault items referring to the blob; it is deleted at zero
+    deleting = BooleanField(default=False)  # Claimed by the release deleting its object
+    # Made by the media pipeline and deleted with the blob; copied to its VaultItems
+    derivatives = DictField(default={})
+    
+    created_at = DateTimeField(default=lambda: datetime.now(tz=timezone.utc))
+    updated_at = DateTimeField(default=lambda: datetime.now(tz=timezone.utc))
+    
+    meta = {
+        'collection': 'vault_blobs',
+    }
+    
+    def describe(self):
+        """The blob's object, described like the storage backend describes objects."""
+        return {
+            "name": self.object_name,
+            "size": self.size,
+            "content_type": self.content_type,
+            "updated": self.updated_at,
+            "generation": self.generation,
+        }
@@ -0,0 +1,45 @@
+from datetime import datetime, timezone
+from mongoengine import Document, StringField, DateTimeField, IntField, DictField
+
+VAULT_CATEGORIES = ("images", "records", "videos")
+
+
+class VaultItem(Document):
+    """A file stored in a user's vault; the object itself lives in storage."""
+    
+    owner = StringField()  # Email of the uploading user, None for anonymous uploads
+    category = StringField(choices=VAULT_CATEGORIES, required=True)
+    filename = StringField(required=True)
+    object_name = StringField(required=True)  # Name in the storage backend, shared by identical files
+    
+    size = IntField()
+    content_type = StringField()
+    content_hash = StringField()  # SHA-256 of the contents, the key of its VaultBlob
+    generation = IntField()  # Storage generation, changes when the object is rewritten
+    # Smaller versions made by the media pipeline: kind -> {"object_name", "content_type", "size", "generation"},
+    # copied from the item's VaultBlob
+    derivatives = DictField(default={})
+    
+    created_at = DateTimeField(default=lambda: datetime.now(tz=timezone.utc))
+    updated_at = DateTimeField(default=lambda: datetime.now(tz=timezone.utc))
+    
+    meta = {
+        'collection': 'vault_items',
+        'indexes': [
+            # One per listing order; _id breaks ties for keyset pagination
+            {'fields': ['owner', 'category', 'created_at', '_id']},
+            {'fields': ['owner', 'category', 'filename', '_id']},
+            ('owner', 'content_hash'),
+            'content_hash',
+        ]
+    }
+    
+    def to_dict(self):
+        return {
+            "id": str(self.id),
+            "filename": self.filename,
+            "category": self.category,
+            "size": self.size,
+            "content_type": self.content_type,
+            "timestamp": self.created_at.isoformat(),
+        }
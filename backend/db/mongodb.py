@@ -1,8 +1,35 @@
 from datetime import timezone
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import asyncio
 import os
 import mongoengine
 from ..config.settings import get_settings
 
+# Dedicated pool for blocking MongoEngine calls made from async handlers
+_db_executor = None
+
+
+def get_db_executor():
+    """Return the thread pool used for MongoDB access, creating it if needed."""
+    global _db_executor
+    if _db_executor is None:
+        settings = get_settings()
+        _db_executor = ThreadPoolExecutor(
+            max_workers=settings.MONGODB_EXECUTOR_WORKERS,
+            thread_name_prefix="mongodb",
+        )
+    return _db_executor
+
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking MongoDB call in the database executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_db_executor(), partial(func, *args, **kwargs)
+    )
+
+
 def connect_to_mongo():
     """Connect to MongoDB"""
     settings = get_settings()
@@ -22,7 +49,11 @@ def connect_to_mongo():
 
 def close_mongo_connection():
     """Close MongoDB connection"""
+    global _db_executor
     try:
+        if _db_executor is not None:
+            _db_executor.shutdown(wait=True)
+            _db_executor = None
         mongoengine.disconnect()
         print("MongoDB connection closed")
         return True
@@ -1,23 +1,46 @@
-import os, json, uuid
+import os, json
+import asyncio
+import jwt
 from typing import Optional, Literal, List
-from fastapi import FastAPI, UploadFile, Form, File, Path, HTTPException, Depends
+from fastapi import FastAPI, Path, HTTPException, Depends, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from google.cloud import storage
-import shutil
-import tempfile
-from datetime import timedelta, datetime
-from pydantic import BaseModel
-from typing import Optional, List
-import uuid
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from datetime import datetime
 from mongoengine import connect, disconnect
 from backend.config.settings import get_settings
-from backend.db.mongodb import close_mongo_connection, connect_to_mongo
+from backend.db.mongodb import close_mongo_connection, connect_to_mongo, run_db
 from backend.services.chatbot_service import ChatbotService
+from backend.services.media_pipeline import close_media_worker, start_media_worker
+from backend.services.password_hashing import PasswordHasherBusyError, close_password_hasher
+from backend.services.persistence_queue import close_write_queue
+from backend.services.session_coordinator import SessionBusyError
+from backend.services.storage import LocalStorage, close_storage, get_signed_url_cache, get_storage
+from backend.services.story_index import get_story_retriever
+from backend.services.story_sync import sync_stories
+from backend.services.upload_sessions import (
+    OffsetMismatchError,
+    SessionNotFoundError,
+    collect_expired_sessions,
+    complete_session,
+    create_session,
+    get_session,
+    write_chunk,
+)
+from backend.services.usage_report import usage_report
+from backend.services.vault_index import InvalidCursorError, list_items
+from backend.services.vault_uploads import (
+    UploadError,
+    complete_direct_uploads,
+    create_direct_uploads,
+    get_upload_progress,
+    receive_vault_upload,
+    store_stream,
+)
 
 from backend.db.models.user_model import UserRegister, UserLogin
 from backend.services.authentication_service import register_user, login_user
-from google.oauth2 import service_account
+from backend.utils.jwt_handler import decode_token, get_secret_key
 
 
 
@@ -36,14 +59,89 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def check_token_secret():
+    # Fail now rather than on the first sign-in
+    get_secret_key()
+
+
 # Connect to MongoDB
 @app.on_event("startup")
 async def startup_db_client():
     connect_to_mongo()
 
 
+@app.on_event("startup")
+async def load_story_index():
+    # Embed or load the stories before the first request needs them
+    try:
+        await asyncio.to_thread(get_story_retriever().get_index)
+    except Exception as e:
+        print(f"Error loading story index: {e}")
+
+
+@app.on_event("startup")
+async def create_storage_client():
+    # Read credentials and open the connection pool once, not per request
+    try:
+        await asyncio.to_thread(get_storage)
+    except Exception as e:
+        print(f"Error creating storage client: {e}")
+
+
+@app.on_event("startup")
+async def start_media_pipeline():
+    if settings.MEDIA_WORKER_ENABLED:
+        start_media_worker()
+
+
+async def poll_story_index():
+    # Serve stories published by a sync job without restarting
+    retriever = get_story_retriever()
+    while True:
+        await asyncio.sleep(settings.STORY_INDEX_POLL_SECONDS)
+        try:
+            if await asyncio.to_thread(retriever.reload_if_changed):
+                print("Loaded the newly synced story index")
+        except Exception as e:
+            print(f"Error reloading story index: {e}")
+
+
+@app.on_event("startup")
+async def start_story_index_polling():
+    if settings.STORY_INDEX_POLL_SECONDS > 0:
+        app.state.story_index_poller = asyncio.create_task(poll_story_index())
+
+
+async def collect_upload_sessions():
+    # Remove resumable uploads that were abandoned, with their stored chunks
+    while True:
+        await asyncio.sleep(settings.VAULT_SESSION_GC_MINUTES * 60)
+        try:
+            removed = await asyncio.to_thread(collect_expired_sessions)
+            if removed:
+                print(f"Removed {removed} abandoned upload sessions")
+        except Exception as e:
+            print(f"Error removing upload sessions: {e}")
+
+
+@app.on_event("startup")
+async def start_upload_session_gc():
+    if settings.VAULT_SESSION_GC_MINUTES > 0:
+        app.state.upload_session_gc = asyncio.create_task(collect_upload_sessions())
+
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    # Write out queued turns while the connection is still open
+    await close_write_queue()
+    for name in ("story_index_poller", "upload_session_gc"):
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+    await close_media_worker()
+    close_password_hasher()
+    close_storage()
     close_mongo_connection()
 
 
@@ -57,6 +155,9 @@ class MessageRequest(BaseModel):
     session_id: Optional[str] = None
     entry_source: Optional[str] = None
     entry_statement: Optional[str] = None
+    # Lets a retried submission get the original reply; may also be sent
+    # as an Idempotency-Key header
+    idempotency_key: Optional[str] = None
 
 
 class MessageResponse(BaseModel):
@@ -65,6 +166,28 @@ class MessageResponse(BaseModel):
     is_new: bool
 
 
+class DirectUploadFile(BaseModel):
+    filename: str
+    content_type: Optional[str] = None
+    sha256: Optional[str] = Field(default=None, pattern="^[0-9a-fA-F]{64}$")  # Lets known files skip the upload
+
+
+class DirectUploadRequest(BaseModel):
+    category: Literal["images", "records", "videos"]
+    files: List[DirectUploadFile]
+
+
+class CompleteUploadRequest(BaseModel):
+    upload_tokens: List[str]
+
+
+class UploadSessionRequest(BaseModel):
+    category: Literal["images", "records", "videos"]
+    filename: str
+    content_type: Optional[str] = None
+    size: Optional[int] = None  # Total bytes, if known; completion then checks it
+
+
 class ConversationSummary(BaseModel):
     id: str
     session_id: str
@@ -79,28 +202,65 @@ async def root():
 
 
 @app.post("/chat", response_model=MessageResponse)
-async def chat(request: MessageRequest):
+async def chat(
+    request: MessageRequest, idempotency_key: Optional[str] = Header(default=None)
+):
     """Process a user message and return a response."""
     try:
         # Process the message
-        response = chatbot_service.process_message(
+        response = await chatbot_service.process_message(
             session_id=request.session_id,
             user_message=request.message,
             entry_source=request.entry_source,
             entry_statement=request.entry_statement,
+            idempotency_key=request.idempotency_key or idempotency_key,
         )
 
         return response
+    except SessionBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         print(f"Error processing message: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def format_sse(event, data):
+    """Format an event as a Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream(
+    request: MessageRequest, idempotency_key: Optional[str] = Header(default=None)
+):
+    """Process a user message and stream the response as Server-Sent Events."""
+
+    async def event_stream():
+        try:
+            async for event in chatbot_service.stream_message(
+                session_id=request.session_id,
+                user_message=request.message,
+                entry_source=request.entry_source,
+                entry_statement=request.entry_statement,
+                idempotency_key=request.idempotency_key or idempotency_key,
+            ):
+                yield format_sse(event["event"], event["data"])
+        except Exception as e:
+            print(f"Error streaming message: {e}")
+            yield format_sse("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/conversations", response_model=List[ConversationSummary])
 async def get_conversations(limit: int = 10):
     """Get a list of recent conversations."""
     try:
-        conversations = chatbot_service.get_recent_conversations(limit=limit)
+        conversations = await chatbot_service.get_recent_conversations(limit=limit)
 
         result = []
         for conv in conversations:
@@ -134,10 +294,16 @@ async def get_conversation(conversation_id: str):
     try:
         from backend.db.models.conversation import Conversation
 
-        conversation = Conversation.objects(id=conversation_id).first()
+        conversation = await run_db(Conversation.objects(id=conversation_id).first)
         if not conversation:
             raise HTTPException(status_code=404, detail="Conversation not found")
 
+        # Include turns still waiting in the write-behind queue
+        if chatbot_service.write_queue is not None:
+            conversation = (
+                chatbot_service.write_queue.get_conversation(conversation.session_id) or conversation
+            )
+
         messages = []
         for msg in conversation.messages:
             messages.append(
@@ -157,6 +323,53 @@ async def get_conversation(conversation_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/admin/usage")
+async def get_usage(
+    days: int = 7,
+    group_by: str = "day,model,entry_source",
+    x_admin_key: Optional[str] = Header(default=None),
+):
+    """LLM cost and latency per group of turns, from the per-turn metrics."""
+    settings = get_settings()
+    if not settings.ADMIN_API_KEY or x_admin_key != settings.ADMIN_API_KEY:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    fields = tuple(field.strip() for field in group_by.split(",") if field.strip())
+    try:
+        return await run_db(usage_report, days=days, group_by=fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/admin/routing")
+async def get_routing_stats(x_admin_key: Optional[str] = Header(default=None)):
+    """How often turns took the plain chat path or the tools agent since startup."""
+    settings = get_settings()
+    if not settings.ADMIN_API_KEY or x_admin_key != settings.ADMIN_API_KEY:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return chatbot_service.turn_router.get_stats()
+
+
+@app.get("/admin/prompt-cache")
+async def get_prompt_cache_stats(x_admin_key: Optional[str] = Header(default=None)):
+    """Prompt cache entries created and input tokens served from the cache since startup."""
+    settings = get_settings()
+    if not settings.ADMIN_API_KEY or x_admin_key != settings.ADMIN_API_KEY:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return chatbot_service.get_prompt_cache_stats()
+
+
+@app.post("/admin/stories/sync")
+async def sync_story_corpus(x_admin_key: Optional[str] = Header(default=None)):
+    """Pull the story sheet and serve the updated stories; only changed rows are re-embedded."""
+    settings = get_settings()
+    if not settings.ADMIN_API_KEY or x_admin_key != settings.ADMIN_API_KEY:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    try:
+        return await asyncio.to_thread(sync_stories)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
@@ -164,103 +377,223 @@ async def health_check():
     return {"status": "healthy", "timestamp": datetime.now()}
 
 
-def upload_to_gcs(bucket_name, file_path, destination_blob_name):
-    settings = get_settings()
-
-    # Create credentials object from the file
-    credentials = service_account.Credentials.from_service_account_file(
-        settings.GOOGLE_APPLICATION_CREDENTIALS
-    )
-
-    gcs_client = storage.Client(credentials=credentials)
-    bucket = gcs_client.bucket(bucket_name)
-    blob = bucket.blob(destination_blob_name)
-    blob.upload_from_filename(file_path)
-    print(f"Uploaded to gs://{bucket_name}/{destination_blob_name}")
+def get_current_user_email(authorization: Optional[str] = Header(default=None)):
+    """Email of the signed-in user from a Bearer token; anonymous requests get a 401."""
+    challenge = {"WWW-Authenticate": "Bearer"}
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers=challenge)
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="Invalid authorization header", headers=challenge)
+    try:
+        return decode_token(token)["sub"]
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="Invalid or expired token", headers=challenge)
 
 
 @app.post("/vault/items")
 async def vault_items(
-    files: List[UploadFile] = File(...),
-    category: Literal["images", "records", "videos"] = Form(...),
+    request: Request,
+    category: Optional[Literal["images", "records", "videos"]] = Query(default=None),
+    upload_id: Optional[str] = Query(default=None),
+    owner: str = Depends(get_current_user_email),
 ):
-    uploaded_files = []
+    """Upload files (multipart fields "files" and "category").
 
-    for file in files:
-        # 1. Save to temp
-        temp_path = os.path.join(tempfile.gettempdir(), file.filename)
+    The body is streamed to storage as it arrives. Sending the category as
+    a query parameter (or before the files) stores them directly; with an
+    upload_id, progress can be followed at /vault/uploads/{upload_id}.
+    """
+    try:
+        files = await receive_vault_upload(request, category=category, upload_id=upload_id, owner=owner)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+    failed = sum(1 for file in files if file["status"] == "failed")
+    status = "uploaded" if not failed else "failed" if failed == len(files) else "partial"
+    return {"status": status, "files": files}
 
-        # 2. Upload to GCS
-        upload_to_gcs(
-            bucket_name="mirrorme-bucket",
-            file_path=temp_path,
-            destination_blob_name=f"uploads/{category}/{file.filename}",
-        )
 
-        # 3. Delete temp file
-        os.remove(temp_path)
+@app.post("/vault/uploads")
+async def create_vault_uploads(
+    data: DirectUploadRequest, owner: str = Depends(get_current_user_email)
+):
+    """Issue URLs for uploading files straight to storage.
 
-        # 4. Append result
-        uploaded_files.append({"filename": file.filename, "category": category})
+    The client sends each "pending" file to its ``url`` with the given
+    ``method`` and ``headers``, then passes the ``upload_token``s to
+    /vault/uploads/complete. Files sent with the ``sha256`` of contents the
+    user already has in the vault come back "uploaded" without a URL.
+    """
+    files = [file.model_dump() for file in data.files]
+    uploads = await create_direct_uploads(data.category, files, owner)
+    return {"category": data.category, "uploads": uploads}
 
-    return {"status": "uploaded", "files": uploaded_files}
 
+@app.post("/vault/uploads/complete")
+async def complete_vault_uploads(
+    data: CompleteUploadRequest, owner: str = Depends(get_current_user_email)
+):
+    """Add files uploaded through /vault/uploads URLs to the vault."""
+    files = await complete_direct_uploads(data.upload_tokens, owner)
+    failed = sum(1 for file in files if file["status"] == "failed")
+    status = "uploaded" if not failed else "failed" if failed == len(files) else "partial"
+    return {"status": status, "files": files}
 
-@app.get("/vault/{category}")
-async def get_files_by_category(
-    category: Literal["images", "records", "videos"] = Path(...),
+
+@app.post("/vault/sessions")
+async def create_upload_session(
+    data: UploadSessionRequest, owner: str = Depends(get_current_user_email)
 ):
-    settings = get_settings()
+    """Start a resumable upload.
 
-    # Create credentials object from the file
-    credentials = service_account.Credentials.from_service_account_file(
-        settings.GOOGLE_APPLICATION_CREDENTIALS
-    )
+    Send the file in chunks with PUT /vault/sessions/{session_id}?offset=N
+    (raw bytes in the body). After a dropped connection, GET the session
+    for the offset to continue from. Complete it with
+    POST /vault/sessions/{session_id}/complete.
+    """
+    try:
+        session = await run_db(create_session, owner, data.category, data.filename, data.content_type, data.size)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return session.to_dict()
 
-    bucket_name = "mirrorme-bucket"
-    folder_path = f"uploads/{category}/"
 
-    gcs_client = storage.Client(credentials=credentials)
-    bucket = gcs_client.bucket(bucket_name)
+@app.get("/vault/sessions/{session_id}")
+async def upload_session_status(session_id: str, owner: str = Depends(get_current_user_email)):
+    """Bytes received so far by a resumable upload."""
+    try:
+        session = await run_db(get_session, session_id, owner)
+    except SessionNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return session.to_dict()
+
+
+@app.put("/vault/sessions/{session_id}")
+async def put_upload_chunk(
+    session_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    owner: str = Depends(get_current_user_email),
+):
+    """Append the request body to a resumable upload at ``offset``."""
+    try:
+        new_offset = await write_chunk(session_id, owner, offset, request.stream())
+    except SessionNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except OffsetMismatchError as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "offset": e.offset})
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"session_id": session_id, "offset": new_offset}
 
-    blobs = bucket.list_blobs(prefix=folder_path)
-    file_list = []
 
-    for blob in blobs:
-        if blob.name.endswith("/"):
-            continue
+@app.post("/vault/sessions/{session_id}/complete")
+async def complete_upload_session(session_id: str, owner: str = Depends(get_current_user_email)):
+    """Add a fully received resumable upload to the vault."""
+    try:
+        item = await complete_session(session_id, owner)
+    except SessionNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "uploaded", **item.to_dict()}
+
 
-        signed_url = blob.generate_signed_url(
-            expiration=timedelta(minutes=30), method="GET"
-        )
+@app.get("/vault/uploads/{upload_id}")
+async def vault_upload_progress(upload_id: str, owner: str = Depends(get_current_user_email)):
+    """Bytes received and stored so far for each file of an upload."""
+    progress = get_upload_progress(upload_id, owner)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return progress
 
-        file_list.append(
-            {
-                "filename": blob.name.split("/")[-1],
-                "url": signed_url,
-                "timestamp": blob.updated.isoformat(),  # ISO 8601 string
-            }
-        )
 
-    return {"category": category, "files": file_list}
+@app.get("/vault/{category}")
+async def get_files_by_category(
+    category: Literal["images", "records", "videos"] = Path(...),
+    sort: Literal["newest", "oldest", "name"] = "newest",
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    owner: str = Depends(get_current_user_email),
+):
+    """A page of the user's files in a category; pass ``next_cursor`` back for the next one."""
+    try:
+        items, next_cursor = await run_db(list_items, owner, category, sort=sort, limit=limit, cursor=cursor)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # URLs signed for earlier listings are reused while they stay valid
+    objects = [{"name": item.object_name, "generation": item.generation} for item in items]
+    derivatives = [
+        (position, kind, {"name": derivative["object_name"], "generation": derivative["generation"]})
+        for position, item in enumerate(items)
+        for kind, derivative in (item.derivatives or {}).items()
+    ]
+    urls = await get_signed_url_cache().sign_all(objects + [obj for _, _, obj in derivatives])
+
+    file_list = []
+    for item, signed_url in zip(items, urls):
+        file_list.append({**item.to_dict(), "url": signed_url, "derivatives": {}})  # timestamp is ISO 8601
+    # Thumbnails, posters and previews, once the media pipeline has made them
+    for (position, kind, _), signed_url in zip(derivatives, urls[len(objects):]):
+        file_list[position]["derivatives"][kind] = signed_url
+
+    return {"category": category, "files": file_list, "next_cursor": next_cursor}
+
+
+def get_local_storage(name, expires, signature, method):
+    """The local storage backend, if this signed URL for it is valid."""
+    storage = get_storage()
+    if not isinstance(storage, LocalStorage):
+        raise HTTPException(status_code=404, detail="Not found")
+    if not storage.verify_signature(name, expires, signature, method=method):
+        raise HTTPException(status_code=403, detail="Invalid or expired signature")
+    return storage
+
+
+@app.put("/storage/{name:path}")
+async def put_stored_file(name: str, expires: int, signature: str, request: Request):
+    """Upload an object through a signed URL of the local storage backend."""
+    get_local_storage(name, expires, signature, "PUT")
+    content_type = request.headers.get("content-type")
+    try:
+        item = await store_stream(name, content_type, request.stream())
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Not found")
+    return {"name": item["name"], "size": item["size"]}
+
+
+@app.get("/storage/{name:path}")
+async def get_stored_file(name: str, expires: int, signature: str):
+    """Download an object through a signed URL of the local storage backend."""
+    storage = get_local_storage(name, expires, signature, "GET")
+    try:
+        path = storage.path(name)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Not found")
+    return FileResponse(path)
 
 
 @app.post("/register")
 async def register(data: UserRegister):
     try:
-        token = register_user(data.email, data.password)
+        token = await register_user(data.email, data.password)
         return {"token": token}
+    except PasswordHasherBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/login")
 async def login(data: UserLogin):
     try:
-        token = login_user(data.email, data.password)
+        token = await login_user(data.email, data.password)
         return {"token": token}
+    except PasswordHasherBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=401, detail=str(e))
 
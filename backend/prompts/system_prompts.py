@@ -1,3 +1,12 @@
+import hashlib
+from functools import lru_cache
+
+
+@lru_cache(maxsize=8)
+def _hash_prompt(prompt):
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+
+
 class MirrorMePrompts:
     """Prompts for the MirrorMe chatbot."""
     
@@ -249,6 +258,7 @@ class MirrorMePrompts:
 #### תהליך השימוש
 - לאחר הקריאה לכלי, המערכת תציע אפשרויות שונות של סיפורים
 - בחר את הסיפור המתאים ביותר בהתבסס על תוכן השיחה ועל הנושאים שעלו
+- קרא לכלי mark_story_shared עם המזהה (id) של הסיפור שבחרת, כדי שלא יוצע שוב
 - חשוב: שלח אך ורק את הסיפור שמגיע מתוך תשובת הכלי ולא מהדוגמאות שבתסריטי השיחה
 - אחרי שיתוף הסיפור, שאל באופן טבעי: "זה מהדהד אצלך? משהו בסיפור מתחבר אליך?"
 
@@ -345,6 +355,37 @@ class MirrorMePrompts:
     SUPPORT_PROMPT = """Thank you for sharing and reflecting with me today. Remember that your feelings and experiences are valid. 
     Everyone deserves to feel safe, respected, and valued in their relationships. Would it be helpful to explore some resources or speak more about any particular aspect of what we've discussed?"""
 
+    # For folding older turns into the running conversation summary
+    HISTORY_SUMMARY_PROMPT = """You maintain a running summary of a supportive conversation between a user and the MirrorMe assistant.
+Update the existing summary with the new lines below. Keep every detail the assistant will need later: what the user shared about her relationship, her feelings, names and events she mentioned, stories already offered, and anything she asked not to discuss.
+Write the summary in the language of the conversation, in at most a few short paragraphs, and return only the updated summary.
+
+Existing summary:
+{summary}
+
+New lines:
+{new_lines}"""
+
+    # Label for the summary when it is passed back to the model
+    HISTORY_SUMMARY_PREFIX = "סיכום של החלק המוקדם יותר בשיחה:"
+
+    # Classifier for turns the routing rules cannot decide (see TurnRouter)
+    TOOL_ROUTER_PROMPT = """The MirrorMe assistant can use tools to register or log in a user and to fetch a story written by another woman (only after the user explicitly agreed to hear one).
+Given the assistant's last message and the user's reply, answer "yes" if answering the reply requires one of these tools and "no" if a plain conversational reply is enough. Answer with a single word.
+
+Assistant: {last_assistant}
+User: {user_message}"""
+
+    @classmethod
+    def get_prompt_version(cls):
+        """Return a short hash identifying the current base system prompt."""
+        return cls.hash_prompt(cls.BASE_SYSTEM_PROMPT)
+
+    @staticmethod
+    def hash_prompt(prompt):
+        """Return the version identifier for a system prompt text."""
+        return _hash_prompt(prompt)
+
     @staticmethod
     def get_entry_prompt(entry_source, entry_statement=None):
         """Get the appropriate entry prompt based on source."""
@@ -1,18 +1,17 @@
-from passlib.context import CryptContext
 from backend.db.models.user_doc import User
+from backend.db.mongodb import run_db
+from backend.services.password_hashing import get_password_hasher
 from backend.utils.jwt_handler import create_token
 from mongoengine.errors import NotUniqueError
 from datetime import datetime, timezone
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-def register_user(email: str, password: str):
+async def register_user(email: str, password: str):
     email = email.lower()
-    if User.objects(email=email).first():
+    if await run_db(User.objects(email=email).first):
         raise Exception("User already exists")
 
     tokened = create_token(email)
-    hashed_password = pwd_context.hash(password)
+    hashed_password = await get_password_hasher().hash(password)
     user = User(
         email=email,
         token=tokened,
@@ -22,18 +21,27 @@ def register_user(email: str, password: str):
         is_verified=False
     )
     try:
-        user.save()
+        await run_db(user.save)
     except NotUniqueError:
         raise Exception("Email already in use")
 
     return create_token(email)
 
-def login_user(email: str, password: str):
+async def login_user(email: str, password: str):
     email = email.lower()
-    user = User.objects(email=email).first()
-    if not user or not pwd_context.verify(password, user.hashed_password):
+    user = await run_db(User.objects(email=email).first)
+    if not user:
+        raise Exception("Invalid credentials")
+    valid, new_hash = await get_password_hasher().verify_and_update(password, user.hashed_password)
+    if not valid:
         raise Exception("Invalid credentials")
-    else:
-        user.token = create_token(email)
-    
+    if new_hash:
+        # The work factor changed since this password was hashed
+        await run_db(
+            User.objects(id=user.id).update_one,
+            set__hashed_password=new_hash,
+            set__updated_at=datetime.now(tz=timezone.utc),
+        )
+    user.token = create_token(email)
+
     return create_token(email)
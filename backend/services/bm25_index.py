@@ -0,0 +1,126 @@
+import json
+import os
+from collections import Counter
+
+import numpy as np
+
+from backend.services.hebrew_text import analyze
+
+
+class BM25Index:
+    """Inverted index with BM25 scoring over Hebrew-normalized terms.
+
+    Postings are kept in flat arrays (CSR layout): the documents and term
+    frequencies of term ``t`` are ``docs[offsets[t]:offsets[t + 1]]`` and
+    ``freqs[...]``. Saved as ``.npy`` files, they are memory-mapped on load,
+    so opening even a large index is instant and its pages are shared
+    between worker processes.
+    """
+
+    def __init__(self, doc_ids, vocabulary, offsets, docs, freqs, doc_lengths, k1=1.5, b=0.75):
+        self.doc_ids = doc_ids
+        self.vocabulary = vocabulary  # term -> term id
+        self.offsets = offsets
+        self.docs = docs
+        self.freqs = freqs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self._rows = {doc_id: row for row, doc_id in enumerate(doc_ids)}
+
+        # Per-term and per-document constants of the BM25 formula
+        n = len(doc_ids)
+        doc_freqs = np.diff(offsets).astype(np.float32)
+        self.idf = np.log1p((n - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+        average_length = float(doc_lengths.mean()) if n else 0.0
+        self._length_norm = (
+            k1 * (1 - b + b * doc_lengths / average_length) if average_length else np.full(n, k1, np.float32)
+        ).astype(np.float32)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    @classmethod
+    def build(cls, doc_ids, texts, **kwargs):
+        """Index ``texts`` (one per id in ``doc_ids``)."""
+        vocabulary = {}
+        postings = []  # term id -> [(row, frequency)]
+        doc_lengths = np.zeros(len(doc_ids), dtype=np.float32)
+        for row, text in enumerate(texts):
+            terms = Counter(analyze(text))
+            doc_lengths[row] = sum(terms.values())
+            for term, frequency in terms.items():
+                term_id = vocabulary.setdefault(term, len(vocabulary))
+                if term_id == len(postings):
+                    postings.append([])
+                postings[term_id].append((row, frequency))
+
+        offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(entries) for entries in postings])
+        docs = np.fromiter((row for entries in postings for row, _ in entries), dtype=np.int32, count=offsets[-1])
+        freqs = np.fromiter(
+            (min(frequency, 65535) for entries in postings for _, frequency in entries),
+            dtype=np.uint16,
+            count=offsets[-1],
+        )
+        return cls(list(doc_ids), vocabulary, offsets, docs, freqs, doc_lengths, **kwargs)
+
+    def search(self, text, k, exclude_ids=()):
+        """Return up to ``k`` ``(doc_id, score)`` pairs with a positive score, best first."""
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+        for term, count in Counter(analyze(text)).items():
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            rows = self.docs[start:end]
+            tf = self.freqs[start:end].astype(np.float32)
+            # Each document appears once per term, so plain fancy-index += is safe
+            scores[rows] += count * self.idf[term_id] * tf * (self.k1 + 1) / (tf + self._length_norm[rows])
+
+        for doc_id in exclude_ids:
+            row = self._rows.get(doc_id)
+            if row is not None:
+                scores[row] = 0
+
+        matched = np.flatnonzero(scores > 0)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched])]
+        return [(self.doc_ids[row], float(scores[row])) for row in matched]
+
+    def save(self, directory):
+        """Write the index to ``directory``."""
+        os.makedirs(directory, exist_ok=True)
+        for name in ("offsets", "docs", "freqs", "doc_lengths"):
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        # Terms in id order; ids are implied by position
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        meta = {"doc_ids": self.doc_ids, "terms": terms, "k1": self.k1, "b": self.b}
+        with open(os.path.join(directory, "index.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory):
+        """Load a saved index with its postings memory-mapped."""
+        with open(os.path.join(directory, "index.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            for name in ("offsets", "docs", "freqs", "doc_lengths")
+        }
+        vocabulary = {term: term_id for term_id, term in enumerate(meta["terms"])}
+        return cls(meta["doc_ids"], vocabulary, k1=meta["k1"], b=meta["b"], **arrays)
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse ranked lists of ids into one, by ``sum(1 / (k + rank))`` per id.
+
+    Only ranks are used, so signals with incomparable scores (cosine
+    similarity, BM25) can be combined without calibration.
+    """
+    scores = Counter()
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += 1.0 / (k + rank)
+    return scores.most_common()
@@ -1,4 +1,3 @@
-from langchain.chains import LLMChain
 from langchain.prompts import (
     ChatPromptTemplate,
     MessagesPlaceholder,
@@ -7,14 +6,28 @@ from langchain.prompts import (
 )
 from langchain_openai import ChatOpenAI
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.schema import SystemMessage, HumanMessage, AIMessage
 from langchain.agents import AgentExecutor, create_openai_tools_agent
+from cachetools import TTLCache
+from contextlib import AsyncExitStack
 from uuid import uuid4
+import asyncio
+import threading
+import time
 
 from backend.config.settings import get_settings
 from backend.prompts.system_prompts import MirrorMePrompts
 from backend.db.models.conversation import Conversation
-
+from backend.db.mongodb import run_db
+
+from backend.services.fake_llm import FakeChatModel, TranscriptRecorder
+from backend.services.history_manager import ConversationHistoryManager
+from backend.services.model_router import HedgedChatModel
+from backend.services.persistence_queue import get_write_queue
+from backend.services.prompt_cache import PromptCachingChatModel, get_prompt_cache
+from backend.services.session_coordinator import get_session_locks, TurnResultCache
+from backend.services.turn_metrics import AGENT_TAG, TurnMetrics
+from backend.services.turn_router import AGENT, TurnRouter
+from backend.tools.story_tools import current_conversation
 from backend.tools.tool_registry import get_available_tools
 
 
@@ -28,21 +41,157 @@ class ChatbotService:
         self.llm = self._get_llm()
         # Get tools from registry
         self.tools = get_available_tools()
+        self.history_manager = ConversationHistoryManager(self.prompts)
+        self.turn_router = TurnRouter()
+
+        # Per-session ordering and replies for duplicate submissions
+        self.session_locks = get_session_locks()
+        self.turn_results = TurnResultCache()
+        # Background persistence of turns (None unless WRITE_BEHIND_ENABLED)
+        self.write_queue = get_write_queue()
+
+        # Compiled prompts, chains and agent executors, keyed by
+        # (model, tool set, prompt version) and reused across requests
+        self._compiled = {}
+        self._compile_lock = threading.Lock()
+
+        # Duration of each session's last turn write, stored with its next turn
+        self._write_times = TTLCache(maxsize=10000, ttl=3600)
+        # Session locks held in the background until queued turns are stored
+        self._background_tasks = set()
+
+    def reload(self, llm=None, tools=None, prompts=None):
+        """Swap in a new model, tool set or prompts.
+
+        The replacement chains are compiled before being swapped in, so
+        requests already in flight finish on the old ones and new requests
+        never see a partially built set.
+        """
+        llm = llm or self.llm
+        tools = tools if tools is not None else self.tools
+        prompts = prompts or self.prompts
+
+        key = self._compile_key(llm, tools, prompts)
+        compiled = {key: self._compile(llm, tools, prompts)}
+
+        with self._compile_lock:
+            self.llm, self.tools, self.prompts = llm, tools, prompts
+            self.history_manager.prompts = prompts
+            self._compiled = compiled
+
+    def _compile_key(self, llm, tools, prompts):
+        """Identify a compiled set by model instance, tool names and prompt version."""
+        return (id(llm), tuple(tool.name for tool in tools), prompts.get_prompt_version())
+
+    def _compile(self, llm, tools, prompts):
+        """Build the chat chain and agent executor for a model, tool set and prompts."""
+        chat_prompt = ChatPromptTemplate.from_messages(
+            [
+                SystemMessagePromptTemplate.from_template(prompts.BASE_SYSTEM_PROMPT),
+                MessagesPlaceholder(variable_name="chat_history"),
+                HumanMessagePromptTemplate.from_template("{input}"),
+            ]
+        )
+
+        # Create the prompt template for the agent
+        agent_prompt = ChatPromptTemplate.from_messages(
+            [
+                SystemMessagePromptTemplate.from_template(prompts.BASE_SYSTEM_PROMPT),
+                MessagesPlaceholder(variable_name="chat_history"),
+                HumanMessagePromptTemplate.from_template("{input}"),
+                MessagesPlaceholder(variable_name="agent_scratchpad"),
+            ]
+        )
+
+        # Create the agent; this converts the tool schemas once
+        agent = create_openai_tools_agent(llm=llm, tools=tools, prompt=agent_prompt)
+
+        return {
+            "chat_chain": chat_prompt | llm,
+            "summary_chain": ChatPromptTemplate.from_template(
+                prompts.HISTORY_SUMMARY_PROMPT
+            )
+            | llm,
+            "router_classifier": TurnRouter.build_classifier(llm, prompts),
+            "agent_executor": AgentExecutor(
+                agent=agent, tools=tools, verbose=True, handle_parsing_errors=True
+            ),
+        }
+
+    def _get_compiled(self):
+        """Return the compiled chains for the current model, tools and prompts."""
+        llm, tools, prompts = self.llm, self.tools, self.prompts
+        key = self._compile_key(llm, tools, prompts)
+
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            with self._compile_lock:
+                compiled = self._compiled.get(key)
+                if compiled is None:
+                    compiled = self._compile(llm, tools, prompts)
+                    self._compiled = {**self._compiled, key: compiled}
+        return compiled
 
     def _get_llm(self):
-        """Get the appropriate LLM based on settings."""
-        if self.settings.DEFAULT_MODEL == "openai":
-            return ChatOpenAI(
+        """Get the appropriate LLM based on settings.
+
+        With a FALLBACK_MODEL configured, requests are routed between the two
+        providers with hedging and failover (see HedgedChatModel).
+        """
+        primary = self._build_llm(self.settings.DEFAULT_MODEL)
+        fallback = self.settings.FALLBACK_MODEL
+        if not fallback or fallback == self.settings.DEFAULT_MODEL:
+            return primary
+        return HedgedChatModel.from_settings(
+            providers=[primary, self._build_llm(fallback)],
+            names=[self.settings.DEFAULT_MODEL, fallback],
+        )
+
+    def _build_llm(self, provider):
+        """Create the chat model for one provider.
+
+        The model is wrapped so the static system prompt can be served from
+        the provider's prompt cache.
+        """
+        if provider == "openai":
+            llm = ChatOpenAI(
                 model=self.settings.OPENAI_MODEL_NAME,
                 openai_api_key=self.settings.OPENAI_API_KEY,
                 temperature=0.7,
+                stream_usage=True,
             )
+            cache = get_prompt_cache("openai", self.settings.OPENAI_MODEL_NAME)
+        elif provider == "fake":  # Offline runs and load tests
+            llm = FakeChatModel.from_settings()
+            cache = get_prompt_cache("fake", llm.model_name)
         else:  # Gemini
-            return ChatGoogleGenerativeAI(
+            llm = ChatGoogleGenerativeAI(
                 model=self.settings.GEMINI_MODEL_NAME,
                 google_api_key=self.settings.GEMINI_API_KEY,
                 temperature=0.7,
             )
+            cache = get_prompt_cache(
+                "gemini", self.settings.GEMINI_MODEL_NAME, self.settings.GEMINI_API_KEY
+            )
+
+        # Capture real traffic for later replay by the fake model
+        callbacks = None
+        if self.settings.LLM_TRANSCRIPT_RECORD_PATH:
+            callbacks = [TranscriptRecorder(self.settings.LLM_TRANSCRIPT_RECORD_PATH)]
+
+        return PromptCachingChatModel(inner=llm, prompt_cache=cache, callbacks=callbacks)
+
+    def get_prompt_cache_stats(self):
+        """Prompt cache counters of each model provider since startup."""
+        if isinstance(self.llm, HedgedChatModel):
+            models = zip(self.llm.names, self.llm.providers)
+        else:
+            models = [(self.settings.DEFAULT_MODEL, self.llm)]
+        return {
+            name: model.prompt_cache.get_stats()
+            for name, model in models
+            if isinstance(model, PromptCachingChatModel) and model.prompt_cache is not None
+        }
 
     def create_or_continue_conversation(
         self, session_id=None, user=None, entry_source="direct", entry_statement=None
@@ -63,11 +212,11 @@ class ChatbotService:
             user=user,
             entry_source=entry_source,
             entry_statement=entry_statement,
+            # The system prompt is injected by the prompt template on every
+            # turn, so only a reference to its version is stored
+            prompt_version=self.prompts.get_prompt_version(),
         )
 
-        # Add system prompt as the first message
-        conversation.add_message(self.prompts.BASE_SYSTEM_PROMPT, "system")
-
         # If from an ad, add specific entry prompt
         if entry_source == "ad" and entry_statement:
             entry_prompt = self.prompts.get_entry_prompt(entry_source, entry_statement)
@@ -80,124 +229,310 @@ class ChatbotService:
         conversation.save()
         return conversation, True
 
-    def process_message(
+    async def process_message(
         self,
         session_id,
         user_message,
         user=None,
         entry_source=None,
         entry_statement=None,
+        idempotency_key=None,
     ):
-        """Process a user message and generate a response."""
-        # Get or create conversation
-        conversation, is_new = self.create_or_continue_conversation(
-            session_id, user, entry_source, entry_statement
-        )
+        """Process a user message and generate a response.
+
+        Turns for the same session are processed one at a time. A repeated
+        submission (same idempotency key, or the same message sent again
+        while the first is still being answered) returns the original reply
+        instead of calling the LLM again.
+        """
+        turn_key = self.turn_results.make_key(session_id, user_message, idempotency_key)
+        cached = await self.turn_results.reply_to(turn_key)
+        if cached is not None:
+            return {"session_id": session_id, "response": cached, "is_new": False}
+
+        async with self.turn_results.running(turn_key), AsyncExitStack() as session_lock:
+            await session_lock.enter_async_context(self.session_locks.hold(session_id))
+            metrics = TurnMetrics()
+
+            # Get or create conversation
+            conversation, is_new = await self._load_conversation(
+                session_id, user, entry_source, entry_statement, metrics
+            )
+
+            # Skip message processing if this is a brand new conversation (already has welcome message)
+            if is_new and entry_source:
+                # Return only the initial welcome message
+                return {
+                    "session_id": conversation.session_id,
+                    "response": conversation.messages[-1].content,
+                    "is_new": is_new,
+                }
+
+            # The turn may have been answered by another worker before a retry
+            if idempotency_key:
+                previous = conversation.find_reply(idempotency_key)
+                if previous is not None:
+                    self.turn_results.put(turn_key, previous)
+                    return {
+                        "session_id": conversation.session_id,
+                        "response": previous,
+                        "is_new": False,
+                    }
+
+            # Add user message to conversation
+            user_entry = conversation.add_message(
+                user_message, "user", self._user_metadata(idempotency_key)
+            )
+
+            # Generate response using LangChain
+            response = await self._generate_response(conversation, user_message, metrics)
+
+            # Save AI response to conversation
+            assistant_entry = conversation.add_message(response, "assistant", metrics.to_metadata())
+            await self._save_turn(conversation, metrics, session_lock, user_entry, assistant_entry)
+            self.turn_results.put(turn_key, response)
 
-        # Skip message processing if this is a brand new conversation (already has welcome message)
-        if is_new and entry_source:
-            # Return only the initial welcome message
             return {
                 "session_id": conversation.session_id,
-                "response": conversation.messages[-1].content,
+                "response": response,
                 "is_new": is_new,
             }
 
-        # Add user message to conversation
-        conversation.add_message(user_message, "user")
+    async def stream_message(
+        self,
+        session_id,
+        user_message,
+        user=None,
+        entry_source=None,
+        entry_statement=None,
+        idempotency_key=None,
+    ):
+        """Process a user message and yield response events as they are produced.
+
+        Yields dictionaries with an ``event`` name (``session``, ``token`` or
+        ``done``) and a ``data`` payload. The assistant reply is saved to the
+        conversation once the stream has completed. Ordering and duplicate
+        handling are the same as in process_message; a duplicate is replayed
+        as a single token event.
+        """
+        turn_key = self.turn_results.make_key(session_id, user_message, idempotency_key)
+        previous = await self.turn_results.reply_to(turn_key)
+        if previous is not None:
+            async for event in self._replay(session_id, previous):
+                yield event
+            return
+
+        async with self.turn_results.running(turn_key), AsyncExitStack() as session_lock:
+            await session_lock.enter_async_context(self.session_locks.hold(session_id))
+            metrics = TurnMetrics()
+
+            # Get or create conversation
+            conversation, is_new = await self._load_conversation(
+                session_id, user, entry_source, entry_statement, metrics
+            )
 
-        # Generate response using LangChain
-        response = self._generate_response(conversation, user_message)
+            # New conversations from a known entry point only get the welcome message
+            if is_new and entry_source:
+                async for event in self._replay(
+                    conversation.session_id, conversation.messages[-1].content, is_new
+                ):
+                    yield event
+                return
+
+            # The turn may have been answered by another worker before a retry
+            if idempotency_key:
+                previous = conversation.find_reply(idempotency_key)
+                if previous is not None:
+                    self.turn_results.put(turn_key, previous)
+                    async for event in self._replay(conversation.session_id, previous):
+                        yield event
+                    return
+
+            yield {
+                "event": "session",
+                "data": {"session_id": conversation.session_id, "is_new": is_new},
+            }
 
-        # Save AI response to conversation
-        conversation.add_message(response, "assistant")
-        conversation.save()
+            # Add user message to conversation
+            user_entry = conversation.add_message(
+                user_message, "user", self._user_metadata(idempotency_key)
+            )
 
-        return {
-            "session_id": conversation.session_id,
-            "response": response,
-            "is_new": is_new,
-        }
+            streamed = []
+            response = None
+            async for kind, content in self._stream_response(conversation, user_message, metrics):
+                if kind == "token":
+                    streamed.append(content)
+                    yield {"event": "token", "data": {"content": content}}
+                else:
+                    response = content
+
+            # Fall back to the streamed tokens if no final output was reported
+            if response is None:
+                response = "".join(streamed)
+
+            # Save AI response to conversation
+            assistant_entry = conversation.add_message(response, "assistant", metrics.to_metadata())
+            await self._save_turn(conversation, metrics, session_lock, user_entry, assistant_entry)
+            self.turn_results.put(turn_key, response)
+
+            yield {
+                "event": "done",
+                "data": {"session_id": conversation.session_id, "response": response},
+            }
 
-    def _generate_response(self, conversation, user_message):
-        """Generate a response using LangChain."""
-        # Get conversation history for context
-        messages = conversation.get_langchain_messages()
-
-        # Convert to LangChain message format
-        langchain_messages = []
-        for msg in messages:
-            if msg["role"] == "system":
-                langchain_messages.append(SystemMessage(content=msg["content"]))
-            elif msg["role"] == "user":
-                langchain_messages.append(HumanMessage(content=msg["content"]))
-            elif msg["role"] == "assistant":
-                langchain_messages.append(AIMessage(content=msg["content"]))
-
-        # Create the prompt template with system message and history
-        prompt = ChatPromptTemplate.from_messages(
-            [
-                SystemMessagePromptTemplate.from_template(
-                    self.prompts.BASE_SYSTEM_PROMPT
-                ),
-                MessagesPlaceholder(variable_name="chat_history"),
-                HumanMessagePromptTemplate.from_template("{input}"),
-            ]
+    async def _replay(self, session_id, response, is_new=False):
+        """Yield stream events for a reply that is already known."""
+        yield {"event": "session", "data": {"session_id": session_id, "is_new": is_new}}
+        yield {"event": "token", "data": {"content": response}}
+        yield {"event": "done", "data": {"session_id": session_id, "response": response}}
+
+    @staticmethod
+    def _user_metadata(idempotency_key):
+        """Metadata stored with the user's message."""
+        return {"idempotency_key": idempotency_key} if idempotency_key else {}
+
+    async def _load_conversation(self, session_id, user, entry_source, entry_statement, metrics):
+        """Get or create the session's conversation, including writes still queued."""
+        previous_write = self._write_times.pop(session_id, None) if session_id else None
+        if previous_write is not None:
+            metrics.timings["previous_mongo_write"] = previous_write
+        if self.write_queue is not None and session_id:
+            pending = self.write_queue.get_conversation(session_id)
+            if pending is not None:
+                return pending, False
+        return await metrics.timed(
+            "mongo_read",
+            run_db(
+                self.create_or_continue_conversation,
+                session_id,
+                user,
+                entry_source,
+                entry_statement,
+            ),
         )
 
-        # Create an agent with tools if we've accumulated enough context
-        if len(langchain_messages) >= 2:  # System + intro + at least 2 user/assistant exchanges
-            return self._generate_agent_response(langchain_messages, user_message)
-
-        # For early conversations, use a simpler approach without tools
-        chain = LLMChain(llm=self.llm, prompt=prompt)
-
-        result = chain.invoke(
-            {
-                "chat_history": langchain_messages[
-                    1:
-                ],  # Skip system message as it's in the prompt
-                "input": user_message,
-            }
+    async def _save_turn(self, conversation, metrics, session_lock, *messages):
+        """Append a turn's messages and the updated history summary.
+
+        In write-behind mode the turn is queued and written in the background.
+        With locks shared between workers, ``session_lock`` (the exit stack
+        holding the session) is taken over and only released once the write
+        is done, so the reply is not held up but the next worker to take the
+        session reads the turn. In-process locks mean a single worker, which
+        reads queued turns back from the write queue (see
+        ConversationWriteQueue). Otherwise the write's own
+        duration is only known afterwards, so it is stored with the
+        session's next turn as ``previous_mongo_write_ms`` rather than by a
+        second update.
+        """
+        if self.write_queue is not None:
+            self.write_queue.enqueue(
+                conversation,
+                messages,
+                summary=conversation.summary,
+                summarized_count=conversation.summarized_count,
+            )
+            if self.settings.SESSION_LOCK_BACKEND == "mongo":
+                self._release_when_stored(session_lock.pop_all(), conversation.session_id)
+            return
+
+        start = time.perf_counter()
+        await run_db(
+            conversation.save_new_messages,
+            messages,
+            summary=conversation.summary,
+            summarized_count=conversation.summarized_count,
+        )
+        self._write_times[conversation.session_id] = time.perf_counter() - start
+
+    def _release_when_stored(self, session_lock, session_id):
+        """Release ``session_lock`` in the background once the session's queued turns are done."""
+
+        async def release():
+            async with session_lock:
+                stored = await self.write_queue.wait_for(
+                    session_id, timeout=self.settings.WRITE_BEHIND_WAIT_TIMEOUT_SECONDS
+                )
+                if not stored:
+                    print(f"Error: turn for session {session_id} was not stored; releasing the session")
+
+        task = asyncio.create_task(release())
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _get_chat_inputs(self, conversation, user_message, metrics):
+        """Build the chain inputs from the token-budgeted conversation history."""
+        chat_history = await metrics.timed(
+            "history",
+            self.history_manager.build_history(
+                conversation, self._get_compiled()["summary_chain"], callbacks=[metrics]
+            ),
+        )
+        return {"chat_history": chat_history, "input": user_message}
+
+    async def _should_use_agent(self, conversation, user_message, metrics):
+        """Decide whether this turn goes through the tools agent."""
+        metrics.path, metrics.route = await self.turn_router.route(
+            conversation,
+            user_message,
+            classifier=self._get_compiled()["router_classifier"],
+            config={"callbacks": [metrics]},
         )
+        return metrics.path == AGENT
 
-        return result["text"]
+    async def _generate_response(self, conversation, user_message, metrics):
+        """Generate a response using LangChain."""
+        inputs = await self._get_chat_inputs(conversation, user_message, metrics)
+        # Lets tools read and update the conversation
+        current_conversation.set(conversation)
 
-    def _generate_agent_response(self, langchain_messages, user_message):
-        """Generate a response using an agent with tools."""
-        # Create the prompt template for the agent
-        prompt = ChatPromptTemplate.from_messages(
-            [
-                SystemMessagePromptTemplate.from_template(
-                    self.prompts.BASE_SYSTEM_PROMPT
-                ),
-                MessagesPlaceholder(variable_name="chat_history"),
-                HumanMessagePromptTemplate.from_template("{input}"),
-                MessagesPlaceholder(variable_name="agent_scratchpad"),
-            ]
-        )
+        # Only turns that may need a tool pay for the agent
+        if await self._should_use_agent(conversation, user_message, metrics):
+            return await self._generate_agent_response(inputs, metrics)
 
-        # Create the agent
-        agent = create_openai_tools_agent(llm=self.llm, tools=self.tools, prompt=prompt)
+        # Plain replies take a single LLM call
+        chain = self._get_compiled()["chat_chain"]
+        result = await chain.ainvoke(inputs, config={"callbacks": [metrics]})
+        return result.content
 
-        # Create the agent executor
-        agent_executor = AgentExecutor(
-            agent=agent, tools=self.tools, verbose=True, handle_parsing_errors=True
-        )
+    async def _generate_agent_response(self, inputs, metrics):
+        """Generate a response using an agent with tools."""
+        agent_executor = self._get_compiled()["agent_executor"]
 
         # Run the agent
-        result = agent_executor.invoke(
-            {
-                "chat_history": langchain_messages[
-                    1:
-                ],  # Skip system message as it's in the prompt
-                "input": user_message,
-            }
-        )
-
+        result = await agent_executor.ainvoke(inputs, config={"callbacks": [metrics], "tags": [AGENT_TAG]})
         return result["output"]
 
-    def get_recent_conversations(self, user=None, limit=10):
+    async def _stream_response(self, conversation, user_message, metrics):
+        """Stream a response using LangChain.
+
+        Yields ``("token", text)`` pairs while the LLM generates and, for the
+        agent path, a final ``("output", text)`` pair with the agent's answer.
+        """
+        inputs = await self._get_chat_inputs(conversation, user_message, metrics)
+        current_conversation.set(conversation)
+        config = {"callbacks": [metrics]}
+
+        # Same routing as _generate_response
+        if await self._should_use_agent(conversation, user_message, metrics):
+            agent_executor = self._get_compiled()["agent_executor"]
+            agent_config = {**config, "tags": [AGENT_TAG]}
+            async for event in agent_executor.astream_events(inputs, config=agent_config, version="v2"):
+                if event["event"] == "on_chat_model_stream":
+                    content = event["data"]["chunk"].content
+                    if isinstance(content, str) and content:
+                        yield "token", content
+                elif event["event"] == "on_chain_end" and not event["parent_ids"]:
+                    yield "output", event["data"]["output"]["output"]
+            return
+
+        chain = self._get_compiled()["chat_chain"]
+        async for chunk in chain.astream(inputs, config=config):
+            if isinstance(chunk.content, str) and chunk.content:
+                yield "token", chunk.content
+
+    async def get_recent_conversations(self, user=None, limit=10):
         """Get recent conversations for a user."""
         query = {}
         if user:
@@ -206,4 +541,5 @@ class ChatbotService:
         conversations = (
             Conversation.objects(**query).order_by("-updated_at").limit(limit)
         )
-        return conversations
+        # Evaluate the queryset off the event loop
+        return await run_db(list, conversations)
@@ -0,0 +1,67 @@
+import hashlib
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from langchain_openai import OpenAIEmbeddings
+
+from backend.config.settings import get_settings
+from backend.services.hebrew_text import tokenize
+
+
+class HashingEmbeddings(Embeddings):
+    """Local, deterministic embeddings for tests and offline runs.
+
+    Words and character trigrams are hashed into a fixed number of signed
+    buckets and the result is L2-normalized, so texts sharing vocabulary
+    get a high cosine similarity. No model or network access is needed.
+    """
+
+    def __init__(self, dimensions=256):
+        self.dimensions = dimensions
+        self.model_name = f"hashing-{dimensions}"
+
+    def _features(self, text):
+        for word in tokenize(text):
+            yield word
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                yield padded[i : i + 3]
+
+    def _embed(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in self._features(text):
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def get_embeddings():
+    """Create the embedding model configured by EMBEDDING_MODEL."""
+    settings = get_settings()
+    if settings.EMBEDDING_MODEL == "openai":
+        embeddings = OpenAIEmbeddings(
+            model=settings.OPENAI_EMBEDDING_MODEL_NAME,
+            openai_api_key=settings.OPENAI_API_KEY,
+            dimensions=settings.EMBEDDING_DIMENSIONS,
+        )
+    elif settings.EMBEDDING_MODEL == "gemini":
+        embeddings = GoogleGenerativeAIEmbeddings(
+            model=settings.GEMINI_EMBEDDING_MODEL_NAME, google_api_key=settings.GEMINI_API_KEY
+        )
+    else:  # Local stand-in
+        embeddings = HashingEmbeddings(settings.EMBEDDING_DIMENSIONS)
+    return embeddings
+
+
+def embedding_model_name(embeddings):
+    """Name identifying the vectors an embedding model produces."""
+    return getattr(embeddings, "model_name", None) or getattr(embeddings, "model", type(embeddings).__name__)
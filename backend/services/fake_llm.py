@@ -0,0 +1,238 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, List
+from uuid import uuid4
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from backend.config.settings import get_settings
+from backend.services.prompt_cache import FakeContextCacheProvider
+
+
+DEFAULT_REPLIES = [
+    "תודה ששיתפת אותי. איך הרגשת באותו רגע?",
+    "אני שומעת אותך. זה נשמע כמו משהו שמעסיק אותך כבר זמן מה.",
+    "מה שאת מתארת חשוב. רוצה לספר לי עוד קצת על מה שקרה?",
+    "זה לגמרי מובן שתרגישי כך. מה עוזר לך בדרך כלל ברגעים כאלה?",
+]
+
+
+def transcript_key(messages):
+    """Key identifying an LLM request by the conversation it was sent.
+
+    The leading system prompt is left out and only message contents are
+    used, so a request matches whether or not the prefix came from a
+    provider cache (see PromptCachingChatModel).
+    """
+    if messages and messages[0].type == "system":
+        messages = messages[1:]
+    digest = hashlib.sha256()
+    for message in messages:
+        digest.update(str(message.content).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic chat model for load tests and offline development.
+
+    Replies are picked by hashing the last user message, after ``latency``
+    seconds and at ``tokens_per_second``. ``tool_script`` rules make it call
+    a tool when the user's message contains a given phrase, e.g.
+    ``{"when": "סיפור", "tool": "fetch_relatable_story", "args": {...}}``.
+    With a transcript (see TranscriptRecorder) requests seen before are
+    answered with the recorded response instead.
+    """
+
+    model_name: str = "fake"
+    latency: float = 0.0
+    tokens_per_second: float = 0.0
+    replies: List[str] = DEFAULT_REPLIES
+    tool_script: List[Dict[str, Any]] = []
+    transcript: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    @classmethod
+    def from_settings(cls):
+        """Create the fake model configured through the FAKE_LLM_* settings."""
+        settings = get_settings()
+        kwargs = {
+            "latency": settings.FAKE_LLM_LATENCY,
+            "tokens_per_second": settings.FAKE_LLM_TOKENS_PER_SECOND,
+        }
+        if settings.FAKE_LLM_TOOL_SCRIPT:
+            with open(settings.FAKE_LLM_TOOL_SCRIPT, encoding="utf-8") as f:
+                kwargs["tool_script"] = json.load(f)
+        if settings.FAKE_LLM_TRANSCRIPT:
+            kwargs["transcript"] = load_transcript(settings.FAKE_LLM_TRANSCRIPT)
+        return cls(**kwargs)
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _respond(self, messages, tools=None, cached_content=None):
+        """Build the deterministic response message for a request."""
+        recorded = self.transcript.get(transcript_key(messages))
+        if recorded is not None:
+            message = AIMessage(
+                content=recorded.get("content", ""),
+                tool_calls=recorded.get("tool_calls", []),
+            )
+        else:
+            if tools is None and cached_content:
+                # Cached requests carry their tools in the cache entry
+                tools = FakeContextCacheProvider.cached_tools.get(cached_content)
+            message = self._scripted(messages, tools)
+
+        input_tokens = sum(len(str(m.content)) for m in messages) // 4 + 1
+        output_tokens = len(str(message.content).split()) + 1
+        message.usage_metadata = {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+            # A cached request only pays for the part after the prefix
+            "input_token_details": {"cache_read": input_tokens // 2 if cached_content else 0},
+        }
+        message.response_metadata = {"model_name": self.model_name}
+        return message
+
+    def _scripted(self, messages, tools):
+        last_user = next(
+            (m.content for m in reversed(messages) if isinstance(m, HumanMessage)), ""
+        )
+
+        # Call a scripted tool on a fresh user turn, never right after a tool result
+        if tools and messages and not isinstance(messages[-1], ToolMessage):
+            tool_names = {tool["function"]["name"] for tool in tools}
+            for rule in self.tool_script:
+                if rule["tool"] in tool_names and rule.get("when", "") in str(last_user):
+                    return AIMessage(
+                        content="",
+                        tool_calls=[
+                            {
+                                "name": rule["tool"],
+                                "args": rule.get("args", {}),
+                                "id": f"call_{uuid4().hex[:12]}",
+                            }
+                        ],
+                    )
+
+        digest = hashlib.sha256(str(last_user).encode("utf-8")).digest()
+        return AIMessage(content=self.replies[digest[0] % len(self.replies)])
+
+    def _delays(self):
+        """Seconds to wait before the first token and between tokens."""
+        per_token = 1 / self.tokens_per_second if self.tokens_per_second else 0
+        return self.latency, per_token
+
+    def _generate(self, messages, stop=None, run_manager=None, tools=None, cached_content=None, **kwargs):
+        message = self._respond(messages, tools, cached_content)
+        first, per_token = self._delays()
+        time.sleep(first + per_token * len(str(message.content).split()))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, tools=None, cached_content=None, **kwargs):
+        message = self._respond(messages, tools, cached_content)
+        first, per_token = self._delays()
+        await asyncio.sleep(first + per_token * len(str(message.content).split()))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _chunks(self, message):
+        """Split a response into streamed chunks, usage on the last one."""
+        words = str(message.content).split(" ") if message.content else []
+        chunks = [AIMessageChunk(content=word if i == 0 else f" {word}") for i, word in enumerate(words)]
+        if message.tool_calls:
+            chunks.append(
+                AIMessageChunk(
+                    content="",
+                    tool_call_chunks=[
+                        {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+                        for i, call in enumerate(message.tool_calls)
+                    ],
+                )
+            )
+        if not chunks:
+            chunks.append(AIMessageChunk(content=""))
+        chunks[-1].usage_metadata = message.usage_metadata
+        chunks[-1].response_metadata = message.response_metadata
+        return chunks
+
+    def _stream(self, messages, stop=None, run_manager=None, tools=None, cached_content=None, **kwargs):
+        message = self._respond(messages, tools, cached_content)
+        first, per_token = self._delays()
+        time.sleep(first)
+        for i, chunk in enumerate(self._chunks(message)):
+            if i:
+                time.sleep(per_token)
+            if run_manager and chunk.content:
+                run_manager.on_llm_new_token(chunk.content)
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages, stop=None, run_manager=None, tools=None, cached_content=None, **kwargs):
+        message = self._respond(messages, tools, cached_content)
+        first, per_token = self._delays()
+        await asyncio.sleep(first)
+        for i, chunk in enumerate(self._chunks(message)):
+            if i:
+                await asyncio.sleep(per_token)
+            if run_manager and chunk.content:
+                await run_manager.on_llm_new_token(chunk.content)
+            yield ChatGenerationChunk(message=chunk)
+
+
+def load_transcript(path):
+    """Load a JSONL transcript written by TranscriptRecorder."""
+    transcript = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                transcript[entry["key"]] = entry["response"]
+    return transcript
+
+
+class TranscriptRecorder(BaseCallbackHandler):
+    """Callback handler that appends every chat model call to a JSONL transcript.
+
+    Attach it to a real model to capture traffic that FakeChatModel can
+    later replay without network access.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._pending[run_id] = transcript_key(messages[0])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        key = self._pending.pop(run_id, None)
+        if key is None:
+            return
+        message = response.generations[0][0].message
+        entry = {
+            "key": key,
+            "response": {
+                "content": message.content,
+                "tool_calls": [
+                    {"name": call["name"], "args": call["args"], "id": call["id"]}
+                    for call in getattr(message, "tool_calls", [])
+                ],
+            },
+        }
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._pending.pop(run_id, None)
@@ -0,0 +1,49 @@
+import re
+
+# Cantillation marks and vowel points (niqqud), U+0591-U+05C7 except maqaf
+# and sof pasuq, which separate words
+_NIQQUD = re.compile("[\u0591-\u05bd\u05bf-\u05c2\u05c4-\u05c7]")
+_FINAL_LETTERS = str.maketrans("ךםןףץ", "כמנפצ")
+# Geresh and gershayim (and their ASCII stand-ins) inside abbreviations
+_ABBREVIATION_MARKS = re.compile("(?<=[\u05d0-\u05ea])[\u05f3\u05f4'\"](?=[\u05d0-\u05ea])")
+_TOKEN = re.compile(r"[א-ת]+|[a-z0-9]+")
+
+# One-letter prefixes: ו (and), ה (the), ב (in), ל (to), מ (from), ש (that), כ (as)
+PREFIX_LETTERS = "והבלמשכ"
+MAX_PREFIX_LENGTH = 3  # e.g. "וכשה"-style stacks are rarely longer
+MIN_STEM_LENGTH = 3
+
+
+def normalize(text):
+    """Lowercase, strip niqqud and fold final letters to their regular form."""
+    text = _NIQQUD.sub("", text.lower())
+    text = _ABBREVIATION_MARKS.sub("", text)
+    return text.translate(_FINAL_LETTERS)
+
+
+def tokenize(text):
+    """Split normalized text into Hebrew and Latin word tokens."""
+    return _TOKEN.findall(normalize(text))
+
+
+def prefix_variants(token):
+    """Return the token and its forms with up to MAX_PREFIX_LENGTH prefix letters removed.
+
+    Prefixes attach directly to the word in Hebrew ("ובבית" = "and in the
+    house"), so both the full token and the stripped stems are indexed and
+    searched; a stem must keep at least MIN_STEM_LENGTH letters.
+    """
+    variants = [token]
+    for i in range(min(MAX_PREFIX_LENGTH, len(token) - MIN_STEM_LENGTH)):
+        if token[i] not in PREFIX_LETTERS:
+            break
+        variants.append(token[i + 1 :])
+    return variants
+
+
+def analyze(text):
+    """Tokens of ``text`` with their prefix variants, as indexed and searched."""
+    terms = []
+    for token in tokenize(text):
+        terms.extend(prefix_variants(token))
+    return terms
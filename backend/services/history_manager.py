@@ -0,0 +1,132 @@
+import asyncio
+
+from langchain.schema import SystemMessage, HumanMessage, AIMessage
+
+from backend.config.settings import get_settings
+
+
+class ConversationHistoryManager:
+    """Keeps the chat history sent to the LLM within a token budget.
+
+    The most recent messages are passed verbatim. Once they no longer fit in
+    the budget, the oldest ones are folded into a running summary stored on
+    the conversation (``summary`` / ``summarized_count``), so every message
+    is summarized at most once.
+    """
+
+    def __init__(self, prompts, token_budget=None, min_recent_messages=None, retain_ratio=0.5):
+        settings = get_settings()
+        self.prompts = prompts
+        self.token_budget = token_budget or settings.HISTORY_TOKEN_BUDGET
+        self.min_recent_messages = (
+            min_recent_messages
+            if min_recent_messages is not None
+            else settings.HISTORY_MIN_RECENT_MESSAGES
+        )
+        # After summarizing, keep roughly this share of the budget verbatim so
+        # the next summary is only needed after several more turns
+        self.retain_ratio = retain_ratio
+        self._encoding = None
+
+    def _load_encoding(self):
+        """Load the tokenizer, which may download its vocabulary on first use."""
+        try:
+            import tiktoken
+
+            self._encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            print(f"Falling back to estimated token counts: {e}")
+            self._encoding = False
+
+    def count_tokens(self, text):
+        """Count tokens in text, estimating if no tokenizer is available."""
+        if self._encoding is None:
+            self._load_encoding()
+        if self._encoding:
+            return len(self._encoding.encode(text))
+        return len(text) // 3 + 1
+
+    async def build_history(self, conversation, summary_chain, exclude_last=True, callbacks=None):
+        """Return the LangChain messages to send as ``chat_history``.
+
+        Args:
+            conversation: The conversation being answered.
+            summary_chain: Runnable that updates a summary with new lines.
+            exclude_last: Leave out the last message, which is the current
+                user input and is passed to the prompt separately.
+            callbacks: Callback handlers for the summary call, e.g. the
+                turn's TurnMetrics so its tokens are counted.
+        """
+        if self._encoding is None:
+            await asyncio.to_thread(self._load_encoding)
+
+        messages = list(conversation.messages)
+        if exclude_last and messages:
+            messages = messages[:-1]
+
+        summarized_count = conversation.summarized_count or 0
+        start = self._recent_start(messages, summarized_count)
+        if start > summarized_count:
+            try:
+                await self._fold_into_summary(conversation, messages, start, summary_chain, callbacks)
+            except Exception as e:
+                # Send the full unsummarized history this turn and retry next time
+                print(f"Error summarizing conversation history: {e}")
+                start = summarized_count
+
+        history = []
+        if conversation.summary:
+            history.append(
+                SystemMessage(
+                    content=f"{self.prompts.HISTORY_SUMMARY_PREFIX}\n{conversation.summary}"
+                )
+            )
+        for msg in messages[start:]:
+            if msg.role == "user":
+                history.append(HumanMessage(content=msg.content))
+            elif msg.role == "assistant":
+                history.append(AIMessage(content=msg.content))
+        return history
+
+    def _recent_start(self, messages, summarized_count):
+        """Find the index where the verbatim part of the history starts."""
+        unsummarized = [
+            (i, self.count_tokens(msg.content))
+            for i, msg in enumerate(messages)
+            if i >= summarized_count and msg.role != "system"
+        ]
+        if sum(tokens for _, tokens in unsummarized) <= self.token_budget:
+            return summarized_count
+
+        # Over budget: keep the newest messages up to the retained share
+        target = self.token_budget * self.retain_ratio
+        kept = 0
+        total = 0
+        start = len(messages)
+        for i, tokens in reversed(unsummarized):
+            if kept >= self.min_recent_messages and total + tokens > target:
+                break
+            kept += 1
+            total += tokens
+            start = i
+        return start
+
+    async def _fold_into_summary(self, conversation, messages, start, summary_chain, callbacks=None):
+        """Summarize messages[summarized_count:start] into the conversation summary."""
+        lines = []
+        for msg in messages[conversation.summarized_count or 0 : start]:
+            if msg.role == "user":
+                lines.append(f"User: {msg.content}")
+            elif msg.role == "assistant":
+                lines.append(f"Assistant: {msg.content}")
+
+        if lines:
+            result = await summary_chain.ainvoke(
+                {
+                    "summary": conversation.summary or "",
+                    "new_lines": "\n".join(lines),
+                },
+                config={"callbacks": callbacks},
+            )
+            conversation.summary = result.content
+        conversation.summarized_count = start
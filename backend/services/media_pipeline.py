@@ -0,0 +1,337 @@
+"""Background generation of smaller versions of vault media.
+
+After an upload, jobs are queued in MongoDB for the item's derivatives:
+a thumbnail for images, a poster frame for videos and a compressed
+preview for recordings. Derivatives belong to the blob of the item's
+contents (see vault_blobs), so identical files share them: they are made
+once, copied to every item with those contents, and deleted with the
+blob. Items registered before their contents were hashed (files sent
+straight to storage) get a "hash" job first, which stores them by
+content and then queues their derivatives. Workers claim jobs with a
+lease, so jobs survive restarts: a job
+left running by a stopped worker is taken over once its lease expires.
+The conversions run in a process pool.
+
+The API runs a worker unless MEDIA_WORKER_ENABLED is false; one can also
+run on its own, or queue jobs for items uploaded before the pipeline:
+
+    python -m backend.services.media_pipeline
+    python -m backend.services.media_pipeline --enqueue-missing
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from uuid import uuid4
+
+from mongoengine.errors import NotUniqueError
+from pymongo import ReturnDocument
+
+from backend.config.settings import get_settings
+from backend.db.models.media_job import MediaJob
+from backend.db.models.vault_blob import VaultBlob
+from backend.db.models.vault_item import VaultItem
+from backend.db.mongodb import connect_to_mongo, run_db
+from backend.services import media_transforms
+from backend.services.storage import get_storage, run_storage
+from backend.services.vault_blobs import deduplicate_item
+
+# Derivatives made for each vault category
+DERIVATIVES = {
+    "images": ["thumbnail"],
+    "videos": ["poster"],
+    "records": ["audio_preview"],
+}
+# kind -> (file extension, content type)
+OUTPUTS = {
+    "thumbnail": ("jpg", "image/jpeg"),
+    "poster": ("jpg", "image/jpeg"),
+    "audio_preview": ("m4a", "audio/mp4"),
+}
+
+
+def derivative_name(content_hash, kind):
+    extension, _ = OUTPUTS[kind]
+    return f"derivatives/sha256/{content_hash[:2]}/{content_hash}/{kind}.{extension}"
+
+
+def enqueue_derivatives(item):
+    """Queue the derivatives of a vault item's contents; returns the number of new jobs.
+
+    Derivatives its contents already have are copied to the item instead.
+    An item whose contents are not hashed yet gets a "hash" job, which
+    queues the derivatives once it is done.
+    """
+    if not item.content_hash:
+        if MediaJob.objects(item_id=item.id, kind="hash", status__in=["pending", "running"]).first():
+            return 0
+        MediaJob(item_id=item.id, kind="hash").save()
+        return 1
+    blob = VaultBlob.objects(content_hash=item.content_hash).only("derivatives").first()
+    if blob is not None and blob.derivatives:
+        VaultItem.objects(id=item.id).update_one(
+            **{f"set__derivatives__{kind}": derivative for kind, derivative in blob.derivatives.items()}
+        )
+
+    queued = 0
+    for kind in DERIVATIVES.get(item.category, []):
+        if blob is not None and kind in blob.derivatives:
+            continue
+        try:
+            MediaJob(content_hash=item.content_hash, item_id=item.id, kind=kind).save()
+            queued += 1
+        except NotUniqueError:
+            pass  # Already queued for the same contents
+    return queued
+
+
+def enqueue_missing():
+    """Queue derivatives for every item that has none yet."""
+    items = VaultItem.objects(__raw__={"$or": [{"derivatives": {}}, {"derivatives": {"$exists": False}}]})
+    return sum(enqueue_derivatives(item) for item in items)
+
+
+def claim_job(worker, lease_seconds):
+    """Take the oldest runnable job, or return None."""
+    now = datetime.now(tz=timezone.utc)
+    document = MediaJob._get_collection().find_one_and_update(
+        {
+            "$or": [
+                {"status": "pending", "run_after": {"$lte": now}},
+                {"status": "running", "lease_until": {"$lte": now}},
+            ]
+        },
+        {
+            "$set": {
+                "status": "running",
+                "worker": worker,
+                "lease_until": now + timedelta(seconds=lease_seconds),
+                "updated_at": now,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+    return MediaJob._from_son(document) if document else None
+
+
+def finish_job(job, worker, error=None, retry_after=None):
+    """Mark a claimed job done, failed, or (with ``retry_after`` seconds) pending again."""
+    now = datetime.now(tz=timezone.utc)
+    if error is None:
+        update = {"status": "done", "error": None}
+    elif retry_after is not None:
+        update = {"status": "pending", "error": error, "run_after": now + timedelta(seconds=retry_after)}
+    else:
+        update = {"status": "failed", "error": error}
+    # Only the worker holding the lease may finish the job
+    MediaJob._get_collection().update_one(
+        {"_id": job.id, "worker": worker, "status": "running"},
+        {"$set": {**update, "updated_at": now}},
+    )
+
+
+def save_derivative(content_hash, kind, stored):
+    """Record a derivative on its blob and every item with its contents.
+
+    Returns False if the blob is being deleted, in which case the
+    derivative is not recorded and should be deleted too.
+    """
+    derivative = {
+        "object_name": stored["name"],
+        "content_type": stored["content_type"],
+        "size": stored["size"],
+        "generation": stored["generation"],
+    }
+    # The blob first: items registered from now on copy it from there
+    saved = VaultBlob.objects(content_hash=content_hash, deleting__ne=True).update_one(
+        **{f"set__derivatives__{kind}": derivative}
+    )
+    if not saved:
+        return False
+    VaultItem.objects(content_hash=content_hash).update(**{f"set__derivatives__{kind}": derivative})
+    return True
+
+
+class MediaWorker:
+    """Claims media jobs and runs their conversions in a process pool."""
+
+    def __init__(self, processes=None, concurrency=None):
+        settings = get_settings()
+        self.id = uuid4().hex
+        self.concurrency = concurrency or settings.MEDIA_WORKER_CONCURRENCY
+        # Spawned, not forked: the API process has database and HTTP threads running
+        self._pool = ProcessPoolExecutor(
+            max_workers=processes or settings.MEDIA_WORKER_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        self._semaphore = None
+        self._wake = None
+        self._runner = None
+        self._tasks = set()
+
+    def start(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._wake = asyncio.Event()
+        self._runner = asyncio.create_task(self.run())
+
+    def wake(self):
+        """Look for jobs now instead of at the next poll."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def run(self):
+        settings = get_settings()
+        while True:
+            await self._semaphore.acquire()
+            try:
+                job = await run_db(claim_job, self.id, settings.MEDIA_JOB_LEASE_SECONDS)
+            except Exception as e:
+                print(f"Error claiming media job: {e}")
+                job = None
+            if job is None:
+                self._semaphore.release()
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), settings.MEDIA_JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.create_task(self._process(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, job):
+        settings = get_settings()
+        try:
+            if job.attempts > settings.MEDIA_JOB_MAX_ATTEMPTS:
+                # Claimed again after its workers kept dying on it
+                await run_db(finish_job, job, self.id, error="Too many attempts")
+                return
+            if job.kind == "hash":
+                item = await deduplicate_item(job.item_id)
+                if item is not None:
+                    await run_db(enqueue_derivatives, item)
+                await run_db(finish_job, job, self.id)
+                return
+            if job.content_hash is None:
+                # Queued per item, before derivatives were shared; --enqueue-missing queues it again
+                await run_db(finish_job, job, self.id, error="Queued without a content hash")
+                return
+            blob = await run_db(VaultBlob.objects(content_hash=job.content_hash, deleting__ne=True).first)
+            if blob is None:
+                await run_db(finish_job, job, self.id)  # Deleted in the meantime
+                return
+            stored = await self._make(blob.object_name, job.content_hash, job.kind)
+            if not await run_db(save_derivative, job.content_hash, job.kind, stored):
+                await run_storage(get_storage().delete, stored["name"])
+            await run_db(finish_job, job, self.id)
+        except Exception as e:
+            print(f"Error making {job.kind} of {job.content_hash or job.item_id}: {e}")
+            retry_after = None
+            if job.attempts < settings.MEDIA_JOB_MAX_ATTEMPTS:
+                retry_after = settings.MEDIA_JOB_RETRY_SECONDS * job.attempts
+            try:
+                await run_db(finish_job, job, self.id, error=str(e), retry_after=retry_after)
+            except Exception as e:
+                print(f"Error updating media job {job.id}: {e}")
+        finally:
+            self._semaphore.release()
+
+    async def _make(self, object_name, content_hash, kind):
+        settings = get_settings()
+        storage = get_storage()
+        extension, content_type = OUTPUTS[kind]
+        if kind == "thumbnail":
+            convert = partial(media_transforms.make_thumbnail, size=settings.THUMBNAIL_SIZE)
+        elif kind == "poster":
+            convert = partial(media_transforms.make_poster, size=settings.POSTER_SIZE, ffmpeg=settings.FFMPEG_PATH)
+        else:
+            convert = partial(
+                media_transforms.make_audio_preview, bitrate=settings.AUDIO_PREVIEW_BITRATE, ffmpeg=settings.FFMPEG_PATH
+            )
+
+        with tempfile.TemporaryDirectory(prefix="media-") as directory:
+            source = os.path.join(directory, "original")
+            destination = os.path.join(directory, f"{kind}.{extension}")
+            await run_storage(storage.download_to_file, object_name, source)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._pool, partial(convert, source, destination))
+            with open(destination, "rb") as f:
+                return await run_storage(storage.upload_file, derivative_name(content_hash, kind), f, content_type)
+
+    async def join(self):
+        """Wait until the worker is stopped."""
+        await self._runner
+
+    async def close(self):
+        """Stop claiming jobs; unfinished ones run again after their lease expires."""
+        if self._runner is not None:
+            self._runner.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(self._runner, *self._tasks, return_exceptions=True)
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+_worker = None
+
+
+def get_media_worker():
+    """Return the media worker started in this process, if any."""
+    return _worker
+
+
+def start_media_worker():
+    global _worker
+    if _worker is None:
+        _worker = MediaWorker()
+        _worker.start()
+    return _worker
+
+
+async def close_media_worker():
+    global _worker
+    if _worker is not None:
+        await _worker.close()
+        _worker = None
+
+
+async def queue_derivatives(item):
+    """Queue the derivatives of a newly registered item and wake the local worker."""
+    try:
+        if await run_db(enqueue_derivatives, item) and _worker is not None:
+            _worker.wake()
+    except Exception as e:
+        # The item is stored either way; --enqueue-missing can catch up
+        print(f"Error queueing media jobs for {item.id}: {e}")
+
+
+async def run_worker():
+    worker = start_media_worker()
+    try:
+        await worker.join()
+    finally:
+        await close_media_worker()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--enqueue-missing", action="store_true", help="Queue jobs for items without derivatives")
+    args = parser.parse_args()
+
+    connect_to_mongo()
+    if args.enqueue_missing:
+        print(f"Queued {enqueue_missing()} jobs")
+        return
+    asyncio.run(run_worker())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Media conversions run in the media pipeline's worker processes.
+
+Kept apart from the pipeline so worker processes only import what the
+conversions need.
+"""
+
+import os
+import subprocess
+
+from PIL import Image, ImageOps
+
+FFMPEG_TIMEOUT_SECONDS = 600
+
+
+def make_thumbnail(source, destination, size):
+    """Write a JPEG of at most ``size`` x ``size`` pixels of the image ``source``."""
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)  # Phones store rotation as metadata
+        image.thumbnail((size, size))
+        image.convert("RGB").save(destination, "JPEG", quality=80, optimize=True)
+
+
+def _ffmpeg(ffmpeg, *args):
+    subprocess.run(
+        [ffmpeg, "-v", "error", "-y", *args],
+        check=True,
+        capture_output=True,
+        timeout=FFMPEG_TIMEOUT_SECONDS,
+    )
+
+
+def make_poster(source, destination, size, ffmpeg="ffmpeg"):
+    """Write a JPEG still of the video ``source``, at most ``size`` pixels wide."""
+    scale = ["-vf", f"scale='min({size},iw)':-2", "-q:v", "5"]
+    # A frame one second in is usually more telling than the first one
+    _ffmpeg(ffmpeg, "-ss", "1", "-i", source, "-frames:v", "1", *scale, destination)
+    if not os.path.exists(destination) or not os.path.getsize(destination):
+        _ffmpeg(ffmpeg, "-i", source, "-frames:v", "1", *scale, destination)
+
+
+def make_audio_preview(source, destination, bitrate, ffmpeg="ffmpeg"):
+    """Write a mono AAC version of the recording ``source`` at ``bitrate`` (e.g. "64k")."""
+    _ffmpeg(ffmpeg, "-i", source, "-vn", "-ac", "1", "-c:a", "aac", "-b:a", bitrate, "-f", "mp4", destination)
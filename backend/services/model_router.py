@@ -0,0 +1,258 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, List
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from backend.config.settings import get_settings
+
+
+# Provider calls don't inherit the caller's callbacks, so only the router's
+# own run reports tokens (a cancelled hedge never leaks into the stream)
+_ISOLATED = {"callbacks": []}
+
+
+class ProviderStats:
+    """Recent latencies and circuit-breaker state for one provider."""
+
+    def __init__(self, name, window=200):
+        self.name = name
+        self.latencies = deque(maxlen=window)  # Full response time, seconds
+        self.first_token_latencies = deque(maxlen=window)  # Streaming TTFT, seconds
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def record_success(self, latency, streaming=False):
+        (self.first_token_latencies if streaming else self.latencies).append(latency)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def record_lower_bound(self, latency, streaming=False):
+        """Record the time a cancelled request had taken; it would have taken at least that long.
+
+        Without these, only requests that won a race would be counted, and
+        the percentile would understate how slow the provider is.
+        """
+        (self.first_token_latencies if streaming else self.latencies).append(latency)
+
+    def record_failure(self, failure_threshold, cooldown):
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= failure_threshold:
+            # Open (or re-open after a failed half-open trial) the circuit
+            self.open_until = time.monotonic() + cooldown
+            print(f"Circuit open for {self.name} after {self.consecutive_failures} failures")
+
+    def is_available(self):
+        """Closed circuit, or open long enough to allow a trial request."""
+        return self.open_until <= time.monotonic()
+
+    def percentile(self, pct, streaming=False):
+        """Latency percentile in seconds, or None without enough samples."""
+        values = self.first_token_latencies if streaming else self.latencies
+        if len(values) < 10:
+            return None
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+class HedgedChatModel(BaseChatModel):
+    """Routes requests across providers with hedging and circuit breaking.
+
+    The first available provider gets the request. If it has not answered
+    (or, when streaming, produced its first token) within its usual latency
+    percentile, the same request is sent to the next provider as well; the
+    first to succeed wins and the other is cancelled. A provider failing
+    ``failure_threshold`` times in a row is skipped for ``cooldown`` seconds.
+    """
+
+    providers: List[Any]
+    names: List[str]
+    stats: Any = None
+    hedge_percentile: float = 95
+    min_hedge_delay: float = 1.0
+    max_hedge_delay: float = 8.0
+    default_hedge_delay: float = 3.0
+    failure_threshold: int = 3
+    cooldown: float = 30.0
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if self.stats is None:
+            # Shared with copies made by bind_tools
+            self.stats = {name: ProviderStats(name) for name in self.names}
+
+    @classmethod
+    def from_settings(cls, providers, names):
+        settings = get_settings()
+        return cls(
+            providers=providers,
+            names=names,
+            hedge_percentile=settings.HEDGE_PERCENTILE,
+            min_hedge_delay=settings.HEDGE_MIN_DELAY_SECONDS,
+            max_hedge_delay=settings.HEDGE_MAX_DELAY_SECONDS,
+            default_hedge_delay=settings.HEDGE_DEFAULT_DELAY_SECONDS,
+            failure_threshold=settings.CIRCUIT_FAILURE_THRESHOLD,
+            cooldown=settings.CIRCUIT_COOLDOWN_SECONDS,
+        )
+
+    @property
+    def _llm_type(self) -> str:
+        return "hedged"
+
+    @property
+    def _identifying_params(self):
+        return {"providers": self.names}
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(
+            update={"providers": [provider.bind_tools(tools, **kwargs) for provider in self.providers]}
+        )
+
+    def _order(self):
+        """Provider indexes to try: available ones first, in preference order."""
+        available = [i for i, name in enumerate(self.names) if self.stats[name].is_available()]
+        unavailable = [i for i in range(len(self.names)) if i not in available]
+        return available + unavailable
+
+    def _hedge_delay(self, index, streaming=False):
+        observed = self.stats[self.names[index]].percentile(self.hedge_percentile, streaming)
+        if observed is None:
+            return self.default_hedge_delay
+        return min(max(observed, self.min_hedge_delay), self.max_hedge_delay)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        # Synchronous callers only get failover, not hedging
+        error = None
+        for index in self._order():
+            stats = self.stats[self.names[index]]
+            start = time.monotonic()
+            try:
+                message = self.providers[index].invoke(messages, config=_ISOLATED, stop=stop, **kwargs)
+            except Exception as e:
+                stats.record_failure(self.failure_threshold, self.cooldown)
+                error = e
+                continue
+            stats.record_success(time.monotonic() - start)
+            return ChatResult(generations=[ChatGeneration(message=message)])
+        raise error
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        order = self._order()
+        running = {}  # task -> (provider index, start time)
+
+        def launch(index):
+            task = asyncio.ensure_future(
+                self.providers[index].ainvoke(messages, config=_ISOLATED, stop=stop, **kwargs)
+            )
+            running[task] = (index, time.monotonic())
+
+        launch(order[0])
+        backups = order[1:]
+        error = None
+        try:
+            while running:
+                timeout = None
+                if backups:
+                    first_index = next(iter(running.values()))[0]
+                    timeout = self._hedge_delay(first_index)
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                # Too slow: hedge with the next provider
+                if not done:
+                    launch(backups.pop(0))
+                    continue
+
+                for task in done:
+                    index, start = running.pop(task)
+                    stats = self.stats[self.names[index]]
+                    if task.exception() is not None:
+                        stats.record_failure(self.failure_threshold, self.cooldown)
+                        error = task.exception()
+                        # Fail over right away instead of waiting for the hedge delay
+                        if backups and not running:
+                            launch(backups.pop(0))
+                        continue
+                    stats.record_success(time.monotonic() - start)
+                    return ChatResult(generations=[ChatGeneration(message=task.result())])
+            raise error
+        finally:
+            now = time.monotonic()
+            for task, (index, start) in running.items():
+                self.stats[self.names[index]].record_lower_bound(now - start)
+                task.cancel()
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        order = self._order()
+        running = {}  # pending first chunk -> (provider index, iterator, start time)
+
+        def launch(index):
+            iterator = self.providers[index].astream(messages, config=_ISOLATED, stop=stop, **kwargs).__aiter__()
+            task = asyncio.ensure_future(iterator.__anext__())
+            running[task] = (index, iterator, time.monotonic())
+
+        launch(order[0])
+        backups = order[1:]
+        error = None
+        winner = None
+        try:
+            while running and winner is None:
+                timeout = None
+                if backups:
+                    first_index = next(iter(running.values()))[0]
+                    timeout = self._hedge_delay(first_index, streaming=True)
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                # No first token yet: hedge with the next provider
+                if not done:
+                    launch(backups.pop(0))
+                    continue
+
+                for task in done:
+                    index, iterator, start = running.pop(task)
+                    stats = self.stats[self.names[index]]
+                    exception = task.exception()
+                    if exception is not None and not isinstance(exception, StopAsyncIteration):
+                        stats.record_failure(self.failure_threshold, self.cooldown)
+                        error = exception
+                        if backups and not running:
+                            launch(backups.pop(0))
+                        continue
+                    stats.record_success(time.monotonic() - start, streaming=True)
+                    first = None if exception is not None else task.result()
+                    winner = (iterator, first)
+                    break
+        finally:
+            # Cancel the losers before streaming the winner
+            now = time.monotonic()
+            for index, _, start in running.values():
+                self.stats[self.names[index]].record_lower_bound(now - start, streaming=True)
+            await asyncio.gather(
+                *(self._discard(task, iterator) for task, (_, iterator, _) in running.items()),
+                return_exceptions=True,
+            )
+
+        if winner is None:
+            raise error
+
+        iterator, first = winner
+        if first is not None:
+            yield await self._emit(first, run_manager)
+            async for chunk in iterator:
+                yield await self._emit(chunk, run_manager)
+
+    async def _discard(self, task, iterator):
+        """Cancel a losing stream and close its connection."""
+        task.cancel()
+        try:
+            await task
+        except BaseException:
+            pass
+        await iterator.aclose()
+
+    async def _emit(self, chunk, run_manager):
+        generation = ChatGenerationChunk(message=chunk)
+        if run_manager and chunk.content:
+            await run_manager.on_llm_new_token(chunk.content, chunk=generation)
+        return generation
@@ -0,0 +1,72 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from passlib.context import CryptContext
+
+from backend.config.settings import get_settings
+
+
+class PasswordHasherBusyError(Exception):
+    """Raised when too many password hashes are already waiting to run."""
+
+
+class PasswordHasher:
+    """bcrypt hashing and verification in a bounded thread pool.
+
+    bcrypt is slow on purpose, so it runs off the event loop; it releases
+    the GIL while hashing, so the threads use several cores. At most
+    ``max_pending`` hashes run or wait at a time. Past that, callers get
+    PasswordHasherBusyError right away instead of a queue that grows
+    for as long as a burst of sign-ins lasts.
+    """
+
+    def __init__(self, rounds=None, workers=None, max_pending=None):
+        settings = get_settings()
+        self.rounds = rounds or settings.BCRYPT_ROUNDS
+        self.max_pending = max_pending or settings.PASSWORD_HASH_MAX_PENDING
+        # Hashes made with another work factor count as outdated
+        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=self.rounds)
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or settings.PASSWORD_HASH_WORKERS,
+            thread_name_prefix="bcrypt",
+        )
+        self._pending = 0
+
+    async def _run(self, func, *args):
+        if self._pending >= self.max_pending:
+            raise PasswordHasherBusyError("Too many sign-ins at once, please try again shortly")
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, partial(func, *args))
+        finally:
+            self._pending -= 1
+
+    async def hash(self, password):
+        return await self._run(self.context.hash, password)
+
+    async def verify_and_update(self, password, hashed):
+        """Check a password; returns (matches, new hash or None if ``hashed`` is current)."""
+        return await self._run(self.context.verify_and_update, password, hashed)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_hasher = None
+
+
+def get_password_hasher():
+    """Return the password hasher of this process, creating it if needed."""
+    global _hasher
+    if _hasher is None:
+        _hasher = PasswordHasher()
+    return _hasher
+
+
+def close_password_hasher():
+    global _hasher
+    if _hasher is not None:
+        _hasher.close()
+        _hasher = None
@@ -0,0 +1,192 @@
+import asyncio
+from collections import defaultdict
+from uuid import uuid4
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from backend.config.settings import get_settings
+from backend.db.models.conversation import Conversation
+from backend.db.mongodb import run_db
+
+
+class ConversationWriteQueue:
+    """Write-behind queue for the messages of a turn.
+
+    ``enqueue`` returns immediately; a background task collects pending
+    turns into ordered ``bulk_write`` batches and retries transient
+    failures. Each write is tagged with a write id so a retried batch never
+    appends the same messages twice. A batch still failing after
+    ``max_retries`` retries is dropped and reported, and ``wait_for``
+    tells the sessions concerned that their turn was not stored.
+
+    Until a session's writes are stored, its latest in-memory conversation
+    is kept and returned by ``get_conversation`` in place of a database read,
+    so the session always sees its own writes in this process. Turns are
+    serialized per session (see session_coordinator), so that object is
+    only ever used by one turn at a time.
+
+    Other processes cannot see queued turns. With more than one worker,
+    SESSION_LOCK_BACKEND must be "mongo": the session then stays locked
+    until its turn is stored (see ChatbotService._save_turn), so whichever
+    worker takes it next reads it from the database.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None, max_retries=None, retry_backoff=None):
+        settings = get_settings()
+        self.batch_size = batch_size or settings.WRITE_BEHIND_BATCH_SIZE
+        self.flush_interval = (
+            flush_interval if flush_interval is not None else settings.WRITE_BEHIND_FLUSH_INTERVAL_SECONDS
+        )
+        self.max_retries = max_retries if max_retries is not None else settings.WRITE_BEHIND_MAX_RETRIES
+        self.retry_backoff = (
+            retry_backoff if retry_backoff is not None else settings.WRITE_BEHIND_RETRY_BACKOFF_SECONDS
+        )
+
+        self._buffer = []  # (session_id, UpdateOne) in enqueue order
+        self._conversations = {}  # session_id -> conversation with unsaved writes
+        self._pending = defaultdict(int)  # session_id -> writes not yet stored
+        self._drained = {}  # session_id -> future resolved once its writes are done
+        self._failed = set()  # Sessions with a write dropped since their future was created
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._closing = False
+
+    def get_conversation(self, session_id):
+        """The session's conversation if it has writes not yet stored, else None."""
+        return self._conversations.get(session_id)
+
+    def enqueue(self, conversation, messages, **fields):
+        """Queue the turn's messages and field updates for ``conversation``."""
+        if self._closing:
+            raise RuntimeError("Write queue is closed")
+        query, update = conversation.new_messages_update(messages, write_id=uuid4().hex, **fields)
+
+        session_id = conversation.session_id
+        self._buffer.append((session_id, UpdateOne(query, update)))
+        self._conversations[session_id] = conversation
+        self._pending[session_id] += 1
+        if session_id not in self._drained:
+            self._drained[session_id] = asyncio.get_running_loop().create_future()
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    async def wait_for(self, session_id, timeout=None):
+        """Wait until every queued write of a session is done.
+
+        Returns True if they were all stored, and False if one was dropped
+        or they are still queued after ``timeout`` seconds.
+        """
+        future = self._drained.get(session_id)
+        if future is None:
+            return True
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return False
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Give concurrent turns a moment to join the batch
+            if self.flush_interval:
+                await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            while self._buffer:
+                await self._flush_batch()
+
+    async def _flush_batch(self):
+        """Write the oldest batch, retrying transient errors; drop it if they persist."""
+        batch = self._buffer[: self.batch_size]
+        operations = [operation for _, operation in batch]
+        collection = Conversation._get_collection()
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            try:
+                # Ordered, so a session's turns are applied in sequence
+                await run_db(collection.bulk_write, operations, ordered=True)
+                self._complete(batch, stored=True)
+                return
+            except BulkWriteError as e:
+                # Everything before the failed write was applied; the failed
+                # write itself was rejected by the server and is dropped
+                failed = e.details["writeErrors"][0]["index"]
+                print(f"Error writing queued messages for session {batch[failed][0]}: {e.details['writeErrors'][0]}")
+                self._complete(batch[:failed], stored=True)
+                self._complete(batch[failed : failed + 1], stored=False)
+                return
+            except PyMongoError as e:
+                print(f"Error writing {len(batch)} queued turns (attempt {attempt + 1}): {e}")
+
+        print(f"Error: dropping {len(batch)} queued turns after {self.max_retries + 1} failed attempts")
+        self._complete(batch, stored=False)
+
+    def _complete(self, batch, stored):
+        """Remove the oldest writes from the buffer, resolving sessions with none left."""
+        del self._buffer[: len(batch)]
+        for session_id, _ in batch:
+            if not stored:
+                self._failed.add(session_id)
+            self._pending[session_id] -= 1
+            if self._pending[session_id] == 0:
+                del self._pending[session_id]
+                self._conversations.pop(session_id, None)
+                self._drained.pop(session_id).set_result(session_id not in self._failed)
+                self._failed.discard(session_id)
+
+    async def close(self, timeout=None):
+        """Stop accepting writes and flush what is queued.
+
+        Returns the number of queued turns that could not be written.
+        """
+        self._closing = True
+        if self._task is None:
+            return 0
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+        async def drain():
+            while self._buffer:
+                await self._flush_batch()
+
+        try:
+            await asyncio.wait_for(drain(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        unwritten = len(self._buffer)
+        if unwritten:
+            print(f"Error: {unwritten} queued turns were not written before shutdown")
+            self._complete(list(self._buffer), stored=False)
+        return unwritten
+
+
+_write_queue = None
+
+
+def get_write_queue():
+    """Return the shared write queue, or None if write-behind is disabled."""
+    global _write_queue
+    settings = get_settings()
+    if _write_queue is None and settings.WRITE_BEHIND_ENABLED:
+        if settings.SESSION_LOCK_BACKEND != "mongo":
+            print(
+                "Warning: write-behind with in-process session locks is only safe with a single worker; "
+                "set SESSION_LOCK_BACKEND=mongo when running several"
+            )
+        _write_queue = ConversationWriteQueue()
+    return _write_queue
+
+
+async def close_write_queue():
+    """Flush queued writes; called before the MongoDB connection is closed."""
+    global _write_queue
+    if _write_queue is not None:
+        await _write_queue.close(timeout=get_settings().WRITE_BEHIND_SHUTDOWN_TIMEOUT_SECONDS)
+        _write_queue = None
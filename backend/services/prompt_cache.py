@@ -0,0 +1,399 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import Any
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from backend.config.settings import get_settings
+
+
+class CacheHandle:
+    """A provider-side cache entry holding the static prompt prefix."""
+
+    def __init__(self, name, expires_at):
+        self.name = name
+        self.expires_at = expires_at
+
+
+class ContextCacheProvider:
+    """Creates and manages provider-side caches for a prompt prefix."""
+
+    def create(self, model, system_prompt, tools, ttl_seconds):
+        """Cache the system prompt (and tool declarations) and return a CacheHandle."""
+        raise NotImplementedError
+
+    def extend(self, handle, ttl_seconds):
+        """Push back the expiry of a cache entry and return the updated handle."""
+        raise NotImplementedError
+
+    def delete(self, name):
+        """Delete a cache entry."""
+
+    def is_cache_error(self, error):
+        """Whether an LLM error means the cache entry is gone."""
+        return False
+
+    def note_request(self, name, hit):
+        """Called for every request that could have used the cache."""
+
+
+class GeminiContextCacheProvider(ContextCacheProvider):
+    """Gemini cached content holding the system instruction and tools."""
+
+    def __init__(self, api_key):
+        from google.ai.generativelanguage_v1beta import CacheServiceClient
+
+        self.client = CacheServiceClient(client_options={"api_key": api_key})
+
+    def create(self, model, system_prompt, tools, ttl_seconds):
+        from google.ai.generativelanguage_v1beta import CachedContent, Content, Part
+        from google.protobuf.duration_pb2 import Duration
+        from langchain_google_genai._function_utils import (
+            convert_to_genai_function_declarations,
+        )
+
+        cached_content = CachedContent(
+            model=model if model.startswith("models/") else f"models/{model}",
+            system_instruction=Content(parts=[Part(text=system_prompt)]),
+            ttl=Duration(seconds=ttl_seconds),
+        )
+        if tools:
+            cached_content.tools = [convert_to_genai_function_declarations(tools)]
+
+        result = self.client.create_cached_content(cached_content=cached_content)
+        return CacheHandle(result.name, result.expire_time)
+
+    def extend(self, handle, ttl_seconds):
+        from google.ai.generativelanguage_v1beta import CachedContent
+        from google.protobuf.duration_pb2 import Duration
+        from google.protobuf.field_mask_pb2 import FieldMask
+
+        result = self.client.update_cached_content(
+            cached_content=CachedContent(name=handle.name, ttl=Duration(seconds=ttl_seconds)),
+            update_mask=FieldMask(paths=["ttl"]),
+        )
+        return CacheHandle(result.name, result.expire_time)
+
+    def delete(self, name):
+        self.client.delete_cached_content(name=name)
+
+    def is_cache_error(self, error):
+        from google.api_core.exceptions import NotFound, PermissionDenied
+
+        return isinstance(error, (NotFound, PermissionDenied)) or "cachedcontent" in str(error).lower()
+
+
+class FakeContextCacheProvider(ContextCacheProvider):
+    """In-memory provider for offline use.
+
+    Records every cache entry created and every request that could have used
+    one, and expires entries on the same schedule a real provider would.
+    """
+
+    # Tools of every entry by name, so FakeChatModel can see the tools of a
+    # cached request the way a real provider would
+    cached_tools = {}
+
+    def __init__(self, now=None):
+        self.now = now or (lambda: datetime.now(tz=timezone.utc))
+        self.entries = {}  # name -> (model, system_prompt, tools, expires_at)
+        self.created = []
+        self.deleted = []
+        self.requests = []  # (cache name or None, hit)
+
+    def create(self, model, system_prompt, tools, ttl_seconds):
+        name = f"cachedContents/fake-{id(self):x}-{len(self.created) + 1}"
+        expires_at = self.now() + timedelta(seconds=ttl_seconds)
+        self.entries[name] = (model, system_prompt, tools, expires_at)
+        FakeContextCacheProvider.cached_tools[name] = tools
+        self.created.append(name)
+        return CacheHandle(name, expires_at)
+
+    def extend(self, handle, ttl_seconds):
+        if not self.is_live(handle.name):
+            raise LookupError(f"CachedContent {handle.name} not found")
+        model, system_prompt, tools, _ = self.entries[handle.name]
+        expires_at = self.now() + timedelta(seconds=ttl_seconds)
+        self.entries[handle.name] = (model, system_prompt, tools, expires_at)
+        return CacheHandle(handle.name, expires_at)
+
+    def delete(self, name):
+        self.entries.pop(name, None)
+        self.deleted.append(name)
+
+    def is_cache_error(self, error):
+        return isinstance(error, LookupError)
+
+    def is_live(self, name):
+        """Whether a cache entry exists and has not expired."""
+        entry = self.entries.get(name)
+        return entry is not None and entry[3] > self.now()
+
+    def note_request(self, name, hit):
+        self.requests.append((name, hit))
+
+    def expire_all(self):
+        """Drop every entry, as if the provider had evicted them."""
+        self.entries.clear()
+
+
+class PromptCacheManager:
+    """Keeps a provider cache entry alive for each static prompt prefix.
+
+    Entries are created on first use, extended shortly before they expire,
+    and dropped when the provider reports them gone; if creating one fails
+    requests fall back to sending the full prompt for a while. Also tracks
+    how many input tokens were served from the provider's cache, which is
+    reported for providers with implicit prefix caching too: logged every
+    ``log_interval_seconds`` and returned by get_stats().
+    """
+
+    def __init__(
+        self,
+        provider=None,
+        model=None,
+        ttl_seconds=None,
+        refresh_margin_seconds=None,
+        retry_after_seconds=60,
+        log_interval_seconds=None,
+    ):
+        settings = get_settings()
+        self.provider = provider
+        self.model = model
+        self.ttl_seconds = ttl_seconds or settings.PROMPT_CACHE_TTL_SECONDS
+        self.refresh_margin = timedelta(
+            seconds=refresh_margin_seconds or settings.PROMPT_CACHE_REFRESH_MARGIN_SECONDS
+        )
+        self.retry_after_seconds = retry_after_seconds
+        self.log_interval_seconds = (
+            log_interval_seconds if log_interval_seconds is not None else settings.PROMPT_CACHE_LOG_INTERVAL_SECONDS
+        )
+        self.stats = Counter()
+        self._logged_at = time.monotonic()
+
+        self._handles = {}  # prefix key -> CacheHandle
+        self._failed_until = {}  # prefix key -> monotonic time
+        self._refreshing = set()
+        self._refresh_tasks = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(system_prompt, tools):
+        digest = hashlib.sha256(system_prompt.encode("utf-8"))
+        if tools:
+            digest.update(json.dumps(tools, sort_keys=True, default=str).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _now(self):
+        if hasattr(self.provider, "now"):
+            return self.provider.now()
+        return datetime.now(tz=timezone.utc)
+
+    async def aget_handle(self, system_prompt, tools=None):
+        """Return the cache name to use for this prefix, or None to send it in full."""
+        if self.provider is None:
+            return None
+
+        key = self._key(system_prompt, tools)
+        handle = self._handles.get(key)
+        now = self._now()
+
+        if handle is not None and handle.expires_at > now:
+            # Extend the entry in the background; it stays valid meanwhile
+            if handle.expires_at - now < self.refresh_margin and key not in self._refreshing:
+                self._refreshing.add(key)
+                task = asyncio.create_task(asyncio.to_thread(self._refresh, key, handle, system_prompt, tools))
+                self._refresh_tasks.add(task)
+                task.add_done_callback(partial(self._refreshed, key))
+            return self._note(handle, hit=True)
+
+        if self._failed_until.get(key, 0) > time.monotonic():
+            return self._note(None, hit=False)
+
+        handle = await asyncio.to_thread(self._create, key, system_prompt, tools)
+        return self._note(handle, hit=False)
+
+    def _note(self, handle, hit):
+        name = handle.name if handle else None
+        self.stats["cache_hits" if hit else "cache_misses"] += 1
+        self.provider.note_request(name, hit)
+        return name
+
+    def _create(self, key, system_prompt, tools):
+        with self._lock:
+            # Another request may have created it while we waited
+            handle = self._handles.get(key)
+            if handle is not None and handle.expires_at > self._now():
+                return handle
+            try:
+                handle = self.provider.create(self.model, system_prompt, tools, self.ttl_seconds)
+            except Exception as e:
+                print(f"Error creating prompt cache, sending full prompt: {e}")
+                self._failed_until[key] = time.monotonic() + self.retry_after_seconds
+                return None
+            self._handles[key] = handle
+            self.stats["caches_created"] += 1
+            return handle
+
+    def _refresh(self, key, handle, system_prompt, tools):
+        try:
+            self._handles[key] = self.provider.extend(handle, self.ttl_seconds)
+            self.stats["caches_extended"] += 1
+        except Exception as e:
+            print(f"Error extending prompt cache {handle.name}: {e}")
+            self._handles.pop(key, None)
+            self._create(key, system_prompt, tools)
+
+    def _refreshed(self, key, task):
+        self._refresh_tasks.discard(task)
+        self._refreshing.discard(key)
+
+    def invalidate(self, name):
+        """Forget a cache entry the provider no longer has."""
+        for key, handle in list(self._handles.items()):
+            if handle.name == name:
+                del self._handles[key]
+        self.stats["caches_invalidated"] += 1
+
+    def is_cache_error(self, error):
+        return self.provider is not None and self.provider.is_cache_error(error)
+
+    def record_usage(self, usage):
+        """Count the input tokens of a response and how many were served from the provider's cache."""
+        if not usage:
+            return
+        self.stats["input_tokens"] += usage.get("input_tokens", 0)
+        self.stats["cached_tokens"] += (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+
+        now = time.monotonic()
+        if self.log_interval_seconds and now - self._logged_at >= self.log_interval_seconds:
+            self._logged_at = now
+            stats = self.get_stats()
+            print(
+                f"Prompt cache ({self.model}): {stats['cached_share']:.0%} of {stats['input_tokens']} input tokens "
+                f"read from cache, {stats.get('cache_hits', 0)} hits, {stats.get('cache_misses', 0)} misses"
+            )
+
+    def get_stats(self):
+        """Counters since startup, with the share of input tokens read from the cache."""
+        stats = dict(self.stats)
+        stats["cached_share"] = self.stats["cached_tokens"] / max(self.stats["input_tokens"], 1)
+        return stats
+
+
+class PromptCachingChatModel(BaseChatModel):
+    """Chat model wrapper that serves the static prompt prefix from a provider cache.
+
+    When the manager has a cache entry for the leading system message (and
+    bound tools), the request is sent with ``cached_content`` instead of the
+    prefix. Later system messages are sent as user messages, since a cached
+    request cannot also carry a system instruction. If the provider reports
+    the entry gone, the request is retried with the full prompt.
+    """
+
+    inner: BaseChatModel
+    prompt_cache: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return f"prompt-caching-{self.inner._llm_type}"
+
+    @property
+    def _identifying_params(self):
+        return self.inner._identifying_params
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    async def _prepare(self, messages, kwargs):
+        """Return the messages and kwargs to send, and the cache name used."""
+        if self.prompt_cache is None or not messages or not isinstance(messages[0], SystemMessage):
+            return messages, kwargs, None
+        if kwargs.get("tool_choice"):
+            return messages, kwargs, None
+
+        name = await self.prompt_cache.aget_handle(messages[0].content, kwargs.get("tools"))
+        if name is None:
+            return messages, kwargs, None
+
+        cached_messages = [
+            HumanMessage(content=message.content) if isinstance(message, SystemMessage) else message
+            for message in messages[1:]
+        ]
+        cached_kwargs = {k: v for k, v in kwargs.items() if k != "tools"}
+        cached_kwargs["cached_content"] = name
+        return cached_messages, cached_kwargs, name
+
+    def _record(self, message):
+        if self.prompt_cache is not None:
+            self.prompt_cache.record_usage(getattr(message, "usage_metadata", None))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        # The synchronous path is unused by the service; send the full prompt
+        result = self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        self._record(result.generations[0].message)
+        return result
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        send_messages, send_kwargs, name = await self._prepare(messages, kwargs)
+        try:
+            result = await self.inner._agenerate(
+                send_messages, stop=stop, run_manager=run_manager, **send_kwargs
+            )
+        except Exception as e:
+            if name is None or not self.prompt_cache.is_cache_error(e):
+                raise
+            print(f"Prompt cache {name} expired, retrying with the full prompt")
+            self.prompt_cache.invalidate(name)
+            result = await self.inner._agenerate(
+                messages, stop=stop, run_manager=run_manager, **kwargs
+            )
+        self._record(result.generations[0].message)
+        return result
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        for chunk in self.inner._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            self._record(chunk.message)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        send_messages, send_kwargs, name = await self._prepare(messages, kwargs)
+        started = False
+        try:
+            async for chunk in self.inner._astream(
+                send_messages, stop=stop, run_manager=run_manager, **send_kwargs
+            ):
+                started = True
+                self._record(chunk.message)
+                yield chunk
+        except Exception as e:
+            # Only retry if nothing has been streamed to the caller yet
+            if started or name is None or not self.prompt_cache.is_cache_error(e):
+                raise
+            print(f"Prompt cache {name} expired, retrying with the full prompt")
+            self.prompt_cache.invalidate(name)
+            async for chunk in self.inner._astream(
+                messages, stop=stop, run_manager=run_manager, **kwargs
+            ):
+                self._record(chunk.message)
+                yield chunk
+
+
+def get_prompt_cache(model_provider, model_name, api_key=None):
+    """Create the prompt cache manager for a model provider."""
+    settings = get_settings()
+    provider = None
+    if settings.PROMPT_CACHE_ENABLED and model_provider == "gemini":
+        provider = GeminiContextCacheProvider(api_key)
+    elif settings.PROMPT_CACHE_ENABLED and model_provider == "fake":
+        provider = FakeContextCacheProvider()
+    # Other providers cache stable prefixes implicitly; usage is still tracked
+    return PromptCacheManager(provider=provider, model=model_name)
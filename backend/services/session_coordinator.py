@@ -0,0 +1,191 @@
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+from cachetools import TTLCache
+from pymongo.errors import DuplicateKeyError
+
+from backend.config.settings import get_settings
+from backend.db.models.session_lock import SessionLock
+from backend.db.mongodb import run_db
+
+
+class SessionBusyError(Exception):
+    """Raised when a session stays locked by another request for too long."""
+
+
+class InProcessSessionLocks:
+    """Per-session locks for requests handled by this worker process."""
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout or get_settings().SESSION_LOCK_TIMEOUT_SECONDS
+        # session_id -> [lock, number of holders and waiters]
+        self._locks = {}
+
+    @asynccontextmanager
+    async def hold(self, session_id):
+        """Hold the lock for a session; a missing session_id is not locked."""
+        if not session_id:
+            yield
+            return
+
+        entry = self._locks.setdefault(session_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            try:
+                await asyncio.wait_for(entry[0].acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                raise SessionBusyError(f"Session {session_id} is busy")
+            try:
+                yield
+            finally:
+                entry[0].release()
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[session_id]
+
+
+class MongoSessionLocks:
+    """Per-session locks shared by all workers through leases in MongoDB.
+
+    Requests within one process queue on an in-process lock first, so only
+    one of them polls MongoDB for the lease at a time.
+    """
+
+    def __init__(self, timeout=None, lease_seconds=None, poll_interval=0.1):
+        settings = get_settings()
+        self.timeout = timeout or settings.SESSION_LOCK_TIMEOUT_SECONDS
+        self.lease = timedelta(seconds=lease_seconds or settings.SESSION_LOCK_LEASE_SECONDS)
+        self.poll_interval = poll_interval
+        self._local = InProcessSessionLocks(timeout=self.timeout)
+
+    def _try_acquire(self, session_id, owner):
+        now = datetime.now(tz=timezone.utc)
+        try:
+            # Matches only a free or expired lease; otherwise the upsert
+            # collides with the existing document
+            SessionLock._get_collection().update_one(
+                {"_id": session_id, "expires_at": {"$lt": now}},
+                {"$set": {"owner": owner, "expires_at": now + self.lease}},
+                upsert=True,
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    def _release(self, session_id, owner):
+        SessionLock._get_collection().delete_one({"_id": session_id, "owner": owner})
+
+    @asynccontextmanager
+    async def hold(self, session_id):
+        """Hold the lease for a session; a missing session_id is not locked."""
+        if not session_id:
+            yield
+            return
+
+        async with self._local.hold(session_id):
+            owner = uuid4().hex
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.timeout
+            delay = self.poll_interval
+            while not await run_db(self._try_acquire, session_id, owner):
+                if loop.time() + delay > deadline:
+                    raise SessionBusyError(f"Session {session_id} is busy")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 1.0)
+            try:
+                yield
+            finally:
+                await run_db(self._release, session_id, owner)
+
+
+def get_session_locks():
+    """Create the session lock backend selected in settings."""
+    if get_settings().SESSION_LOCK_BACKEND == "mongo":
+        return MongoSessionLocks()
+    return InProcessSessionLocks()
+
+
+class TurnResultCache:
+    """Replies to turns that may be submitted twice.
+
+    A turn is identified by its session and the client's idempotency key,
+    or by its session and message text when no key is sent. While a turn
+    is running, an identical one waits for its reply instead of calling
+    the LLM again. Once finished, only replies to turns with an
+    idempotency key are kept (for IDEMPOTENCY_KEY_TTL_SECONDS): without a
+    key, the same message sent again later is a new turn, since users do
+    repeat themselves ("כן", "לא"). Turns without a session (a new
+    conversation) are never deduplicated, since nothing ties a key to its
+    conversation yet.
+    """
+
+    def __init__(self, maxsize=10000, key_ttl=None):
+        self._results = TTLCache(maxsize=maxsize, ttl=key_ttl or get_settings().IDEMPOTENCY_KEY_TTL_SECONDS)
+        self._running = {}  # key -> future of the reply of the turn being processed
+
+    @staticmethod
+    def make_key(session_id, user_message, idempotency_key=None):
+        """Build the key of a turn, or None if it cannot be deduplicated."""
+        if not session_id:
+            return None
+        if idempotency_key:
+            # Scoped to the session, so another session reusing the key gets its own reply
+            digest = hashlib.sha256(f"{session_id}\0{idempotency_key}".encode("utf-8"))
+            return f"key:{digest.hexdigest()}"
+        digest = hashlib.sha256(f"{session_id}\0{user_message}".encode("utf-8"))
+        return f"msg:{digest.hexdigest()}"
+
+    def get(self, key):
+        """Return the stored reply to a finished turn with this key, if any."""
+        if key is None:
+            return None
+        return self._results.get(key)
+
+    async def reply_to(self, key):
+        """Reply to an identical turn, finished or still running, or None.
+
+        A running turn that fails gives None, and the caller processes its
+        turn itself.
+        """
+        if key is None:
+            return None
+        reply = self._results.get(key)
+        if reply is not None:
+            return reply
+        future = self._running.get(key)
+        if future is None:
+            return None
+        return await asyncio.shield(future)
+
+    @asynccontextmanager
+    async def running(self, key):
+        """Mark the turn with this key as in progress until the block exits.
+
+        The block reports the reply with put(); identical turns arriving
+        meanwhile get it from reply_to().
+        """
+        if key is None or key in self._running:
+            yield
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._running[key] = future
+        try:
+            yield
+        finally:
+            del self._running[key]
+            if not future.done():
+                future.set_result(None)
+
+    def put(self, key, reply):
+        """Report the reply of a turn."""
+        if key is None:
+            return
+        future = self._running.get(key)
+        if future is not None and not future.done():
+            future.set_result(reply)
+        if key.startswith("key:"):
+            self._results[key] = reply
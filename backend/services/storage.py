@@ -0,0 +1,441 @@
+import asyncio
+import hashlib
+import hmac
+import mimetypes
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from urllib.parse import quote, urlencode
+
+import google.auth
+from cachetools import TLRUCache
+from google.api_core.exceptions import NotFound
+from google.auth.transport.requests import AuthorizedSession
+from google.cloud import storage
+from google.oauth2 import service_account
+from requests.adapters import HTTPAdapter
+
+from backend.config.settings import get_settings
+
+
+class StorageBackend:
+    """Object store holding the vault media.
+
+    Objects are addressed by name (e.g. ``uploads/images/cat.jpg``) and
+    described by dicts with ``name``, ``size``, ``content_type``,
+    ``updated`` (aware datetime) and ``generation`` (changes whenever the
+    object is overwritten). Calls block, so async code should run them
+    with run_storage().
+    """
+
+    def open_writer(self, name, content_type=None):
+        """Start writing ``name`` and return a writer.
+
+        The writer has ``write(data)``, ``close()``, which completes the
+        object and returns its description, and ``abort()``. Only a bounded
+        part of the data is buffered, so objects can be streamed in.
+        """
+        raise NotImplementedError
+
+    def upload_file(self, name, fileobj, content_type=None):
+        """Store the contents of ``fileobj`` under ``name`` and return its description."""
+        writer = self.open_writer(name, content_type)
+        try:
+            while True:
+                chunk = fileobj.read(1024 * 1024)
+                if not chunk:
+                    break
+                writer.write(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.close()
+
+    def move(self, source, destination):
+        """Rename an object and return the description of ``destination``."""
+        raise NotImplementedError
+
+    def download_to_file(self, name, path):
+        """Copy the contents of ``name`` to the local file ``path``."""
+        raise NotImplementedError
+
+    def open_reader(self, name):
+        """Open ``name`` for reading as a binary file object, fetched in chunks."""
+        raise NotImplementedError
+
+    def hash_object(self, name):
+        """Hex SHA-256 of the contents of ``name``."""
+        digest = hashlib.sha256()
+        with self.open_reader(name) as f:
+            for chunk in iter(partial(f.read, 1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def list_objects(self, prefix):
+        """Describe the objects whose names start with ``prefix``."""
+        raise NotImplementedError
+
+    def describe(self, name):
+        """Description of ``name``, or None if there is no such object."""
+        raise NotImplementedError
+
+    def signed_url(self, name, expiration):
+        """Return a URL that allows downloading ``name`` for ``expiration`` (a timedelta)."""
+        raise NotImplementedError
+
+    def upload_url(self, name, expiration, content_type, resumable=False):
+        """Return how a client may upload ``name`` directly, without the API in between.
+
+        The result has the ``url``, the HTTP ``method`` and the ``headers``
+        the request must carry. With ``resumable``, the request starts a
+        resumable upload session where the backend supports it.
+        """
+        raise NotImplementedError
+
+    def delete(self, name):
+        """Remove ``name`` if it exists."""
+        raise NotImplementedError
+
+
+class GCSStorage(StorageBackend):
+    """Google Cloud Storage bucket.
+
+    One client is shared by all requests: the service account key is read
+    once, access tokens are refreshed by the authorized session when they
+    expire, and its HTTP connection pool keeps connections to GCS alive.
+    """
+
+    def __init__(self, bucket_name, credentials_path=None, pool_size=32, chunk_size=8 * 1024 * 1024):
+        scopes = ["https://www.googleapis.com/auth/devstorage.read_write"]
+        if credentials_path:
+            credentials = service_account.Credentials.from_service_account_file(credentials_path, scopes=scopes)
+            project = credentials.project_id
+        else:
+            credentials, project = google.auth.default(scopes=scopes)
+
+        session = AuthorizedSession(credentials)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+
+        self.client = storage.Client(project=project, credentials=credentials, _http=session)
+        self.bucket = self.client.bucket(bucket_name)
+        self.chunk_size = chunk_size  # Resumable upload chunk, buffered in memory per upload
+
+    @staticmethod
+    def _describe(blob):
+        return {
+            "name": blob.name,
+            "size": blob.size,
+            "content_type": blob.content_type,
+            "updated": blob.updated,
+            "generation": blob.generation,
+        }
+
+    def open_writer(self, name, content_type=None):
+        return _GCSWriter(self.bucket.blob(name), content_type, self.chunk_size)
+
+    def move(self, source, destination):
+        source_blob = self.bucket.blob(source)
+        blob = self.bucket.blob(destination)
+        # Server-side copy; large objects take several rewrite calls
+        token, _, _ = blob.rewrite(source_blob)
+        while token is not None:
+            token, _, _ = blob.rewrite(source_blob, token=token)
+        source_blob.delete()
+        blob.reload()
+        return self._describe(blob)
+
+    def list_objects(self, prefix):
+        return [
+            self._describe(blob) for blob in self.client.list_blobs(self.bucket, prefix=prefix)
+            if not blob.name.endswith("/")
+        ]
+
+    def download_to_file(self, name, path):
+        self.bucket.blob(name).download_to_filename(path)
+
+    def open_reader(self, name):
+        return self.bucket.blob(name).open("rb", chunk_size=self.chunk_size)
+
+    def describe(self, name):
+        blob = self.bucket.get_blob(name)
+        return self._describe(blob) if blob is not None else None
+
+    def signed_url(self, name, expiration):
+        return self.bucket.blob(name).generate_signed_url(expiration=expiration, method="GET")
+
+    def upload_url(self, name, expiration, content_type, resumable=False):
+        blob = self.bucket.blob(name)
+        if resumable:
+            # The POST returns a session URI in its Location header that takes the data
+            # (https://cloud.google.com/storage/docs/performing-resumable-uploads)
+            headers = {"Content-Type": content_type, "x-goog-resumable": "start"}
+            url = blob.generate_signed_url(
+                version="v4", expiration=expiration, method="RESUMABLE", content_type=content_type
+            )
+            return {"url": url, "method": "POST", "headers": headers}
+        url = blob.generate_signed_url(version="v4", expiration=expiration, method="PUT", content_type=content_type)
+        return {"url": url, "method": "PUT", "headers": {"Content-Type": content_type}}
+
+    def delete(self, name):
+        try:
+            self.bucket.blob(name).delete()
+        except NotFound:
+            pass
+
+
+class _GCSWriter:
+    def __init__(self, blob, content_type, chunk_size):
+        self.blob = blob
+        self._file = blob.open("wb", chunk_size=chunk_size, content_type=content_type, ignore_flush=True)
+
+    def write(self, data):
+        self._file.write(data)
+
+    def close(self):
+        self._file.close()
+        self.blob.reload()
+        return GCSStorage._describe(self.blob)
+
+    def abort(self):
+        if not self._file.closed:
+            self._file.terminate()
+
+
+class LocalStorage(StorageBackend):
+    """Object store in a local directory, for development, tests and benchmarks.
+
+    Signed URLs point at the API's ``/storage`` route and carry an HMAC of
+    the method, object name and expiry time, checked by verify_signature().
+    Uploads through them are plain PUTs, there are no resumable sessions.
+    """
+
+    def __init__(self, root, base_url, secret):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip("/")
+        self.secret = secret.encode("utf-8")
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, name):
+        """Filesystem path of ``name``; names may not leave the storage root."""
+        path = os.path.abspath(os.path.join(self.root, name))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Invalid object name: {name}")
+        return path
+
+    def _describe(self, name, path):
+        stat = os.stat(path)
+        return {
+            "name": name,
+            "size": stat.st_size,
+            "content_type": mimetypes.guess_type(name)[0] or "application/octet-stream",
+            "updated": datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc),
+            "generation": stat.st_mtime_ns,
+        }
+
+    def open_writer(self, name, content_type=None):
+        return _LocalWriter(self, name)
+
+    def move(self, source, destination):
+        path = self.path(destination)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self.path(source), path)
+        return self._describe(destination, path)
+
+    def list_objects(self, prefix):
+        directory = os.path.dirname(prefix)
+        start = self.path(directory) if directory else self.root
+        objects = []
+        for dirpath, _, filenames in os.walk(start):
+            for filename in filenames:
+                if filename.startswith(".upload-"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, self.root).replace(os.sep, "/")
+                if name.startswith(prefix):
+                    objects.append(self._describe(name, path))
+        return sorted(objects, key=lambda item: item["name"])
+
+    def download_to_file(self, name, path):
+        shutil.copyfile(self.path(name), path)
+
+    def open_reader(self, name):
+        return open(self.path(name), "rb")
+
+    def describe(self, name):
+        path = self.path(name)
+        return self._describe(name, path) if os.path.isfile(path) else None
+
+    def _signature(self, method, name, expires):
+        message = f"{method}\n{name}\n{expires}".encode("utf-8")
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+
+    def _signed(self, method, name, expiration):
+        expires = int(time.time() + expiration.total_seconds())
+        query = urlencode({"expires": expires, "signature": self._signature(method, name, expires)})
+        return f"{self.base_url}/{quote(name)}?{query}"
+
+    def signed_url(self, name, expiration):
+        return self._signed("GET", name, expiration)
+
+    def upload_url(self, name, expiration, content_type, resumable=False):
+        return {"url": self._signed("PUT", name, expiration), "method": "PUT", "headers": {"Content-Type": content_type}}
+
+    def verify_signature(self, name, expires, signature, method="GET"):
+        """Whether a signed URL for ``method`` on ``name`` is authentic and not expired."""
+        if expires < time.time():
+            return False
+        return hmac.compare_digest(self._signature(method, name, expires), signature)
+
+    def delete(self, name):
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+
+class _LocalWriter:
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+        self.path = storage.path(name)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Write beside the target and rename, so readers never see a partial object
+        fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix=".upload-")
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, data):
+        self._file.write(data)
+
+    def close(self):
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+        return self.storage._describe(self.name, self.path)
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.unlink(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+class SignedUrlCache:
+    """Signed download URLs, reused until they are close to expiring.
+
+    URLs are keyed by object name and generation, so an overwritten object
+    gets a new one. Signing (an RSA signature per URL on GCS) only happens
+    for objects without a fresh URL, in batches on the storage executor.
+    """
+
+    def __init__(self, storage, expiration, refresh_margin, maxsize=100000, batch_size=64):
+        self.storage = storage
+        self.expiration = expiration
+        self.refresh_margin = refresh_margin
+        self.batch_size = batch_size
+        # Each value is (url, seconds to reuse it)
+        self._urls = TLRUCache(maxsize=maxsize, ttu=lambda _key, value, now: now + value[1])
+
+    def _sign_batch(self, names):
+        return [self.storage.signed_url(name, self.expiration) for name in names]
+
+    async def sign_all(self, items):
+        """Return a download URL for each object description in ``items``."""
+        urls = [None] * len(items)
+        cold = []  # (position, key)
+        for position, item in enumerate(items):
+            key = (item["name"], item["generation"])
+            cached = self._urls.get(key)
+            if cached is not None:
+                urls[position] = cached[0]
+            else:
+                cold.append((position, key))
+
+        batches = [cold[start : start + self.batch_size] for start in range(0, len(cold), self.batch_size)]
+        signed = await asyncio.gather(
+            *(run_storage(self._sign_batch, [key[0] for _, key in batch]) for batch in batches)
+        )
+        # Signed URLs are valid for ``expiration`` from now; stop handing them out ``refresh_margin`` earlier
+        reuse_seconds = (self.expiration - self.refresh_margin).total_seconds()
+        for batch, batch_urls in zip(batches, signed):
+            for (position, key), url in zip(batch, batch_urls):
+                urls[position] = url
+                if reuse_seconds > 0:
+                    self._urls[key] = (url, reuse_seconds)
+        return urls
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """Return the storage backend selected by STORAGE_BACKEND, creating it once."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                settings = get_settings()
+                if settings.STORAGE_BACKEND == "local":
+                    _storage = LocalStorage(
+                        settings.LOCAL_STORAGE_DIR, settings.LOCAL_STORAGE_BASE_URL, settings.LOCAL_STORAGE_SECRET
+                    )
+                else:
+                    _storage = GCSStorage(
+                        settings.GCS_BUCKET_NAME,
+                        settings.GOOGLE_APPLICATION_CREDENTIALS,
+                        pool_size=settings.STORAGE_HTTP_POOL_SIZE,
+                        chunk_size=settings.STORAGE_UPLOAD_CHUNK_BYTES,
+                    )
+    return _storage
+
+
+_signed_url_cache = None
+
+
+def get_signed_url_cache():
+    """Return the shared cache of vault download URLs."""
+    global _signed_url_cache
+    if _signed_url_cache is None:
+        settings = get_settings()
+        _signed_url_cache = SignedUrlCache(
+            get_storage(),
+            timedelta(minutes=settings.VAULT_URL_EXPIRY_MINUTES),
+            timedelta(minutes=settings.VAULT_URL_REFRESH_MARGIN_MINUTES),
+            maxsize=settings.VAULT_URL_CACHE_SIZE,
+        )
+    return _signed_url_cache
+
+
+# Dedicated pool for blocking storage calls made from async handlers
+_storage_executor = None
+
+
+def get_storage_executor():
+    """Return the thread pool used for storage access, creating it if needed."""
+    global _storage_executor
+    if _storage_executor is None:
+        _storage_executor = ThreadPoolExecutor(
+            max_workers=get_settings().STORAGE_EXECUTOR_WORKERS,
+            thread_name_prefix="storage",
+        )
+    return _storage_executor
+
+
+async def run_storage(func, *args, **kwargs):
+    """Run a blocking storage call in the storage executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_storage_executor(), partial(func, *args, **kwargs))
+
+
+def close_storage():
+    """Shut down the storage executor after the running calls finish."""
+    global _storage_executor
+    if _storage_executor is not None:
+        _storage_executor.shutdown(wait=True)
+        _storage_executor = None
@@ -0,0 +1,334 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from backend.config.settings import get_settings
+from backend.services.bm25_index import BM25Index, reciprocal_rank_fusion
+from backend.services.embeddings import embedding_model_name, get_embeddings
+
+
+def story_text(story):
+    """Text of a story that is embedded and searched."""
+    return f"{story.get('title', '')}\n{story.get('content', '')}"
+
+
+def load_stories(path):
+    """Load the story corpus, a JSON list of story dicts with unique ids."""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_atomic(path, text):
+    """Replace the file at ``path`` so readers see either the old or the new content."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def corpus_hash(stories):
+    """Hash identifying the searchable content of a corpus."""
+    digest = hashlib.sha256()
+    for story in stories:
+        digest.update(story["id"].encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(story_text(story).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class StoryIndex:
+    """Story vectors for top-k cosine similarity search.
+
+    Vectors are stored as one float32 matrix with L2-normalized rows, so a
+    query is a single matrix-vector product followed by a partial sort.
+    Search time is bound by reading the matrix, so vectors are cut to
+    EMBEDDING_DIMENSIONS; the supported embedding models are trained so
+    that a prefix of the vector is itself a usable embedding. ``lexical``
+    is a BM25 index over the same stories for exact-wording matches.
+    """
+
+    def __init__(self, stories, vectors, model, source_hash=None, lexical=None):
+        self.stories = stories  # In row order
+        self.vectors = vectors
+        self.model = model
+        self.source_hash = source_hash or corpus_hash(stories)
+        self.lexical = lexical
+        self.embedded_count = 0  # Stories embedded by build(), the rest were reused
+        self._rows = {story["id"]: row for row, story in enumerate(stories)}
+
+    def __len__(self):
+        return len(self.stories)
+
+    @classmethod
+    def build(cls, stories, embeddings, dimensions=None, batch_size=256, previous=None):
+        """Embed a corpus and build its index.
+
+        Stories whose text is unchanged in ``previous`` (an index built with
+        the same model) keep their vectors; only the others are embedded.
+        """
+        dimensions = dimensions or get_settings().EMBEDDING_DIMENSIONS
+        model = embedding_model_name(embeddings)
+        if previous is not None and (previous.model != model or previous.vectors.shape[1] != dimensions):
+            previous = None
+
+        vectors = np.zeros((len(stories), dimensions), dtype=np.float32)
+        pending = []  # Rows to embed
+        for row, story in enumerate(stories):
+            old_row = previous._rows.get(story["id"]) if previous is not None else None
+            if old_row is not None and story_text(previous.stories[old_row]) == story_text(story):
+                vectors[row] = previous.vectors[old_row]
+            else:
+                pending.append(row)
+
+        for start in range(0, len(pending), batch_size):
+            rows = pending[start : start + batch_size]
+            embedded = embeddings.embed_documents([story_text(stories[row]) for row in rows])
+            vectors[rows] = normalize(embedded, dimensions)
+
+        # The lexical index is cheap to rebuild and its statistics depend on the whole corpus
+        lexical = BM25Index.build([story["id"] for story in stories], [story_text(story) for story in stories])
+        index = cls(stories, vectors, model, lexical=lexical)
+        index.embedded_count = len(pending)
+        return index
+
+    def get_story(self, story_id):
+        """Return the story with this id."""
+        return self.stories[self._rows[story_id]]
+
+    def search(self, query_vector, k, exclude_ids=()):
+        """Return up to ``k`` ``(story, score)`` pairs, best first."""
+        if not self.stories or k <= 0:
+            return []
+        scores = self.vectors @ normalize([query_vector], self.vectors.shape[1])[0]
+
+        excluded = [self._rows[story_id] for story_id in exclude_ids if story_id in self._rows]
+        if excluded:
+            scores[excluded] = -np.inf
+        k = min(k, len(self.stories) - len(set(excluded)))
+        if k <= 0:
+            return []
+
+        # Partial sort: only the top k rows are ordered
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.stories[row], float(scores[row])) for row in top]
+
+    def save(self, directory):
+        """Write the index to ``directory``."""
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "vectors.npy"), self.vectors)
+        meta = {"model": self.model, "source_hash": self.source_hash, "stories": self.stories}
+        with open(os.path.join(directory, "stories.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        if self.lexical is not None:
+            self.lexical.save(os.path.join(directory, "bm25"))
+
+    @classmethod
+    def load(cls, directory):
+        """Load a saved index, memory-mapping the vectors and postings."""
+        with open(os.path.join(directory, "stories.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        lexical = None
+        if os.path.exists(os.path.join(directory, "bm25", "index.json")):
+            lexical = BM25Index.load(os.path.join(directory, "bm25"))
+        return cls(meta["stories"], vectors, meta["model"], meta["source_hash"], lexical=lexical)
+
+
+def normalize(vectors, dimensions=None):
+    """Return ``vectors`` as a float32 matrix with unit-length rows.
+
+    With ``dimensions`` only the first that many components are kept.
+    """
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.size == 0:
+        return matrix.reshape(0, dimensions or 0)
+    if dimensions:
+        matrix = matrix[:, :dimensions]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+CURRENT_VERSION_FILE = "CURRENT"
+SYNCED_STORIES_FILE = "synced_stories.json"  # Corpus from the last sync, used instead of STORIES_PATH
+KEPT_INDEX_VERSIONS = 3  # Older versions may still be memory-mapped by other workers
+
+
+def current_version(index_dir):
+    """Name of the index version that should be served, if any."""
+    try:
+        with open(os.path.join(index_dir, CURRENT_VERSION_FILE), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def save_version(index, index_dir):
+    """Save ``index`` as a new version under ``index_dir`` and return its name.
+
+    The version is not served until it is made current with set_current_version().
+    """
+    version = f"{int(time.time() * 1000)}-{index.source_hash[:12]}"
+    index.save(os.path.join(index_dir, "versions", version))
+    return version
+
+
+def set_current_version(index_dir, version):
+    """Point ``index_dir`` at ``version`` and remove old versions."""
+    write_atomic(os.path.join(index_dir, CURRENT_VERSION_FILE), version)
+
+    versions_dir = os.path.join(index_dir, "versions")
+    # Names start with a millisecond timestamp, so they sort by age
+    for old in sorted(os.listdir(versions_dir))[:-KEPT_INDEX_VERSIONS]:
+        if old != version:
+            shutil.rmtree(os.path.join(versions_dir, old), ignore_errors=True)
+
+
+class StoryRetriever:
+    """Finds the stories most similar to a conversation.
+
+    The index is built from STORIES_PATH on first use, or loaded from the
+    current version in STORY_INDEX_DIR if it is up to date. publish()
+    serves a new index and makes it current on disk; other processes pick
+    it up with reload_if_changed(). Synced stories are kept in
+    STORY_INDEX_DIR and take the place of STORIES_PATH from then on, so
+    the corpus shipped with the code is never rewritten.
+    """
+
+    def __init__(self, embeddings=None, stories_path=None, index_dir=None):
+        settings = get_settings()
+        self.embeddings = embeddings or get_embeddings()
+        self.stories_path = stories_path or settings.STORIES_PATH
+        self.index_dir = index_dir if index_dir is not None else settings.STORY_INDEX_DIR
+        self._index = None
+        self._version = None
+        self._rejected_version = None
+        self._lock = threading.Lock()
+
+    def get_index(self):
+        """Return the current index, loading or building it if needed."""
+        index = self._index
+        if index is None:
+            with self._lock:
+                if self._index is None:
+                    self._load_or_build()
+                index = self._index
+        return index
+
+    def _load_version(self, version):
+        """Load a saved version, or return None if it does not fit the current settings."""
+        index = StoryIndex.load(os.path.join(self.index_dir, "versions", version))
+        if (
+            index.model == embedding_model_name(self.embeddings)
+            and index.lexical is not None
+            and index.vectors.shape[1] == get_settings().EMBEDDING_DIMENSIONS
+        ):
+            return index
+        return None
+
+    def _corpus_path(self):
+        if self.index_dir:
+            synced = os.path.join(self.index_dir, SYNCED_STORIES_FILE)
+            if os.path.exists(synced):
+                return synced
+        return self.stories_path
+
+    def _load_or_build(self):
+        stories = load_stories(self._corpus_path())
+        version = current_version(self.index_dir) if self.index_dir else None
+        previous = None
+        if version:
+            try:
+                previous = self._load_version(version)
+                if previous is not None and previous.source_hash == corpus_hash(stories):
+                    self.swap(previous, version)
+                    return
+            except Exception as e:
+                print(f"Error loading story index: {e}")
+
+        # Out of date: only stories that changed since the saved version are embedded
+        self.publish(StoryIndex.build(stories, self.embeddings, previous=previous), write_stories=False)
+
+    def publish(self, index, write_stories=True):
+        """Serve ``index`` and store it, with its stories, as the current version."""
+        version = save_version(index, self.index_dir) if self.index_dir else None
+        if write_stories and self.index_dir:
+            write_atomic(
+                os.path.join(self.index_dir, SYNCED_STORIES_FILE),
+                json.dumps(index.stories, ensure_ascii=False, indent=2),
+            )
+        if version:
+            set_current_version(self.index_dir, version)
+        self.swap(index, version)
+
+    def swap(self, index, version=None):
+        """Replace the index; searches already running finish on the old one."""
+        self._index = index
+        self._version = version
+
+    def reload_if_changed(self):
+        """Serve the current version on disk if another process published a new one.
+
+        Returns True if the index was swapped.
+        """
+        if not self.index_dir or self._index is None:
+            return False
+        version = current_version(self.index_dir)
+        if not version or version == self._version:
+            return False
+        with self._lock:
+            if version == self._version:
+                return False
+            index = self._load_version(version)
+            if index is None:
+                if version != self._rejected_version:
+                    print(f"Error loading story index: version {version} does not match the embedding settings")
+                    self._rejected_version = version
+                return False
+            self.swap(index, version)
+        return True
+
+    def search(self, text, k=None, exclude_ids=()):
+        """Return the ``k`` stories best matching ``text`` as ``(story, score)`` pairs.
+
+        The semantic (vector) and lexical (BM25) rankings of the top
+        candidates are combined with reciprocal rank fusion; the score is
+        the fused one.
+        """
+        k = k or get_settings().MAX_STORIES_TO_RETURN
+        index = self.get_index()
+        candidates = max(k * 10, 50)
+
+        rankings = [
+            [story["id"] for story, _ in index.search(self.embeddings.embed_query(text), candidates, exclude_ids)]
+        ]
+        if index.lexical is not None:
+            rankings.append([story_id for story_id, _ in index.lexical.search(text, candidates, exclude_ids)])
+
+        fused = reciprocal_rank_fusion(rankings)[:k]
+        return [(index.get_story(story_id), score) for story_id, score in fused]
+
+
+_retriever = None
+
+
+def get_story_retriever():
+    """Return the shared story retriever."""
+    global _retriever
+    if _retriever is None:
+        _retriever = StoryRetriever()
+    return _retriever
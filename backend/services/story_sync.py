@@ -0,0 +1,149 @@
+"""Sync the story corpus from the editors' spreadsheet.
+
+Rows are compared with the served corpus by hash; when any changed, a
+new index is built in which only stories with new text are embedded,
+then published for the serving processes to pick up. The synced corpus
+is stored in STORY_INDEX_DIR; STORIES_PATH is left as shipped.
+
+The sheet needs a header row with the columns id, title, content and
+reflection_question. A CSV or XLSX export with the same columns can be
+used instead, e.g. offline:
+
+    python -m backend.services.story_sync
+    python -m backend.services.story_sync --source stories.xlsx
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import threading
+
+from backend.config.settings import get_settings
+from backend.services.story_index import StoryIndex, get_story_retriever
+
+STORY_COLUMNS = ("id", "title", "content", "reflection_question")
+
+_sync_lock = threading.Lock()  # One sync at a time per process
+
+
+def read_rows(source):
+    """Return the rows of ``source`` as dicts keyed by header.
+
+    ``source`` is a .csv or .xlsx path, or a Google Sheets id.
+    """
+    if source.lower().endswith(".csv"):
+        # utf-8-sig drops the BOM that spreadsheet exports add
+        with open(source, encoding="utf-8-sig", newline="") as f:
+            return list(csv.DictReader(f))
+
+    if source.lower().endswith(".xlsx"):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise RuntimeError("Reading .xlsx files requires openpyxl (pip install openpyxl)")
+        workbook = load_workbook(source, read_only=True, data_only=True)
+        try:
+            values = list(workbook.worksheets[0].iter_rows(values_only=True))
+        finally:
+            workbook.close()
+        if not values:
+            return []
+        header = [str(cell or "") for cell in values[0]]
+        return [dict(zip(header, row)) for row in values[1:]]
+
+    import gspread
+
+    settings = get_settings()
+    client = gspread.service_account(filename=settings.GOOGLE_APPLICATION_CREDENTIALS)
+    spreadsheet = client.open_by_key(source)
+    worksheet = (
+        spreadsheet.worksheet(settings.STORY_SHEET_WORKSHEET)
+        if settings.STORY_SHEET_WORKSHEET
+        else spreadsheet.sheet1
+    )
+    # Keep every cell as text; ids like "007" must not become numbers
+    return worksheet.get_all_records(numericise_ignore=["all"])
+
+
+def rows_to_stories(rows):
+    """Convert sheet rows to story dicts, skipping rows without an id or content."""
+    stories = []
+    seen = set()
+    for number, row in enumerate(rows, start=2):  # Row 1 is the header
+        row = {str(key).strip().lower(): value for key, value in row.items() if key}
+        story = {column: str(row.get(column) or "").strip() for column in STORY_COLUMNS}
+        if not story["id"] or not story["content"]:
+            continue
+        if story["id"] in seen:
+            print(f"Error syncing stories: duplicate id {story['id']} in row {number}, skipped")
+            continue
+        seen.add(story["id"])
+        stories.append(story)
+    return stories
+
+
+def row_hash(story):
+    """Hash of every field of a story row."""
+    return hashlib.sha256(json.dumps(story, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def diff_stories(old_stories, new_stories):
+    """Count the added, updated, removed and unchanged stories."""
+    old_hashes = {story["id"]: row_hash(story) for story in old_stories}
+    new_hashes = {story["id"]: row_hash(story) for story in new_stories}
+    return {
+        "added": sum(1 for story_id in new_hashes if story_id not in old_hashes),
+        "updated": sum(
+            1 for story_id, digest in new_hashes.items() if story_id in old_hashes and old_hashes[story_id] != digest
+        ),
+        "removed": sum(1 for story_id in old_hashes if story_id not in new_hashes),
+        "unchanged": sum(1 for story_id, digest in new_hashes.items() if old_hashes.get(story_id) == digest),
+    }
+
+
+def sync_stories(source=None, retriever=None, force=False):
+    """Pull the stories from ``source`` and publish a new index if any changed.
+
+    Returns the change counts, with the number of stories that were embedded.
+    """
+    settings = get_settings()
+    source = source or settings.STORY_SYNC_SOURCE or settings.GOOGLE_SHEETS_ID
+    retriever = retriever or get_story_retriever()
+
+    stories = rows_to_stories(read_rows(source))
+    with _sync_lock:
+        return _publish_changes(stories, retriever, force)
+
+
+def _publish_changes(stories, retriever, force):
+    current = retriever.get_index()
+    changes = diff_stories(current.stories, stories)
+    unchanged = not (changes["added"] or changes["updated"] or changes["removed"])
+    # Stories are kept in row order, so a reordered sheet is a change too
+    same_order = [story["id"] for story in stories] == [story["id"] for story in current.stories]
+    if unchanged and same_order and not force:
+        changes["embedded"] = 0
+        return changes
+
+    index = StoryIndex.build(stories, retriever.embeddings, previous=current)
+    retriever.publish(index)
+    changes["embedded"] = index.embedded_count
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", help="CSV/XLSX path or Google Sheets id (default: STORY_SYNC_SOURCE or GOOGLE_SHEETS_ID)")
+    parser.add_argument("--force", action="store_true", help="Publish a new index even if nothing changed")
+    args = parser.parse_args()
+
+    changes = sync_stories(args.source, force=args.force)
+    print(
+        f"Stories: {changes['added']} added, {changes['updated']} updated, {changes['removed']} removed, "
+        f"{changes['unchanged']} unchanged; {changes['embedded']} embedded"
+    )
+
+
+if __name__ == "__main__":
+    main()
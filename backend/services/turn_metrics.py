@@ -0,0 +1,98 @@
+import time
+
+from langchain_core.callbacks import AsyncCallbackHandler
+
+# Tag for the agent run, so its LLM calls can be told from router and summary calls
+AGENT_TAG = "agent"
+
+
+class TurnMetrics(AsyncCallbackHandler):
+    """Latency and token accounting for one chat turn.
+
+    Passed as a callback to the chain or agent run, it counts LLM calls,
+    token usage, tool calls and time to first token. Database and history
+    timings are added by the service through ``timed``. The result is
+    stored in the assistant message's metadata (see ``to_metadata``).
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.path = None
+        self.route = None  # Why the path was chosen (see TurnRouter)
+        self.model = None
+        self.llm_calls = 0
+        self.agent_iterations = 0
+        self.llm_seconds = 0.0
+        self.first_token_seconds = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.tool_calls = []
+        self.timings = {}  # Step name -> seconds
+        self._llm_starts = {}
+
+    async def timed(self, name, awaitable):
+        """Await ``awaitable`` and add its duration to the ``name`` timing."""
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    async def on_chat_model_start(self, serialized, messages, *, run_id, tags=None, metadata=None, **kwargs):
+        self._llm_starts[run_id] = time.perf_counter()
+        if tags and AGENT_TAG in tags:
+            # Each agent iteration is one LLM call inside the agent run
+            self.agent_iterations += 1
+        if self.model is None and metadata:
+            self.model = metadata.get("ls_model_name")
+
+    async def on_llm_new_token(self, token, *, run_id, **kwargs):
+        if self.first_token_seconds is None and token:
+            self.first_token_seconds = time.perf_counter() - self.started
+
+    async def on_llm_end(self, response, *, run_id, **kwargs):
+        start = self._llm_starts.pop(run_id, None)
+        if start is not None:
+            self.llm_seconds += time.perf_counter() - start
+        self.llm_calls += 1
+
+        message = getattr(response.generations[0][0], "message", None)
+        if message is None:
+            return
+        model = message.response_metadata.get("model_name")
+        if model:
+            self.model = model
+        usage = getattr(message, "usage_metadata", None) or {}
+        self.prompt_tokens += usage.get("input_tokens", 0)
+        self.completion_tokens += usage.get("output_tokens", 0)
+        self.cached_tokens += (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+
+    async def on_llm_error(self, error, *, run_id, **kwargs):
+        self._llm_starts.pop(run_id, None)
+
+    async def on_tool_start(self, serialized, input_str, **kwargs):
+        self.tool_calls.append((serialized or {}).get("name") or kwargs.get("name"))
+
+    def to_metadata(self):
+        """Metrics in the form stored in ``Message.metadata``."""
+        metadata = {
+            "model": self.model,
+            "path": self.path,
+            "route": self.route,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "llm_calls": self.llm_calls,
+            "tool_calls": self.tool_calls,
+            "llm_ms": round(self.llm_seconds * 1000),
+            "total_ms": round((time.perf_counter() - self.started) * 1000),
+        }
+        if self.path == "agent":
+            metadata["agent_iterations"] = self.agent_iterations
+        if self.first_token_seconds is not None:
+            # Measured from the start of the turn, as the user experiences it
+            metadata["ttft_ms"] = round(self.first_token_seconds * 1000)
+        for name, seconds in self.timings.items():
+            metadata[f"{name}_ms"] = round(seconds * 1000)
+        return metadata
@@ -0,0 +1,143 @@
+import re
+from collections import Counter
+
+from langchain.prompts import ChatPromptTemplate
+
+from backend.config.settings import get_settings
+
+
+AGENT = "agent"
+CHAT = "chat"
+
+# Words in the user's message that may call for the auth tools. Only
+# nouns, infinitives and imperatives are listed, and they must match whole
+# words: "התחברתי לסיפור" ("I related to the story") is not a login.
+AUTH_WORDS = (
+    "הרשמה", "להירשם", "הירשם", "הירשמי", "להתחבר", "התחבר", "התחברי", "התחברות",
+    "כניסה", "סיסמה", "סיסמא", "מייל", "אימייל",
+    "login", "log in", "sign in", "register", "sign up", "password", "email",
+)
+# One-letter Hebrew prefixes ("and", "the", "to", "that"...) a word may carry
+HEBREW_PREFIXES = "ובלשהמכ"
+# Phrases in the assistant's last message that offer a story
+STORY_OFFER_WORDS = ("סיפור", "לשתף אותך", "לשמוע איך", "story")
+# Replies that accept an offer
+CONSENT_WORDS = (
+    "כן", "בטח", "אשמח", "בשמחה", "רוצה", "יאללה", "סבבה", "אוקיי", "בסדר", "למה לא",
+    "yes", "sure", "ok",
+)
+# The user asking for a story without being offered one
+STORY_REQUEST_WORDS = ("סיפור", "story")
+
+_EMAIL = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+")
+
+
+class TurnRouter:
+    """Decides per turn whether the tools agent is needed.
+
+    The tools (login, registration and story fetching) are only relevant in
+    a few conversation states, so cheap rules on the conversation pick the
+    path and most turns go through the plain chat chain with a single LLM
+    call. Turns the rules cannot settle go to the classifier chain (see
+    ``build_classifier``) if one is given, and to the agent otherwise.
+    Counts per path and reason are kept in ``stats``.
+    """
+
+    def __init__(self, min_user_messages_for_story=None):
+        self.min_user_messages_for_story = (
+            min_user_messages_for_story
+            if min_user_messages_for_story is not None
+            else get_settings().STORY_MIN_USER_MESSAGES
+        )
+        self.stats = Counter()  # (path, reason) -> turns
+
+    @staticmethod
+    def build_classifier(llm, prompts):
+        """Classifier chain for undecided turns, or None if TURN_ROUTER_CLASSIFIER is off."""
+        if not get_settings().TURN_ROUTER_CLASSIFIER:
+            return None
+        return ChatPromptTemplate.from_template(prompts.TOOL_ROUTER_PROMPT) | llm
+
+    async def route(self, conversation, user_message, classifier=None, config=None):
+        """Return ``(path, reason)`` for the current turn.
+
+        ``conversation.messages`` already ends with the user's message;
+        ``config`` is passed to the classifier run.
+        """
+        path, reason = self._apply_rules(conversation, user_message)
+        if path is None:
+            path, reason = await self._classify(conversation, user_message, classifier, config)
+        self.stats[(path, reason)] += 1
+        return path, reason
+
+    def _apply_rules(self, conversation, user_message):
+        messages = conversation.messages
+        # Intro + the current user message
+        if len(messages) < 2:
+            return CHAT, "opening"
+
+        text = user_message.lower()
+        last_assistant = next(
+            (m.content.lower() for m in reversed(messages[:-1]) if m.role == "assistant"), ""
+        )
+
+        if _EMAIL.search(user_message) or _contains_word(text, AUTH_WORDS, HEBREW_PREFIXES):
+            return AGENT, "auth"
+        # Continuing a registration or login the assistant started
+        if _contains_word(last_assistant, AUTH_WORDS, HEBREW_PREFIXES):
+            return AGENT, "auth_followup"
+
+        user_messages = sum(1 for m in messages if m.role == "user")
+        if user_messages < self.min_user_messages_for_story:
+            return CHAT, "too_early_for_story"
+        if _contains(last_assistant, STORY_OFFER_WORDS) and _contains_word(text, CONSENT_WORDS):
+            return AGENT, "story_consent"
+        if _contains(text, STORY_REQUEST_WORDS):
+            # Asking is not consenting to an offer; let the classifier decide
+            return None, "story_mention"
+        return CHAT, "no_tool_needed"
+
+    async def _classify(self, conversation, user_message, classifier, config):
+        if classifier is None:
+            return AGENT, "unclassified"
+        last_assistant = next(
+            (m.content for m in reversed(conversation.messages[:-1]) if m.role == "assistant"), ""
+        )
+        try:
+            result = await classifier.ainvoke(
+                {"last_assistant": last_assistant, "user_message": user_message}, config=config
+            )
+        except Exception as e:
+            print(f"Error classifying turn: {e}")
+            return AGENT, "classifier_error"
+        answer = str(getattr(result, "content", result)).strip().lower()
+        if answer.startswith("yes"):
+            return AGENT, "classifier"
+        return CHAT, "classifier"
+
+    def get_stats(self):
+        """Turn counts per path, with the share of each and a breakdown by reason."""
+        totals = Counter()
+        for (path, _), count in self.stats.items():
+            totals[path] += count
+        total = sum(totals.values())
+        return {
+            "total": total,
+            "paths": {
+                path: {"turns": count, "share": count / total} for path, count in totals.items()
+            },
+            "reasons": {f"{path}:{reason}": count for (path, reason), count in self.stats.items()},
+        }
+
+
+def _contains(text, words):
+    return any(word in text for word in words)
+
+
+def _contains_word(text, words, prefixes=""):
+    """Like _contains, but only whole words count ("כן" but not "לכן").
+
+    A word may start with up to two of the given ``prefixes`` letters.
+    """
+    prefix = f"[{prefixes}]{{0,2}}" if prefixes else ""
+    return any(re.search(rf"(?<!\w){prefix}{re.escape(word)}(?!\w)", text) for word in words)
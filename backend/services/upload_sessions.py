@@ -0,0 +1,280 @@
+"""Resumable vault uploads for large files over unreliable connections.
+
+A client creates a session, sends the file in chunks with
+``PUT /vault/sessions/{session_id}?offset=N`` and completes the session
+once everything has arrived. Each chunk is streamed into its own part
+object, so a dropped connection only loses the chunk in flight (the bytes
+that did arrive are kept) and the client asks for the session's offset to
+carry on from there. Completion streams the parts into one object,
+hashing it on the way, and adds it to the vault like any other upload.
+
+Sessions without new chunks for VAULT_SESSION_TTL_HOURS are removed with
+their parts by the API, or with:
+
+    python -m backend.services.upload_sessions --gc
+"""
+
+import argparse
+import hashlib
+import secrets
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+from pymongo import ReturnDocument
+from starlette.requests import ClientDisconnect
+
+from backend.config.settings import get_settings
+from backend.db.models.upload_session import UploadSession
+from backend.db.models.vault_item import VAULT_CATEGORIES, VaultItem
+from backend.db.mongodb import connect_to_mongo, run_db
+from backend.services.storage import get_storage, run_storage
+from backend.services.vault_blobs import store_blob
+from backend.services.vault_index import new_item_id
+from backend.services.vault_uploads import READ_CHUNK_BYTES, STAGING_PREFIX, UploadError, register_upload, safe_filename
+
+SESSION_PREFIX = "uploads/.sessions/"
+
+
+class SessionNotFoundError(LookupError):
+    """No such upload session for this user, or it has expired."""
+
+
+class OffsetMismatchError(Exception):
+    """A chunk does not start where the session's data ends."""
+
+    def __init__(self, offset):
+        super().__init__(f"The upload continues at offset {offset}")
+        self.offset = offset
+
+
+def _expiry(now):
+    return now + timedelta(hours=get_settings().VAULT_SESSION_TTL_HOURS)
+
+
+def create_session(owner, category, filename, content_type=None, size=None):
+    if category not in VAULT_CATEGORIES:
+        raise UploadError(f"Invalid category: {category}")
+    if size is not None and size <= 0:
+        raise UploadError("Invalid size")
+    now = datetime.now(tz=timezone.utc)
+    session = UploadSession(
+        session_id=secrets.token_urlsafe(24),
+        owner=owner,
+        category=category,
+        filename=safe_filename(filename),
+        content_type=content_type or "application/octet-stream",
+        size=size,
+        item_id=new_item_id(),
+        expires_at=_expiry(now),
+        created_at=now,
+        updated_at=now,
+    )
+    session.save(force_insert=True)
+    return session
+
+
+def get_session(session_id, owner):
+    session = UploadSession.objects(pk=session_id, owner=owner).first()
+    if session is None:
+        raise SessionNotFoundError("Upload session not found")
+    return session
+
+
+def commit_part(session, offset, part):
+    """Append a stored part if the session still ends at ``offset``; returns the new offset or None."""
+    now = datetime.now(tz=timezone.utc)
+    document = UploadSession._get_collection().find_one_and_update(
+        {"_id": session.session_id, "status": "open", "offset": offset},
+        {
+            "$push": {"parts": part},
+            "$inc": {"offset": part["size"]},
+            "$set": {"expires_at": _expiry(now), "updated_at": now},
+        },
+        return_document=ReturnDocument.AFTER,
+    )
+    return document["offset"] if document else None
+
+
+async def write_chunk(session_id, owner, offset, chunks):
+    """Store the byte chunks of the async iterable ``chunks`` at ``offset``.
+
+    The data goes to a part object of its own, with at most
+    READ_CHUNK_BYTES (plus the storage writer's buffer) in memory. If the
+    client disconnects, the part is kept with whatever arrived. Returns
+    the session's new offset.
+    """
+    settings = get_settings()
+    storage = get_storage()
+    session = await run_db(get_session, session_id, owner)
+    if session.status != "open":
+        raise UploadError("The upload has already been completed")
+    if offset != session.offset:
+        raise OffsetMismatchError(session.offset)
+    if len(session.parts) >= settings.VAULT_SESSION_MAX_PARTS:
+        raise UploadError("Too many chunks; send larger ones")
+
+    # Unique per attempt, so a retried chunk never overwrites the one still arriving
+    part_name = f"{SESSION_PREFIX}{session_id}/{offset:016d}-{uuid4().hex[:8]}"
+    writer = await run_storage(storage.open_writer, part_name)
+    received = 0
+    pending = bytearray()
+    try:
+        try:
+            async for chunk in chunks:
+                if session.size is not None and offset + received + len(pending) + len(chunk) > session.size:
+                    raise UploadError("The chunk goes past the declared size")
+                pending += chunk
+                if len(pending) >= READ_CHUNK_BYTES:
+                    await run_storage(writer.write, bytes(pending))
+                    received += len(pending)
+                    pending.clear()
+        except ClientDisconnect:
+            pass  # Keep what arrived; the client resumes after it
+        if pending:
+            await run_storage(writer.write, bytes(pending))
+            received += len(pending)
+        if not received:
+            await run_storage(writer.abort)
+            return session.offset
+    except BaseException:
+        await run_storage(writer.abort)
+        raise
+
+    stored = await run_storage(writer.close)
+    new_offset = await run_db(commit_part, session, offset, {"name": part_name, "offset": offset, "size": stored["size"]})
+    if new_offset is None:
+        # Another request for this offset won, or the session was completed or removed
+        await run_storage(storage.delete, part_name)
+        session = await run_db(get_session, session_id, owner)
+        raise OffsetMismatchError(session.offset)
+    return new_offset
+
+
+def claim_session(session_id, owner):
+    """Start completing a session; returns it, or None if it is not open."""
+    now = datetime.now(tz=timezone.utc)
+    lease_until = now + timedelta(seconds=get_settings().VAULT_SESSION_COMPLETE_SECONDS)
+    document = UploadSession._get_collection().find_one_and_update(
+        {
+            "_id": session_id,
+            "owner": owner,
+            "$or": [{"status": "open"}, {"status": "completing", "lease_until": {"$lte": now}}],
+        },
+        {"$set": {"status": "completing", "lease_until": lease_until, "updated_at": now}},
+        return_document=ReturnDocument.AFTER,
+    )
+    return UploadSession._from_son(document) if document else None
+
+
+def finish_session(session, status):
+    """Set the session ``status`` (open again after a failure, or done)."""
+    now = datetime.now(tz=timezone.utc)
+    UploadSession.objects(pk=session.session_id).update_one(
+        set__status=status, unset__lease_until=True, set__expires_at=_expiry(now), set__updated_at=now
+    )
+
+
+async def assemble_parts(parts, name, content_type):
+    """Stream part objects into ``name``; returns its description and SHA-256."""
+    storage = get_storage()
+    digest = hashlib.sha256()
+
+    def write(writer, chunk):
+        # On the storage executor, so hashing stays off the event loop
+        digest.update(chunk)
+        writer.write(chunk)
+
+    writer = await run_storage(storage.open_writer, name, content_type)
+    try:
+        for part in parts:
+            reader = await run_storage(storage.open_reader, part["name"])
+            try:
+                while chunk := await run_storage(reader.read, READ_CHUNK_BYTES):
+                    await run_storage(write, writer, chunk)
+            finally:
+                await run_storage(reader.close)
+    except BaseException:
+        await run_storage(writer.abort)
+        raise
+    return await run_storage(writer.close), digest.hexdigest()
+
+
+async def complete_session(session_id, owner):
+    """Add a fully received session to the vault and return the new vault item.
+
+    Completing a session again returns the same item.
+    """
+    storage = get_storage()
+    session = await run_db(get_session, session_id, owner)
+    if session.status == "done":
+        item = await run_db(VaultItem.objects(id=session.item_id).first)
+        if item is None:
+            raise SessionNotFoundError("The uploaded file no longer exists")
+        return item
+    if session.size is not None and session.offset != session.size:
+        raise UploadError(f"Only {session.offset} of {session.size} bytes have been received")
+    if not session.parts:
+        raise UploadError("No data has been received")
+    session = await run_db(claim_session, session_id, owner)
+    if session is None:
+        raise UploadError("The upload is already being completed")
+
+    staged_name = f"{STAGING_PREFIX}{session.item_id}"
+    try:
+        _, content_hash = await assemble_parts(session.parts, staged_name, session.content_type)
+        stored = await store_blob(staged_name, content_hash)
+        item = await register_upload(
+            session.item_id, owner, session.category, session.filename, stored, content_hash, session.content_type
+        )
+    except BaseException:
+        await run_storage(storage.delete, staged_name)
+        await run_db(finish_session, session, "open")
+        raise
+
+    await run_db(finish_session, session, "done")
+    for part in session.parts:
+        try:
+            await run_storage(storage.delete, part["name"])
+        except Exception as e:
+            print(f"Error deleting upload part {part['name']}: {e}")  # Removed with the session later
+    return item
+
+
+def collect_expired_sessions(storage=None):
+    """Remove expired sessions and their stored parts; returns how many were removed."""
+    storage = storage or get_storage()
+    now = datetime.now(tz=timezone.utc)
+    expired = UploadSession.objects(
+        __raw__={
+            "expires_at": {"$lte": now},
+            "$or": [{"status": {"$ne": "completing"}}, {"lease_until": {"$lte": now}}],
+        }
+    )
+    removed = 0
+    for session in expired:
+        try:
+            for stored in storage.list_objects(f"{SESSION_PREFIX}{session.session_id}/"):
+                storage.delete(stored["name"])
+            if session.status != "done":
+                storage.delete(f"{STAGING_PREFIX}{session.item_id}")  # Left by an interrupted completion
+            session.delete()
+            removed += 1
+        except Exception as e:
+            print(f"Error removing upload session {session.session_id}: {e}")
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gc", action="store_true", help="Remove abandoned upload sessions")
+    args = parser.parse_args()
+    if not args.gc:
+        parser.print_help()
+        return
+
+    connect_to_mongo()
+    print(f"Removed {collect_expired_sessions()} upload sessions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Cost and latency report over the per-turn metrics in Message.metadata.
+
+    python -m backend.services.usage_report --days 7 --group-by day,model
+"""
+
+import argparse
+import json
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from backend.config.settings import get_settings
+from backend.db.models.conversation import Conversation
+
+
+GROUP_FIELDS = ("day", "model", "entry_source", "path", "route")
+
+
+def turn_cost(metrics, prices=None):
+    """Cost of one turn in USD, or None if the model has no known price."""
+    prices = prices if prices is not None else get_settings().MODEL_PRICES
+    model = metrics.get("model") or ""
+    # Longest matching prefix, so dated model versions use their family's price
+    matches = [name for name in prices if model.startswith(name)]
+    if not matches:
+        return None
+    price = prices[max(matches, key=len)]
+
+    cached = metrics.get("cached_tokens", 0)
+    uncached = max(metrics.get("prompt_tokens", 0) - cached, 0)
+    return (
+        uncached * price["input"]
+        + cached * price["cached_input"]
+        + metrics.get("completion_tokens", 0) * price["output"]
+    ) / 1_000_000
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+def collect_turns(since):
+    """Fetch the metrics of every assistant turn since ``since``."""
+    pipeline = [
+        # updated_at is indexed and bounds every message timestamp
+        {"$match": {"updated_at": {"$gte": since}}},
+        {"$unwind": "$messages"},
+        {
+            "$match": {
+                "messages.role": "assistant",
+                "messages.timestamp": {"$gte": since},
+                "messages.metadata.llm_calls": {"$exists": True},
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "entry_source": 1,
+                "timestamp": "$messages.timestamp",
+                "metrics": "$messages.metadata",
+            }
+        },
+    ]
+    return list(Conversation._get_collection().aggregate(pipeline))
+
+
+def usage_report(days=7, group_by=("day", "model", "entry_source")):
+    """Summarize turn counts, tokens, cost and latency percentiles per group."""
+    unknown = set(group_by) - set(GROUP_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown group fields: {', '.join(sorted(unknown))}")
+
+    since = datetime.now(tz=timezone.utc) - timedelta(days=days)
+    groups = defaultdict(list)
+    for turn in collect_turns(since):
+        metrics = turn["metrics"]
+        values = {
+            "day": turn["timestamp"].strftime("%Y-%m-%d"),
+            "model": metrics.get("model") or "unknown",
+            "entry_source": turn.get("entry_source") or "direct",
+            "path": metrics.get("path") or "unknown",
+            "route": metrics.get("route") or "unknown",
+        }
+        groups[tuple(values[field] for field in group_by)].append(metrics)
+
+    rows = []
+    for key, turns in sorted(groups.items()):
+        costs = [cost for cost in (turn_cost(turn) for turn in turns) if cost is not None]
+        latencies = [turn["total_ms"] for turn in turns if "total_ms" in turn]
+        llm_latencies = [turn["llm_ms"] for turn in turns if "llm_ms" in turn]
+        ttfts = [turn["ttft_ms"] for turn in turns if "ttft_ms" in turn]
+        row = dict(zip(group_by, key))
+        row.update(
+            {
+                "turns": len(turns),
+                "prompt_tokens": sum(turn.get("prompt_tokens", 0) for turn in turns),
+                "completion_tokens": sum(turn.get("completion_tokens", 0) for turn in turns),
+                "cached_tokens": sum(turn.get("cached_tokens", 0) for turn in turns),
+                "tool_calls": sum(len(turn.get("tool_calls") or []) for turn in turns),
+                "cost_usd": sum(costs),
+                "cost_p50_usd": _percentile(costs, 50),
+                "cost_p95_usd": _percentile(costs, 95),
+                "latency_p50_ms": _percentile(latencies, 50),
+                "latency_p95_ms": _percentile(latencies, 95),
+                "llm_p95_ms": _percentile(llm_latencies, 95),
+                "ttft_p50_ms": _percentile(ttfts, 50),
+                "ttft_p95_ms": _percentile(ttfts, 95),
+            }
+        )
+        rows.append(row)
+    return rows
+
+
+def main():
+    from backend.db.mongodb import close_mongo_connection, connect_to_mongo
+
+    parser = argparse.ArgumentParser(description="Report LLM cost and latency per turn.")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument(
+        "--group-by", default="day,model,entry_source", help=f"Comma-separated: {', '.join(GROUP_FIELDS)}"
+    )
+    parser.add_argument("--json", action="store_true", help="Print the rows as JSON")
+    args = parser.parse_args()
+
+    if not connect_to_mongo():
+        raise SystemExit(1)
+    try:
+        group_by = tuple(field.strip() for field in args.group_by.split(",") if field.strip())
+        rows = usage_report(days=args.days, group_by=group_by)
+    finally:
+        close_mongo_connection()
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+
+    header = "".join(f"{field:<20}" for field in group_by)
+    print(f"{header}{'turns':>7}{'cost $':>10}{'p50 ms':>9}{'p95 ms':>9}{'ttft p95':>10}")
+    for row in rows:
+        groups = "".join(f"{str(row[field]):<20}" for field in group_by)
+        ttft = row["ttft_p95_ms"] if row["ttft_p95_ms"] is not None else "-"
+        print(
+            f"{groups}{row['turns']:>7}{row['cost_usd']:>10.4f}"
+            f"{row['latency_p50_ms'] or 0:>9}{row['latency_p95_ms'] or 0:>9}{ttft:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""Content-addressed storage of vault files.
+
+Uploads are hashed (SHA-256) while they stream in and stored once, under
+``blobs/sha256/``. A VaultBlob record counts the vault items referring to
+the contents, so identical files share one object, and a user adding a
+file that is already in their vault does not have to send it again.
+
+The record is referenced before its object is written, and a release
+claims it (``deleting``) before deleting the object, so storing
+contents again while their last reference is being released never
+leaves a record whose object was deleted.
+
+Files stored before deduplication are hashed and merged with:
+
+    python -m backend.services.vault_blobs --backfill --owner user@example.com
+
+Bucket objects without a vault item are registered on the way, as files
+of ``--owner`` (see vault_index).
+"""
+
+import argparse
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from backend.db.models.media_job import MediaJob
+from backend.db.models.vault_blob import VaultBlob
+from backend.db.models.vault_item import VaultItem
+from backend.db.mongodb import connect_to_mongo, run_db
+from backend.services import vault_index
+from backend.services.storage import get_storage, run_storage
+
+BLOB_PREFIX = "blobs/sha256/"
+DELETE_CLAIM_SECONDS = 60  # A release claim older than this was abandoned by a crashed worker
+RESERVE_TIMEOUT_SECONDS = 10  # Longest store_blob() waits for a release to finish
+
+
+def blob_name(content_hash):
+    # Two-character fan-out keeps listings of the prefix manageable
+    return f"{BLOB_PREFIX}{content_hash[:2]}/{content_hash}"
+
+
+def acquire_blob(content_hash):
+    """Add a reference to the stored blob with this hash and return it, or None if there is none."""
+    document = VaultBlob._get_collection().find_one_and_update(
+        {"_id": content_hash, "ref_count": {"$gt": 0}, "deleting": {"$ne": True}, "object_name": {"$ne": None}},
+        {"$inc": {"ref_count": 1}, "$set": {"updated_at": datetime.now(tz=timezone.utc)}},
+        return_document=ReturnDocument.AFTER,
+    )
+    return VaultBlob._from_son(document) if document else None
+
+
+def acquire_owned_blob(owner, content_hash):
+    """Like acquire_blob(), but only for contents ``owner`` already has in the vault.
+
+    Knowing a hash is not proof of having the file, so clients may only
+    skip sending files they have uploaded before.
+    """
+    if VaultItem.objects(owner=owner, content_hash=content_hash).only("id").first() is None:
+        return None
+    return acquire_blob(content_hash)
+
+
+def reserve_blob(content_hash):
+    """Add a reference to the record of contents about to be stored, creating it.
+
+    Returns False while the record is claimed by a release; the contents
+    can be stored again once it is gone. A claim abandoned for
+    DELETE_CLAIM_SECONDS is taken over, and the record treated as new.
+    """
+    collection = VaultBlob._get_collection()
+    now = datetime.now(tz=timezone.utc)
+    try:
+        collection.find_one_and_update(
+            {"_id": content_hash, "deleting": {"$ne": True}},
+            {"$inc": {"ref_count": 1}, "$set": {"updated_at": now}, "$setOnInsert": {"created_at": now}},
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        pass
+    taken_over = collection.find_one_and_update(
+        {"_id": content_hash, "deleting": True, "updated_at": {"$lt": now - timedelta(seconds=DELETE_CLAIM_SECONDS)}},
+        {
+            "$set": {"deleting": False, "ref_count": 1, "updated_at": now},
+            # Its objects may be gone; the blob is written again by the caller
+            # and its derivatives are queued again
+            "$unset": {"object_name": "", "size": "", "generation": "", "derivatives": ""},
+        },
+    )
+    if taken_over is None:
+        return False
+    MediaJob.objects(content_hash=content_hash).delete()
+    return True
+
+
+def record_stored(content_hash, stored):
+    """Describe the object just written under blob_name() on its reserved record.
+
+    When the same contents were stored concurrently, the last write wins;
+    the objects are identical.
+    """
+    collection = VaultBlob._get_collection()
+    document = collection.find_one_and_update(
+        {"_id": content_hash},
+        {
+            "$set": {
+                "object_name": stored["name"],
+                "size": stored["size"],
+                "generation": stored["generation"],
+                "updated_at": datetime.now(tz=timezone.utc),
+            }
+        },
+        return_document=ReturnDocument.AFTER,
+    )
+    if document.get("content_type") is None:
+        # As sent by the first uploader
+        collection.update_one({"_id": content_hash, "content_type": None}, {"$set": {"content_type": stored["content_type"]}})
+        document["content_type"] = stored["content_type"]
+    return VaultBlob._from_son(document)
+
+
+def release_blob(content_hash):
+    """Drop a reference; returns the blob if it was the last and the record is now claimed for deletion."""
+    collection = VaultBlob._get_collection()
+    document = collection.find_one_and_update(
+        {"_id": content_hash, "deleting": {"$ne": True}},
+        {"$inc": {"ref_count": -1}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if document is None or document["ref_count"] > 0:
+        return None
+    # Unless someone stored the same contents again in the meantime
+    claimed = collection.find_one_and_update(
+        {"_id": content_hash, "ref_count": {"$lte": 0}, "deleting": {"$ne": True}},
+        {"$set": {"deleting": True, "updated_at": datetime.now(tz=timezone.utc)}},
+        return_document=ReturnDocument.AFTER,
+    )
+    return VaultBlob._from_son(claimed) if claimed else None
+
+
+def delete_claimed_blob(content_hash):
+    """Remove a record claimed by release_blob(), and its media jobs, once its objects are deleted."""
+    MediaJob.objects(content_hash=content_hash).delete()
+    VaultBlob._get_collection().delete_one({"_id": content_hash, "deleting": True})
+
+
+async def store_blob(staged_name, content_hash):
+    """Turn an uploaded object into a reference to the blob of its contents.
+
+    If the blob exists, the staged object is deleted; otherwise it is
+    moved into place. Returns the blob's description.
+    """
+    storage = get_storage()
+    blob = await run_db(acquire_blob, content_hash)
+    if blob is not None:
+        await run_storage(storage.delete, staged_name)
+        return blob.describe()
+
+    # Referenced before the object is written, so a release of the same
+    # contents cannot claim the record and delete what is being stored
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + RESERVE_TIMEOUT_SECONDS
+    while not await run_db(reserve_blob, content_hash):
+        if loop.time() > deadline:
+            raise RuntimeError(f"Blob {content_hash} is still being deleted")
+        await asyncio.sleep(0.05)
+    try:
+        stored = await run_storage(storage.move, staged_name, blob_name(content_hash))
+    except Exception:
+        await release(content_hash)
+        raise
+    blob = await run_db(record_stored, content_hash, stored)
+    return blob.describe()
+
+
+async def deduplicate_item(item_id):
+    """Hash the object of an item registered unhashed and move it into the blob of its contents.
+
+    Returns the updated item, or None if it is gone or stored by content already.
+    """
+    storage = get_storage()
+    item = await run_db(VaultItem.objects(id=item_id).first)
+    if item is None or item.object_name.startswith(BLOB_PREFIX):
+        return None
+    content_hash = item.content_hash
+    if content_hash is None:
+        content_hash = await run_storage(storage.hash_object, item.object_name)
+        # Saved first, so a retry after a crash finds the blob even if the object has moved
+        await run_db(item.update, set__content_hash=content_hash)
+
+    if await run_storage(storage.describe, item.object_name) is not None:
+        stored = await store_blob(item.object_name, content_hash)
+    else:
+        # Moved by an attempt that failed before updating the item; store_blob()
+        # had taken the item's reference by then
+        blob = await run_db(VaultBlob.objects(content_hash=content_hash, deleting__ne=True).first)
+        if blob is None or blob.object_name is None:
+            raise RuntimeError(f"The object of item {item_id} is gone")
+        stored = blob.describe()
+
+    await run_db(
+        item.update,
+        set__object_name=stored["name"],
+        set__size=stored["size"],
+        set__generation=stored["generation"],
+        set__updated_at=datetime.now(tz=timezone.utc),
+    )
+    return await run_db(VaultItem.objects(id=item_id).first)
+
+
+async def release(content_hash):
+    """Drop a reference taken by store_blob() or acquire_owned_blob().
+
+    The last one deletes the blob's object and its derivatives.
+    """
+    blob = await run_db(release_blob, content_hash)
+    if blob is not None:
+        storage = get_storage()
+        names = [blob_name(content_hash)] + [derivative["object_name"] for derivative in blob.derivatives.values()]
+        for name in names:
+            await run_storage(storage.delete, name)
+        await run_db(delete_claimed_blob, content_hash)
+
+
+def backfill(storage=None, owner=None):
+    """Move every vault file that is not content-addressed yet into its blob.
+
+    Bucket objects without a vault item are registered first, as files of
+    ``owner``. Returns the number of files moved and how many of them were
+    duplicates.
+    """
+    storage = storage or get_storage()
+    vault_index.backfill(storage, owner)
+
+    moved = duplicates = 0
+    for item in VaultItem.objects(object_name__not__startswith=BLOB_PREFIX):
+        try:
+            content_hash = item.content_hash or storage.hash_object(item.object_name)
+            # Saved first, so a rerun after a crash finds the blob even if the object has moved
+            item.update(set__content_hash=content_hash)
+            blob = acquire_blob(content_hash)
+            if blob is None:
+                if not reserve_blob(content_hash):
+                    raise RuntimeError("its blob is being deleted")
+                try:
+                    stored = storage.move(item.object_name, blob_name(content_hash))
+                except Exception:
+                    if release_blob(content_hash):
+                        storage.delete(blob_name(content_hash))
+                        delete_claimed_blob(content_hash)
+                    raise
+                blob = record_stored(content_hash, stored)
+            else:
+                duplicates += 1
+            item.update(
+                set__object_name=blob.object_name,
+                set__size=blob.size,
+                set__generation=blob.generation,
+                set__updated_at=datetime.now(tz=timezone.utc),
+            )
+            if item.object_name != blob.object_name:
+                storage.delete(item.object_name)
+            moved += 1
+        except Exception as e:
+            print(f"Error deduplicating {item.object_name}: {e}")
+    return moved, duplicates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backfill", action="store_true", help="Hash and deduplicate existing bucket objects")
+    parser.add_argument("--owner", help="Email of the user unregistered objects belong to (default: none, listed to nobody)")
+    args = parser.parse_args()
+    if not args.backfill:
+        parser.print_help()
+        return
+
+    connect_to_mongo()
+    moved, duplicates = backfill(owner=args.owner and args.owner.lower())
+    print(f"Moved {moved} files into content-addressed storage, {duplicates} of them duplicates")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Vault metadata in MongoDB, so listings never enumerate the bucket.
+
+Files uploaded before the index existed can be registered with:
+
+    python -m backend.services.vault_index --backfill --owner user@example.com
+
+Those uploads did not record who sent them (every visitor saw every
+file), so the owner to give them is chosen by whoever runs the backfill.
+Without ``--owner`` they are registered without one, and stay hidden
+until they are given one: the vault is only served to signed-in users.
+"""
+
+import argparse
+import base64
+import json
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from mongoengine import Q
+
+from backend.config.settings import get_settings
+from backend.db.models.vault_item import VAULT_CATEGORIES, VaultItem
+from backend.db.mongodb import connect_to_mongo
+from backend.services.storage import get_storage
+
+# sort -> (field, descending)
+SORT_ORDERS = {
+    "newest": ("created_at", True),
+    "oldest": ("created_at", False),
+    "name": ("filename", False),
+}
+
+
+class InvalidCursorError(ValueError):
+    """The pagination cursor is malformed or belongs to another sort order."""
+
+
+def new_item_id():
+    """Id for an item about to be uploaded; it is also part of the object name."""
+    return ObjectId()
+
+
+def register_item(item_id, owner, category, filename, stored, content_hash=None, created_at=None):
+    """Record an uploaded object, described by the storage backend as ``stored``."""
+    now = created_at or datetime.now(tz=timezone.utc)
+    item = VaultItem(
+        id=item_id,
+        owner=owner,
+        category=category,
+        filename=filename,
+        object_name=stored["name"],
+        size=stored["size"],
+        content_type=stored["content_type"],
+        content_hash=content_hash,
+        generation=stored["generation"],
+        created_at=now,
+        updated_at=now,
+    )
+    item.save()
+    return item
+
+
+def encode_cursor(sort, item):
+    field, _ = SORT_ORDERS[sort]
+    value = getattr(item, field)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps({"sort": sort, "value": value, "id": str(item.id)})
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(sort, cursor):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if payload["sort"] != sort:
+            raise InvalidCursorError("The cursor belongs to another sort order")
+        value = payload["value"]
+        if SORT_ORDERS[sort][0] == "created_at":
+            value = datetime.fromisoformat(value)
+        return value, ObjectId(payload["id"])
+    except InvalidCursorError:
+        raise
+    except Exception:
+        raise InvalidCursorError("Invalid cursor")
+
+
+def list_items(owner, category, sort="newest", limit=None, cursor=None):
+    """Return a page of a vault category and the cursor of the next page (or None).
+
+    Keyset pagination: a page starts right after the (sort value, id) of
+    the previous page's last item, so every page is an index range scan
+    however deep it is.
+    """
+    settings = get_settings()
+    if sort not in SORT_ORDERS:
+        raise InvalidCursorError(f"Unknown sort order: {sort}")
+    limit = max(1, min(limit or settings.VAULT_PAGE_SIZE, settings.VAULT_MAX_PAGE_SIZE))
+    field, descending = SORT_ORDERS[sort]
+
+    query = VaultItem.objects(owner=owner, category=category)
+    if cursor:
+        value, last_id = decode_cursor(sort, cursor)
+        after = "lt" if descending else "gt"
+        query = query.filter(
+            Q(**{f"{field}__{after}": value}) | (Q(**{field: value}) & Q(**{f"id__{after}": last_id}))
+        )
+    direction = "-" if descending else "+"
+    items = list(query.order_by(f"{direction}{field}", f"{direction}id").limit(limit + 1))
+
+    next_cursor = encode_cursor(sort, items[limit - 1]) if len(items) > limit else None
+    return items[:limit], next_cursor
+
+
+def backfill(storage=None, owner=None):
+    """Register objects under uploads/{category}/ that have no vault item yet.
+
+    They are recorded as files of ``owner`` (None for no owner), since the
+    objects themselves do not say who uploaded them. Returns the number of
+    registered objects.
+    """
+    storage = storage or get_storage()
+    registered = 0
+    for category in VAULT_CATEGORIES:
+        objects = storage.list_objects(f"uploads/{category}/")
+        known = set(VaultItem.objects(category=category).scalar("object_name"))
+        for stored in objects:
+            if stored["name"] in known:
+                continue
+            filename = stored["name"].rsplit("/", 1)[-1]
+            # Keep the upload time rather than the time of the backfill
+            register_item(new_item_id(), owner, category, filename, stored, created_at=stored["updated"])
+            registered += 1
+    return registered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backfill", action="store_true", help="Register existing bucket objects")
+    parser.add_argument("--owner", help="Email of the user the registered objects belong to (default: none, listed to nobody)")
+    args = parser.parse_args()
+    if not args.backfill:
+        parser.print_help()
+        return
+
+    connect_to_mongo()
+    print(f"Registered {backfill(owner=args.owner and args.owner.lower())} objects")
+
+
+if __name__ == "__main__":
+    main()
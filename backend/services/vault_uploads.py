@@ -0,0 +1,454 @@
+import asyncio
+import hashlib
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import jwt
+from bson import ObjectId
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from backend.config.settings import get_settings
+from backend.db.models.vault_item import VAULT_CATEGORIES, VaultItem
+from backend.db.mongodb import run_db
+from backend.services.media_pipeline import queue_derivatives
+from backend.services.storage import get_storage, run_storage
+from backend.services.vault_blobs import acquire_owned_blob, release, store_blob
+from backend.services.vault_index import new_item_id, register_item
+from backend.utils.jwt_handler import ALGORITHM, get_secret_key
+
+READ_CHUNK_BYTES = 1024 * 1024  # Body data is handed to storage in chunks of this size
+STAGING_PREFIX = "uploads/.incoming/"
+UPLOAD_TOKEN_AUDIENCE = "vault-upload"  # Keeps upload tokens from being accepted as sign-in tokens
+
+# upload_id -> {"owner": str, "files": [...], "done": bool, "finished_at": float}
+_progress = {}
+# Semaphore releases still running; the event loop only keeps weak references to tasks
+_background_tasks = set()
+
+
+class UploadError(Exception):
+    """The upload request is malformed."""
+
+
+def safe_filename(filename):
+    """Last path component of a client-supplied filename."""
+    name = os.path.basename((filename or "").replace("\\", "/")).strip()
+    return name if name not in ("", ".", "..") else "file"
+
+
+async def iter_multipart(request):
+    """Parse a multipart/form-data body while it arrives.
+
+    Yields ``("field", name, value)`` for form fields and, for files,
+    ``("file", name, filename, content_type)`` followed by ``("data", bytes)``
+    events and an ``("end",)`` event. Nothing is spooled to disk.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise UploadError("Expected a multipart/form-data body")
+
+    events = []
+    part = {}
+
+    def on_part_begin():
+        part.clear()
+        part.update(headers={}, field=b"", value=b"", data=[], is_file=False)
+
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"], part["value"] = b"", b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["name"] = disposition.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" in disposition:
+            part["is_file"] = True
+            content_type = part["headers"].get(b"content-type", b"application/octet-stream")
+            filename = disposition[b"filename"].decode("utf-8", "replace")
+            events.append(("file", part["name"], filename, content_type.decode("latin-1")))
+
+    def on_part_data(data, start, end):
+        if part["is_file"]:
+            events.append(("data", data[start:end]))
+        else:
+            part["data"].append(data[start:end])
+
+    def on_part_end():
+        if part["is_file"]:
+            events.append(("end",))
+        else:
+            events.append(("field", part["name"], b"".join(part["data"]).decode("utf-8", "replace")))
+
+    parser = MultipartParser(
+        options[b"boundary"],
+        {
+            "on_part_begin": on_part_begin,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_part_data": on_part_data,
+            "on_part_end": on_part_end,
+        },
+    )
+    async for chunk in request.stream():
+        if chunk:
+            parser.write(chunk)
+        # Hand the events over before reading on, so memory stays bounded
+        batch = events[:]
+        events.clear()
+        for event in batch:
+            yield event
+    parser.finalize()
+    for event in events:
+        yield event
+
+
+class FileUpload:
+    """One file streamed from the request body into storage.
+
+    The request side calls write() and finish(); a task stores the queued
+    chunks, so the next file can be received while this one is stored.
+    """
+
+    _ABORT = object()
+
+    def __init__(self, item_id, filename, content_type, object_name, status):
+        settings = get_settings()
+        self.item_id = item_id
+        self.filename = filename
+        self.content_type = content_type
+        self.object_name = object_name
+        self.status = status  # Progress entry, updated in place
+        self.result = None
+        self.item = None
+        self._hash = hashlib.sha256()
+        self._queue = asyncio.Queue(maxsize=settings.VAULT_UPLOAD_BUFFER_CHUNKS)
+        self._pending = bytearray()
+        self.task = asyncio.create_task(self._store())
+
+    async def write(self, data):
+        self.status["bytes_received"] += len(data)
+        self._pending += data
+        if len(self._pending) >= READ_CHUNK_BYTES:
+            await self._put(bytes(self._pending))
+            self._pending.clear()
+
+    async def finish(self):
+        if self._pending:
+            await self._put(bytes(self._pending))
+            self._pending.clear()
+        await self._put(None)
+
+    async def abort(self):
+        await self._put(self._ABORT)
+
+    async def _put(self, item):
+        if self.status["status"] != "failed" or item is None or item is self._ABORT:
+            await self._queue.put(item)
+
+    def _write(self, writer, chunk):
+        # Runs on the storage executor, so hashing stays off the event loop
+        self._hash.update(chunk)
+        writer.write(chunk)
+
+    @property
+    def content_hash(self):
+        return self._hash.hexdigest()
+
+    async def _store(self):
+        storage = get_storage()
+        writer = None
+        ended = False  # Whether the request side is done with this file
+        try:
+            writer = await run_storage(storage.open_writer, self.object_name, self.content_type)
+            while True:
+                chunk = await self._queue.get()
+                ended = chunk is None or chunk is self._ABORT
+                if chunk is None:
+                    break
+                if chunk is self._ABORT:
+                    raise UploadError("The upload was interrupted")
+                await run_storage(self._write, writer, chunk)
+                self.status["bytes_stored"] += len(chunk)
+            self.result = await run_storage(writer.close)
+            self.status["status"] = "stored"
+        except Exception as e:
+            print(f"Error uploading {self.filename}: {e}")
+            self.status.update(status="failed", error=str(e))
+            if writer is not None:
+                try:
+                    await run_storage(writer.abort)
+                except Exception:
+                    pass
+            # Keep taking chunks so the request side is never blocked on a full queue
+            while not ended:
+                item = await self._queue.get()
+                ended = item is None or item is self._ABORT
+
+
+def _start_progress(upload_id, owner):
+    settings = get_settings()
+    now = time.monotonic()
+    for key, entry in list(_progress.items()):
+        if entry["done"] and now - entry["finished_at"] > settings.VAULT_UPLOAD_PROGRESS_TTL_SECONDS:
+            del _progress[key]
+    entry = {"owner": owner, "files": [], "done": False, "finished_at": None}
+    if upload_id:
+        _progress[upload_id] = entry
+    return entry
+
+
+def get_upload_progress(upload_id, owner):
+    """Per-file progress of ``owner``'s upload started with this ``upload_id``, or None."""
+    entry = _progress.get(upload_id)
+    if entry is None or entry["owner"] != owner:
+        return None
+    return {"upload_id": upload_id, "done": entry["done"], "files": [dict(f) for f in entry["files"]]}
+
+
+async def register_upload(item_id, owner, category, filename, stored, content_hash, content_type=None):
+    """Add stored contents to the vault as an item of ``owner``.
+
+    ``stored`` describes the blob a reference was taken on; the reference
+    is dropped again if the item cannot be registered. Without a
+    ``content_hash``, ``stored`` is an object that the media worker hashes
+    and moves into its blob later.
+    """
+    if content_type:
+        stored = {**stored, "content_type": content_type}
+    try:
+        item = await run_db(register_item, item_id, owner, category, filename, stored, content_hash=content_hash)
+    except Exception:
+        if content_hash:
+            await release(content_hash)
+        raise
+    await queue_derivatives(item)
+    return item
+
+
+async def receive_vault_upload(request, owner, category=None, upload_id=None):
+    """Stream the files of a vault upload request into storage.
+
+    Files are hashed while they are streamed to a staging name, then
+    stored by content (see vault_blobs) and registered as vault items of
+    ``owner``; a file whose contents are stored already only adds a
+    reference. The ``category`` form field may come before or after the
+    files. Up to VAULT_UPLOAD_CONCURRENCY files are stored at the same time.
+
+    Returns the per-file results; a failed file does not fail the others.
+    """
+    settings = get_settings()
+    storage = get_storage()
+    progress = _start_progress(upload_id, owner)
+    semaphore = asyncio.Semaphore(settings.VAULT_UPLOAD_CONCURRENCY)
+    uploads = []
+    current = None
+
+    async def release_when_done(upload):
+        try:
+            await upload.task
+        finally:
+            semaphore.release()
+
+    try:
+        async for event in iter_multipart(request):
+            kind = event[0]
+            if kind == "data":
+                await current.write(event[1])
+            elif kind == "file":
+                if event[1] != "files":
+                    raise UploadError(f"Unexpected file field: {event[1]}")
+                filename = safe_filename(event[2])
+                await semaphore.acquire()
+                item_id = new_item_id()
+                object_name = f"{STAGING_PREFIX}{item_id}"
+                status = {"filename": filename, "status": "uploading", "bytes_received": 0, "bytes_stored": 0}
+                progress["files"].append(status)
+                current = FileUpload(item_id, filename, event[3], object_name, status)
+                task = asyncio.create_task(release_when_done(current))
+                _background_tasks.add(task)
+                task.add_done_callback(_background_tasks.discard)
+                uploads.append(current)
+            elif kind == "end":
+                await current.finish()
+                current = None
+            elif kind == "field" and event[1] == "category":
+                if category and event[2] != category:
+                    raise UploadError("Conflicting categories")
+                category = event[2]
+            if category is not None and category not in VAULT_CATEGORIES:
+                raise UploadError(f"Invalid category: {category}")
+        if category is None:
+            raise UploadError("Missing category")
+        if not uploads:
+            raise UploadError("No files")
+    except BaseException:
+        # Client disconnected or bad request: stop every upload still open
+        for upload in uploads:
+            if not upload.task.done():
+                await upload.abort()
+        await asyncio.gather(*(upload.task for upload in uploads), return_exceptions=True)
+        # Nothing was registered, so nothing stored may stay
+        for upload in uploads:
+            if upload.result is not None:
+                await run_storage(storage.delete, upload.object_name)
+        progress.update(done=True, finished_at=time.monotonic())
+        raise
+
+    await asyncio.gather(*(upload.task for upload in uploads))
+
+    files = []
+    for upload in uploads:
+        if upload.result is not None:
+            try:
+                stored = await store_blob(upload.object_name, upload.content_hash)
+                upload.item = await register_upload(
+                    upload.item_id, owner, category, upload.filename, stored, upload.content_hash, upload.content_type
+                )
+            except Exception as e:
+                print(f"Error uploading {upload.filename}: {e}")
+                upload.status.update(status="failed", error=str(e))
+                await run_storage(storage.delete, upload.object_name)  # In case it was not moved
+        if upload.item is not None:
+            upload.status["status"] = "uploaded"
+            files.append({"status": "uploaded", **upload.item.to_dict()})
+        else:
+            files.append(
+                {"filename": upload.filename, "category": category, "status": "failed", "error": upload.status.get("error")}
+            )
+    progress.update(done=True, finished_at=time.monotonic())
+    return files
+
+
+async def store_stream(object_name, content_type, chunks):
+    """Write the byte chunks of the async iterable ``chunks`` to storage.
+
+    Chunks are combined into READ_CHUNK_BYTES writes. Returns the
+    description of the stored object.
+    """
+    storage = get_storage()
+    writer = await run_storage(storage.open_writer, object_name, content_type)
+    pending = bytearray()
+    try:
+        async for chunk in chunks:
+            pending += chunk
+            if len(pending) >= READ_CHUNK_BYTES:
+                await run_storage(writer.write, bytes(pending))
+                pending.clear()
+        if pending:
+            await run_storage(writer.write, bytes(pending))
+    except BaseException:
+        await run_storage(writer.abort)
+        raise
+    return await run_storage(writer.close)
+
+
+async def add_known_file(owner, category, filename, content_hash, content_type=None):
+    """Add a file ``owner`` already has in the vault without receiving it again.
+
+    Returns the new vault item, or None if they have no such contents.
+    """
+    blob = await run_db(acquire_owned_blob, owner, content_hash)
+    if blob is None:
+        return None
+    return await register_upload(new_item_id(), owner, category, filename, blob.describe(), content_hash, content_type)
+
+
+async def create_direct_uploads(category, files, owner):
+    """Issue upload URLs for files the client sends straight to storage.
+
+    ``files`` are dicts with ``filename``, ``content_type`` and optionally
+    the hex ``sha256`` of the contents. A file whose contents ``owner``
+    already has in the vault is added right away (status "uploaded").
+    Other files are uploaded to a staging name (status "pending") and become
+    vault items when the ``upload_token`` returned for them is passed to
+    complete_direct_uploads(). Videos get resumable uploads where the
+    backend supports them.
+    """
+    settings = get_settings()
+    if category not in VAULT_CATEGORIES:
+        raise UploadError(f"Invalid category: {category}")
+    storage = get_storage()
+    expiration = timedelta(minutes=settings.VAULT_UPLOAD_URL_EXPIRY_MINUTES)
+    expires_at = datetime.now(tz=timezone.utc) + expiration
+    token_expires_at = expires_at + timedelta(hours=settings.VAULT_UPLOAD_TOKEN_EXPIRY_HOURS)
+
+    uploads = []
+    for file in files:
+        filename = safe_filename(file.get("filename"))
+        content_type = file.get("content_type") or "application/octet-stream"
+        if file.get("sha256"):
+            item = await add_known_file(owner, category, filename, file["sha256"].lower(), content_type)
+            if item is not None:
+                uploads.append({"status": "uploaded", **item.to_dict()})
+                continue
+        item_id = new_item_id()
+        object_name = f"{STAGING_PREFIX}{item_id}"
+        claims = {
+            "item": str(item_id),
+            "owner": owner,
+            "category": category,
+            "filename": filename,
+            "content_type": content_type,
+        }
+        token = jwt.encode(
+            {**claims, "aud": UPLOAD_TOKEN_AUDIENCE, "exp": token_expires_at},
+            get_secret_key(),
+            algorithm=ALGORITHM,
+        )
+        target = await run_storage(
+            storage.upload_url, object_name, expiration, content_type, resumable=category == "videos"
+        )
+        uploads.append(
+            {"status": "pending", "filename": filename, "upload_token": token, "expires_at": expires_at, **target}
+        )
+    return uploads
+
+
+async def complete_direct_uploads(upload_tokens, owner):
+    """Add ``owner``'s directly uploaded files to the vault; returns a result per token.
+
+    The client's upload cannot be hashed on the way in, and reading it back
+    would make completion as slow as the upload. Items are registered with
+    their staged object right away; the media worker hashes and
+    deduplicates them afterwards (see media_pipeline). Completing a token
+    again returns the same item.
+    """
+    storage = get_storage()
+    files = []
+    for token in upload_tokens:
+        try:
+            claims = jwt.decode(token, get_secret_key(), algorithms=[ALGORITHM], audience=UPLOAD_TOKEN_AUDIENCE)
+        except jwt.PyJWTError as e:
+            files.append({"status": "failed", "error": f"Invalid upload token: {e}"})
+            continue
+
+        filename = claims.get("filename")
+        result = {"filename": filename, "category": claims.get("category")}
+        try:
+            filename, category = claims["filename"], claims["category"]
+            if claims["owner"] != owner:
+                raise UploadError("The upload token belongs to another user")
+            item_id = ObjectId(claims["item"])
+            item = await run_db(VaultItem.objects(id=item_id, owner=owner).first)
+            if item is None:
+                stored = await run_storage(storage.describe, f"{STAGING_PREFIX}{item_id}")
+                if stored is None:
+                    raise UploadError("The file has not been uploaded")
+                item = await register_upload(
+                    item_id, claims["owner"], category, filename, stored, None, claims.get("content_type")
+                )
+            result = {"status": "uploaded", **item.to_dict()}
+        except Exception as e:
+            print(f"Error completing upload of {filename}: {e}")
+            result.update(status="failed", error=str(e))
+        files.append(result)
+    return files
@@ -0,0 +1,28 @@
+import os
+import tempfile
+
+# Offline settings, before anything reads them
+os.environ.setdefault("DEFAULT_MODEL", "fake")
+os.environ.setdefault("FAKE_LLM_LATENCY", "0")
+os.environ.setdefault("FAKE_LLM_TOKENS_PER_SECOND", "0")
+os.environ.setdefault("EMBEDDING_MODEL", "local")
+os.environ.setdefault("STORY_INDEX_DIR", tempfile.mkdtemp(prefix="stories-"))
+os.environ.setdefault("STORAGE_BACKEND", "local")
+os.environ.setdefault("LOCAL_STORAGE_DIR", tempfile.mkdtemp(prefix="storage-"))
+os.environ.setdefault("MEDIA_WORKER_ENABLED", "false")
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+
+import mongoengine
+import mongomock
+import pytest
+
+
+@pytest.fixture
+def mongo():
+    """An empty in-memory database for the test."""
+    mongoengine.disconnect()
+    connection = mongoengine.connect(
+        db="mirrorme_test", host="mongodb://localhost", mongo_client_class=mongomock.MongoClient
+    )
+    yield connection
+    mongoengine.disconnect()
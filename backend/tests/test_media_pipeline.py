@@ -0,0 +1,135 @@
+import asyncio
+import hashlib
+import io
+
+import pytest
+
+from backend.db.models.media_job import MediaJob
+from backend.db.models.vault_blob import VaultBlob
+from backend.db.models.vault_item import VaultItem
+from backend.db.mongodb import run_db
+from backend.services.media_pipeline import MediaWorker, claim_job, derivative_name
+from backend.services.storage import get_storage, run_storage
+from backend.services.vault_blobs import blob_name, release, store_blob
+from backend.services.vault_index import new_item_id
+from backend.services.vault_uploads import STAGING_PREFIX, register_upload
+
+CONTENT = b"the same photo"
+CONTENT_HASH = hashlib.sha256(CONTENT).hexdigest()
+
+
+async def upload(owner, filename):
+    staged = f"uploads/.incoming/{new_item_id()}"
+    writer = get_storage().open_writer(staged)
+    writer.write(CONTENT)
+    writer.close()
+    stored = await store_blob(staged, CONTENT_HASH)
+    return await register_upload(new_item_id(), owner, "images", filename, stored, CONTENT_HASH, "image/png")
+
+
+@pytest.fixture
+def worker(mongo):
+    worker = MediaWorker(processes=1, concurrency=1)
+    worker.made = []
+
+    async def make(object_name, content_hash, kind):
+        worker.made.append((object_name, kind))
+        return await run_storage(
+            get_storage().upload_file, derivative_name(content_hash, kind), io.BytesIO(b"thumbnail"), "image/jpeg"
+        )
+
+    worker._make = make
+    yield worker
+    worker._pool.shutdown()
+
+
+async def run_jobs(worker):
+    """Process every runnable job, one at a time."""
+    worker._semaphore = asyncio.Semaphore(1)
+    while (job := await run_db(claim_job, worker.id, 60)) is not None:
+        await worker._semaphore.acquire()
+        await worker._process(job)
+
+
+def test_identical_files_share_one_job_and_its_derivative(worker):
+    async def run():
+        first = await upload("a@example.com", "a.png")
+        second = await upload("b@example.com", "b.png")
+        assert MediaJob.objects(content_hash=CONTENT_HASH).count() == 1
+        await run_jobs(worker)
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert len(worker.made) == 1
+    expected = derivative_name(CONTENT_HASH, "thumbnail")
+    for item in (first, second):
+        assert VaultItem.objects.get(id=item.id).derivatives["thumbnail"]["object_name"] == expected
+    assert VaultBlob.objects.get(content_hash=CONTENT_HASH).derivatives["thumbnail"]["object_name"] == expected
+
+
+def test_a_later_copy_gets_the_existing_derivative(worker):
+    async def run():
+        await upload("a@example.com", "a.png")
+        await run_jobs(worker)
+        later = await upload("b@example.com", "b.png")
+        await run_jobs(worker)
+        return later
+
+    later = asyncio.run(run())
+
+    assert len(worker.made) == 1
+    assert "thumbnail" in VaultItem.objects.get(id=later.id).derivatives
+
+
+def test_derivatives_are_deleted_with_their_blob(worker):
+    async def run():
+        await upload("a@example.com", "a.png")
+        await run_jobs(worker)
+        await release(CONTENT_HASH)
+
+    asyncio.run(run())
+
+    assert get_storage().describe(derivative_name(CONTENT_HASH, "thumbnail")) is None
+    assert MediaJob.objects(content_hash=CONTENT_HASH).count() == 0
+    assert VaultBlob.objects(content_hash=CONTENT_HASH).count() == 0
+
+
+def test_a_job_for_a_deleted_blob_makes_nothing(worker):
+    async def run():
+        item = await upload("a@example.com", "a.png")
+        # The job outlives its blob, e.g. queued again by --enqueue-missing
+        await release(CONTENT_HASH)
+        MediaJob(content_hash=CONTENT_HASH, item_id=item.id, kind="thumbnail").save()
+        await run_jobs(worker)
+
+    asyncio.run(run())
+
+    assert worker.made == []
+    assert MediaJob.objects.get(content_hash=CONTENT_HASH).status == "done"
+
+
+def test_an_unhashed_upload_is_stored_by_content_in_the_background(worker):
+    async def run():
+        existing = await upload("a@example.com", "a.png")
+        # Sent straight to storage, so registered before it was hashed
+        item_id = new_item_id()
+        staged = f"{STAGING_PREFIX}{item_id}"
+        writer = get_storage().open_writer(staged)
+        writer.write(CONTENT)
+        writer.close()
+        stored = await run_storage(get_storage().describe, staged)
+        direct = await register_upload(item_id, "b@example.com", "images", "b.png", stored, None, "image/png")
+        await run_jobs(worker)
+        return existing, direct, staged
+
+    existing, direct, staged = asyncio.run(run())
+
+    item = VaultItem.objects.get(id=direct.id)
+    assert item.content_hash == CONTENT_HASH
+    assert item.object_name == blob_name(CONTENT_HASH)
+    assert get_storage().describe(staged) is None
+    assert VaultBlob.objects.get(content_hash=CONTENT_HASH).ref_count == 2
+    # Its contents were known, so it shares the derivative made for the other item
+    assert len(worker.made) == 1
+    assert item.derivatives == VaultItem.objects.get(id=existing.id).derivatives != {}
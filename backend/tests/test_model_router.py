@@ -0,0 +1,136 @@
+import asyncio
+import time
+from typing import Any, List
+
+import pytest
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from backend.services.model_router import HedgedChatModel
+
+
+class ScriptedModel(BaseChatModel):
+    """Answers ``reply`` after ``delay`` seconds, or raises if ``fail``."""
+
+    reply: str
+    delay: float = 0.0
+    fail: bool = False
+    calls: List[float] = []
+    cancelled: List[bool] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        raise NotImplementedError
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        self.calls.append(time.monotonic())
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(True)
+            raise
+        if self.fail:
+            raise RuntimeError(f"{self.reply} is down")
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        self.calls.append(time.monotonic())
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(True)
+            raise
+        if self.fail:
+            raise RuntimeError(f"{self.reply} is down")
+        for word in self.reply.split():
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+
+
+def scripted(reply, **kwargs):
+    return ScriptedModel(reply=reply, calls=[], cancelled=[], **kwargs)
+
+
+def hedged(primary, backup, **kwargs):
+    settings = {"default_hedge_delay": 0.05, "min_hedge_delay": 0.01, "max_hedge_delay": 1.0, **kwargs}
+    return HedgedChatModel(providers=[primary, backup], names=["primary", "backup"], **settings)
+
+
+def test_a_fast_primary_is_not_hedged():
+    primary, backup = scripted("primary"), scripted("backup")
+
+    assert asyncio.run(hedged(primary, backup).ainvoke("היי")).content == "primary"
+    assert backup.calls == []
+
+
+def test_a_slow_primary_is_hedged_after_the_delay_and_cancelled():
+    primary, backup = scripted("primary", delay=1.0), scripted("backup")
+    model = hedged(primary, backup)
+
+    assert asyncio.run(model.ainvoke("היי")).content == "backup"
+    assert backup.calls[0] - primary.calls[0] == pytest.approx(0.05, abs=0.04)
+    assert primary.cancelled == [True]
+
+
+def test_the_hedge_delay_follows_the_primary_latency():
+    model = hedged(scripted("primary"), scripted("backup"))
+    for latency in [0.2] * 20:
+        model.stats["primary"].record_success(latency)
+
+    assert model._hedge_delay(0) == pytest.approx(0.2)
+
+
+def test_a_cancelled_primary_still_counts_towards_its_latency():
+    primary, backup = scripted("primary", delay=1.0), scripted("backup")
+    model = hedged(primary, backup)
+
+    asyncio.run(model.ainvoke("היי"))
+
+    (latency,) = model.stats["primary"].latencies
+    assert latency >= 0.04
+
+
+def test_an_error_fails_over_without_waiting_for_the_hedge_delay():
+    primary, backup = scripted("primary", fail=True), scripted("backup")
+    model = hedged(primary, backup, default_hedge_delay=5.0)
+
+    start = time.monotonic()
+    assert asyncio.run(model.ainvoke("היי")).content == "backup"
+    assert time.monotonic() - start < 1.0
+    assert model.stats["primary"].consecutive_failures == 1
+
+
+def test_the_circuit_opens_after_repeated_failures_and_closes_after_a_trial():
+    primary, backup = scripted("primary", fail=True), scripted("backup")
+    model = hedged(primary, backup, failure_threshold=2, cooldown=0.1)
+
+    async def run():
+        for _ in range(2):
+            await model.ainvoke("היי")
+        assert not model.stats["primary"].is_available()
+        calls = len(primary.calls)
+        await model.ainvoke("היי")
+        assert len(primary.calls) == calls  # Skipped while open
+
+        await asyncio.sleep(0.1)
+        primary.fail = False
+        return await model.ainvoke("היי")
+
+    assert asyncio.run(run()).content == "primary"
+    assert model.stats["primary"].is_available()
+    assert model.stats["primary"].consecutive_failures == 0
+
+
+def test_a_slow_stream_is_hedged_and_the_loser_cancelled():
+    primary, backup = scripted("primary reply", delay=1.0), scripted("backup reply")
+    model = hedged(primary, backup)
+
+    async def run():
+        return [chunk.content async for chunk in model.astream("היי")]
+
+    assert asyncio.run(run()) == ["backup", "reply"]
+    assert primary.cancelled == [True]
+    assert len(model.stats["primary"].first_token_latencies) == 1
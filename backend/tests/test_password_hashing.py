@@ -0,0 +1,87 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.db.models.user_doc import User
+from backend.main import app
+from backend.services import password_hashing
+from backend.services.authentication_service import login_user, register_user
+from backend.services.password_hashing import PasswordHasher, PasswordHasherBusyError
+
+
+class BlockingContext:
+    """Stands in for the CryptContext; each hash waits until ``release`` is set."""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def hash(self, password):
+        self.release.wait(timeout=5)
+        return f"hashed:{password}"
+
+
+@pytest.fixture
+def hasher(monkeypatch):
+    """Swap the process hasher; ``use(hasher)`` replaces it again."""
+
+    def use(hasher):
+        monkeypatch.setattr(password_hashing, "_hasher", hasher)
+        return hasher
+
+    yield use
+    password_hashing.close_password_hasher()
+
+
+def test_hashes_past_the_pending_limit_are_turned_away(hasher):
+    hasher = hasher(PasswordHasher(rounds=4, workers=1, max_pending=2))
+    hasher.context = BlockingContext()
+
+    async def run():
+        running = [asyncio.create_task(hasher.hash(f"pw{i}")) for i in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(PasswordHasherBusyError):
+            await hasher.hash("one too many")
+
+        hasher.context.release.set()
+        finished = await asyncio.gather(*running)
+        # The slots are free again once the burst has been served
+        return finished, await hasher.hash("later")
+
+    finished, later = asyncio.run(run())
+
+    assert finished == ["hashed:pw0", "hashed:pw1"]
+    assert later == "hashed:later"
+    assert hasher._pending == 0
+
+
+def test_a_busy_hasher_answers_sign_ins_with_503(mongo, hasher):
+    hasher = hasher(PasswordHasher(rounds=4, workers=1, max_pending=1))
+    asyncio.run(register_user("user@example.com", "secret"))
+    hasher._pending = hasher.max_pending
+
+    response = TestClient(app).post("/login", json={"email": "user@example.com", "password": "secret"})
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+
+
+def test_an_outdated_hash_is_replaced_at_login(mongo, hasher):
+    hasher(PasswordHasher(rounds=4, workers=1))
+    asyncio.run(register_user("User@example.com", "secret"))
+    assert User.objects.get(email="user@example.com").hashed_password.startswith("$2b$04$")
+
+    # The work factor is raised
+    hasher(PasswordHasher(rounds=5, workers=1))
+    with pytest.raises(Exception, match="Invalid credentials"):
+        asyncio.run(login_user("user@example.com", "wrong"))
+    assert User.objects.get(email="user@example.com").hashed_password.startswith("$2b$04$")
+
+    asyncio.run(login_user("user@example.com", "secret"))
+    rehashed = User.objects.get(email="user@example.com").hashed_password
+    assert rehashed.startswith("$2b$05$")
+
+    # The new hash is current, so it is kept and still accepted
+    asyncio.run(login_user("user@example.com", "secret"))
+    assert User.objects.get(email="user@example.com").hashed_password == rehashed
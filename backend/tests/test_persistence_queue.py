@@ -0,0 +1,240 @@
+import asyncio
+
+import mongomock
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from backend.db.models.conversation import Conversation
+from backend.db.models.session_lock import SessionLock
+from backend.services.chatbot_service import ChatbotService
+from backend.services.persistence_queue import ConversationWriteQueue
+from backend.services.session_coordinator import MongoSessionLocks
+
+
+class BulkWrites:
+    """``bulk_write`` for mongomock collections, which lack it.
+
+    ``failures`` are raised by successive calls; a failure with
+    ``applied=True`` is raised after the writes went through, like a lost
+    acknowledgement.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.failures = []
+
+    def bulk_write(self, collection, operations, ordered=True):
+        self.calls.append(len(operations))
+        failure = self.failures.pop(0) if self.failures else None
+        if isinstance(failure, BulkWriteError):
+            # The server stops at the rejected write
+            rejected = failure.details["writeErrors"][0]["index"]
+            operations = operations[:rejected]
+        elif failure is not None and not failure.applied:
+            raise failure.error
+        for operation in operations:
+            collection.update_one(operation._filter, operation._doc)
+        if failure is not None:
+            raise failure if isinstance(failure, BulkWriteError) else failure.error
+
+
+class Failure:
+    def __init__(self, error, applied=False):
+        self.error = error
+        self.applied = applied
+
+
+def rejected_at(index):
+    return BulkWriteError({"writeErrors": [{"index": index, "code": 121, "errmsg": "Document failed validation"}]})
+
+
+@pytest.fixture
+def collection(mongo, monkeypatch):
+    writes = BulkWrites()
+    monkeypatch.setattr(
+        mongomock.Collection,
+        "bulk_write",
+        lambda collection, operations, ordered=True: writes.bulk_write(collection, operations, ordered),
+        raising=False,
+    )
+    return writes
+
+
+def new_conversation(session_id):
+    conversation = Conversation(session_id=session_id)
+    conversation.add_message("היי, מה שלומך?", "assistant")
+    conversation.save()
+    return conversation
+
+
+def queue_turn(queue, conversation, text):
+    message = conversation.add_message(text, "user")
+    queue.enqueue(conversation, [message])
+
+
+def stored_messages(session_id):
+    return [message.content for message in Conversation.objects(session_id=session_id).first().messages[1:]]
+
+
+def make_queue(**kwargs):
+    return ConversationWriteQueue(
+        **{"batch_size": 10, "flush_interval": 0.01, "max_retries": 2, "retry_backoff": 0.01, **kwargs}
+    )
+
+
+def test_turns_are_written_in_one_batch(collection):
+    a, b = new_conversation("a"), new_conversation("b")
+
+    async def run():
+        queue = make_queue()
+        queue_turn(queue, a, "ראשון")
+        queue_turn(queue, b, "שני")
+        queue_turn(queue, a, "שלישי")
+        assert queue.get_conversation("a") is a
+        stored = await asyncio.gather(queue.wait_for("a"), queue.wait_for("b"))
+        return queue, stored
+
+    queue, stored = asyncio.run(run())
+
+    assert stored == [True, True]
+    assert collection.calls == [3]
+    assert stored_messages("a") == ["ראשון", "שלישי"]
+    assert stored_messages("b") == ["שני"]
+    assert queue.get_conversation("a") is None
+
+
+def test_batches_are_split_at_the_batch_size(collection):
+    conversation = new_conversation("a")
+
+    async def run():
+        queue = make_queue(batch_size=2)
+        for i in range(5):
+            queue_turn(queue, conversation, f"הודעה {i}")
+        return await queue.wait_for("a")
+
+    assert asyncio.run(run())
+    assert collection.calls == [2, 2, 1]
+    assert stored_messages("a") == [f"הודעה {i}" for i in range(5)]
+
+
+def test_a_retried_batch_is_not_written_twice(collection):
+    conversation = new_conversation("a")
+    # The first attempt is applied but its acknowledgement is lost
+    collection.failures = [Failure(AutoReconnect("connection reset"), applied=True)]
+
+    async def run():
+        queue = make_queue()
+        queue_turn(queue, conversation, "ראשון")
+        queue_turn(queue, conversation, "שני")
+        return await queue.wait_for("a")
+
+    assert asyncio.run(run())
+    assert collection.calls == [2, 2]
+    assert stored_messages("a") == ["ראשון", "שני"]
+
+
+def test_a_rejected_write_is_dropped_and_the_rest_are_written(collection, capsys):
+    a, b = new_conversation("a"), new_conversation("b")
+    collection.failures = [rejected_at(1)]
+
+    async def run():
+        queue = make_queue()
+        queue_turn(queue, a, "נשמר")
+        queue_turn(queue, b, "נדחה")
+        queue_turn(queue, a, "נשמר גם")
+        return await asyncio.gather(queue.wait_for("a"), queue.wait_for("b"))
+
+    stored_a, stored_b = asyncio.run(run())
+
+    assert [stored_a, stored_b] == [True, False]
+    assert collection.calls == [3, 1]
+    assert stored_messages("a") == ["נשמר", "נשמר גם"]
+    assert stored_messages("b") == []
+    assert "Error writing queued messages for session b" in capsys.readouterr().out
+
+
+def test_a_batch_is_dropped_once_retries_run_out(collection, capsys):
+    conversation = new_conversation("a")
+    collection.failures = [Failure(AutoReconnect("no primary"))] * 3
+
+    async def run():
+        queue = make_queue()
+        queue_turn(queue, conversation, "אבד")
+        stored = await queue.wait_for("a", timeout=5)
+        return queue, stored
+
+    queue, stored = asyncio.run(run())
+
+    assert not stored
+    assert collection.calls == [1, 1, 1]
+    assert queue.get_conversation("a") is None
+    assert "dropping 1 queued turns after 3 failed attempts" in capsys.readouterr().out
+
+
+def test_wait_for_gives_up_after_its_timeout(collection):
+    conversation = new_conversation("a")
+
+    async def run():
+        queue = make_queue(flush_interval=10)
+        queue_turn(queue, conversation, "ממתין")
+        stored = await queue.wait_for("a", timeout=0.01)
+        await queue.close(timeout=1)
+        return stored
+
+    assert asyncio.run(run()) is False
+    # Closing the queue still wrote the turn
+    assert stored_messages("a") == ["ממתין"]
+
+
+def test_close_flushes_queued_turns_and_rejects_new_ones(collection):
+    conversation = new_conversation("a")
+
+    async def run():
+        queue = make_queue(flush_interval=10)
+        queue_turn(queue, conversation, "לפני הסגירה")
+        unwritten = await queue.close(timeout=1)
+        with pytest.raises(RuntimeError):
+            queue_turn(queue, conversation, "אחרי הסגירה")
+        return unwritten
+
+    assert asyncio.run(run()) == 0
+    assert stored_messages("a") == ["לפני הסגירה"]
+
+
+def test_close_reports_turns_it_could_not_write(collection, capsys):
+    conversation = new_conversation("a")
+    collection.failures = [Failure(AutoReconnect("no primary"))] * 10
+
+    async def run():
+        queue = make_queue(flush_interval=10, retry_backoff=1)
+        queue_turn(queue, conversation, "אבד")
+        waiter = asyncio.create_task(queue.wait_for("a"))
+        unwritten = await queue.close(timeout=0.1)
+        return unwritten, await waiter
+
+    assert asyncio.run(run()) == (1, False)
+    assert "1 queued turns were not written before shutdown" in capsys.readouterr().out
+
+
+def test_the_session_stays_locked_until_its_turn_is_stored(collection, monkeypatch):
+    service = ChatbotService()
+    monkeypatch.setattr(service.settings, "SESSION_LOCK_BACKEND", "mongo")
+    service.session_locks = MongoSessionLocks(poll_interval=0.01)
+
+    async def run():
+        service.write_queue = make_queue(flush_interval=0.05)
+        session_id = (await service.process_message(None, "שלום", entry_source="direct"))["session_id"]
+        await service.process_message(session_id, "היה לי יום קשה")
+
+        # The reply is back before the turn is written, and the session is still held
+        locked_after_reply = SessionLock.objects(session_id=session_id).count()
+        written_after_reply = stored_messages(session_id)
+        await asyncio.gather(*service._background_tasks)
+        return session_id, locked_after_reply, written_after_reply
+
+    session_id, locked_after_reply, written_after_reply = asyncio.run(run())
+
+    assert locked_after_reply == 1
+    assert written_after_reply == []
+    assert SessionLock.objects(session_id=session_id).count() == 0
+    assert stored_messages(session_id)[0] == "היה לי יום קשה"
@@ -0,0 +1,106 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from backend.services.fake_llm import FakeChatModel
+from backend.services.prompt_cache import FakeContextCacheProvider, PromptCacheManager, PromptCachingChatModel
+
+
+class Clock:
+    def __init__(self):
+        self.now = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+    def __call__(self):
+        return self.now
+
+
+def make_manager(provider, **kwargs):
+    return PromptCacheManager(
+        provider=provider, model="fake", ttl_seconds=600, refresh_margin_seconds=60, log_interval_seconds=0, **kwargs
+    )
+
+
+def test_the_fake_provider_records_hits_and_misses():
+    provider = FakeContextCacheProvider()
+    manager = make_manager(provider)
+
+    async def run():
+        return [await manager.aget_handle("system prompt") for _ in range(3)]
+
+    names = asyncio.run(run())
+
+    assert len(set(names)) == 1 and provider.is_live(names[0])
+    assert provider.requests == [(names[0], False), (names[0], True), (names[0], True)]
+    assert manager.stats["caches_created"] == 1
+
+
+def test_entries_are_extended_before_they_expire():
+    clock = Clock()
+    provider = FakeContextCacheProvider(now=clock)
+    manager = make_manager(provider)
+
+    async def run():
+        name = await manager.aget_handle("system prompt")
+        clock.now += timedelta(seconds=570)  # Inside the refresh margin
+        assert await manager.aget_handle("system prompt") == name
+        await asyncio.gather(*manager._refresh_tasks)
+        # Past the original expiry
+        clock.now += timedelta(seconds=100)
+        return name, await manager.aget_handle("system prompt")
+
+    name, later = asyncio.run(run())
+
+    assert later == name and provider.is_live(name)
+    assert manager.stats["caches_extended"] == 1
+    assert len(provider.created) == 1
+
+
+def test_failed_creation_falls_back_to_the_full_prompt():
+    class FailingProvider(FakeContextCacheProvider):
+        attempts = 0
+
+        def create(self, *args):
+            self.attempts += 1
+            raise RuntimeError("quota exceeded")
+
+    provider = FailingProvider()
+    manager = make_manager(provider, retry_after_seconds=60)
+
+    async def run():
+        return [await manager.aget_handle("system prompt") for _ in range(2)]
+
+    assert asyncio.run(run()) == [None, None]
+    # Not retried until retry_after_seconds have passed
+    assert provider.attempts == 1
+
+
+def test_an_evicted_entry_is_retried_with_the_full_prompt():
+    provider = FakeContextCacheProvider()
+    manager = make_manager(provider)
+
+    class EvictingModel(FakeChatModel):
+        async def _agenerate(self, messages, stop=None, run_manager=None, cached_content=None, **kwargs):
+            if cached_content and not provider.is_live(cached_content):
+                raise LookupError(f"CachedContent {cached_content} not found")
+            return await super()._agenerate(messages, stop, run_manager, cached_content=cached_content, **kwargs)
+
+    model = PromptCachingChatModel(inner=EvictingModel(), prompt_cache=manager)
+    messages = [SystemMessage(content="system prompt"), HumanMessage(content="היי")]
+
+    async def run():
+        await model.ainvoke(messages)
+        provider.expire_all()
+        return await model.ainvoke(messages)
+
+    assert asyncio.run(run()).content
+    assert manager.stats["caches_invalidated"] == 1
+    assert manager._handles == {}
+
+
+def test_the_cached_token_share_is_logged(capsys):
+    manager = PromptCacheManager(model="fake", log_interval_seconds=1e-9)
+
+    manager.record_usage({"input_tokens": 100, "input_token_details": {"cache_read": 25}})
+
+    assert "25% of 100 input tokens" in capsys.readouterr().out
@@ -0,0 +1,95 @@
+import asyncio
+
+from backend.db.models.conversation import Conversation
+from backend.services.chatbot_service import ChatbotService
+from backend.services.session_coordinator import TurnResultCache
+
+
+def test_idempotency_keys_are_scoped_to_the_session():
+    cache = TurnResultCache()
+    cache.put(cache.make_key("session-a", "hello", "key-1"), "reply for a")
+
+    assert cache.get(cache.make_key("session-a", "hello again", "key-1")) == "reply for a"
+    assert cache.get(cache.make_key("session-b", "hello", "key-1")) is None
+
+
+def test_turns_without_a_session_are_not_deduplicated():
+    assert TurnResultCache.make_key(None, "hello", "key-1") is None
+    assert TurnResultCache.make_key(None, "hello") is None
+
+
+def test_same_key_in_another_session_gets_its_own_turn(mongo):
+    service = ChatbotService()
+
+    async def run():
+        first = await service.process_message(None, "שלום", entry_source="direct")
+        second = await service.process_message(None, "שלום", entry_source="direct")
+        await service.process_message(first["session_id"], "הודעה ראשונה", idempotency_key="same-key")
+        return first["session_id"], second["session_id"], await service.process_message(
+            second["session_id"], "הודעה שנייה", idempotency_key="same-key"
+        )
+
+    _, second_id, reply = asyncio.run(run())
+
+    assert reply["session_id"] == second_id
+    messages = [message.content for message in Conversation.objects(session_id=second_id).first().messages]
+    assert "הודעה שנייה" in messages
+    assert reply["response"] == messages[-1]
+
+
+def user_messages(session_id):
+    conversation = Conversation.objects(session_id=session_id).first()
+    return [message.content for message in conversation.messages if message.role == "user"]
+
+
+def test_a_repeated_message_is_a_new_turn(mongo):
+    service = ChatbotService()
+
+    async def run():
+        session_id = (await service.process_message(None, "שלום", entry_source="direct"))["session_id"]
+        await service.process_message(session_id, "כן")
+        await service.process_message(session_id, "כן")
+        return session_id
+
+    session_id = asyncio.run(run())
+
+    assert user_messages(session_id) == ["כן", "כן"]
+
+
+def test_identical_messages_in_flight_are_answered_once(mongo):
+    service = ChatbotService()
+
+    async def run():
+        session_id = (await service.process_message(None, "שלום", entry_source="direct"))["session_id"]
+        first, second = await asyncio.gather(
+            service.process_message(session_id, "כן"), service.process_message(session_id, "כן")
+        )
+        return session_id, first, second
+
+    session_id, first, second = asyncio.run(run())
+
+    assert first["response"] == second["response"]
+    assert user_messages(session_id) == ["כן"]
+
+
+def test_a_failed_turn_lets_its_duplicate_run():
+    cache = TurnResultCache()
+    key = cache.make_key("session-a", "כן")
+
+    async def run():
+        async def failing():
+            async with cache.running(key):
+                await asyncio.sleep(0)
+                raise RuntimeError("LLM error")
+
+        first = asyncio.create_task(failing())
+        await asyncio.sleep(0)
+        duplicate = await cache.reply_to(key)
+        try:
+            await first
+        except RuntimeError:
+            pass
+        return duplicate
+
+    assert asyncio.run(run()) is None
+    assert cache.get(key) is None
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+from backend.db.models.conversation import Conversation
+from backend.services.embeddings import HashingEmbeddings
+from backend.services.story_index import StoryRetriever
+from backend.tools.story_tools import StoryFilterTool, StorySharedTool, current_conversation
+
+STORIES = [
+    {"id": f"story{i}", "title": f"סיפור {i}", "content": f"תוכן הסיפור מספר {i}", "reflection_question": "?"}
+    for i in range(1, 4)
+]
+
+
+@pytest.fixture
+def retriever(tmp_path):
+    stories_path = tmp_path / "stories.json"
+    stories_path.write_text(json.dumps(STORIES, ensure_ascii=False))
+    return StoryRetriever(embeddings=HashingEmbeddings(), stories_path=str(stories_path), index_dir=None)
+
+
+@pytest.fixture
+def conversation(mongo):
+    conversation = Conversation(session_id="stories")
+    conversation.save()
+    conversation.add_message("קשה לי עם בן הזוג שלי", "user")
+    token = current_conversation.set(conversation)
+    yield conversation
+    current_conversation.reset(token)
+
+
+def story_ids(result):
+    return {story["id"] for story in result["stories"]}
+
+
+def test_fetched_candidates_stay_eligible(retriever, conversation):
+    fetch = StoryFilterTool(retriever)
+
+    assert story_ids(fetch.run("זוגיות")) == {"story1", "story2", "story3"}
+    assert story_ids(fetch.run("זוגיות")) == {"story1", "story2", "story3"}
+    assert Conversation.objects(session_id="stories").first().recommended_story_ids == []
+
+
+def test_only_the_shared_story_is_excluded(retriever, conversation):
+    fetch = StoryFilterTool(retriever)
+    shared = StorySharedTool(retriever)
+
+    assert shared.run("story2") == {"success": True}
+
+    assert story_ids(fetch.run("זוגיות")) == {"story1", "story3"}
+    assert Conversation.objects(session_id="stories").first().recommended_story_ids == ["story2"]
+
+
+def test_unknown_story_ids_are_not_recorded(retriever, conversation):
+    assert StorySharedTool(retriever).run("story9")["success"] is False
+    assert conversation.recommended_story_ids == []
@@ -0,0 +1,43 @@
+import asyncio
+
+from backend.db.models.conversation import Conversation
+from backend.services.chatbot_service import ChatbotService
+
+
+def assistant_metadata(session_id):
+    conversation = Conversation.objects(session_id=session_id).first()
+    return [message.metadata for message in conversation.messages if message.role == "assistant"]
+
+
+def test_turn_metrics_are_stored_with_the_reply(mongo):
+    service = ChatbotService()
+
+    async def run():
+        session_id = (await service.process_message(None, "שלום", entry_source="direct"))["session_id"]
+        await service.process_message(session_id, "היה לי יום קשה")
+        return session_id
+
+    metadata = assistant_metadata(asyncio.run(run()))[-1]
+
+    assert metadata["path"] is not None
+    assert metadata["llm_calls"] >= 1
+    assert metadata["prompt_tokens"] > 0
+    assert "mongo_read_ms" in metadata
+    assert "total_ms" in metadata
+
+
+def test_write_time_is_stored_with_the_next_turn(mongo):
+    service = ChatbotService()
+
+    async def run():
+        session_id = (await service.process_message(None, "שלום", entry_source="direct"))["session_id"]
+        await service.process_message(session_id, "היה לי יום קשה")
+        await service.process_message(session_id, "אני עייפה")
+        return session_id
+
+    welcome, first, second = assistant_metadata(asyncio.run(run()))
+
+    # Each turn is a single update; its duration is only known to the next one
+    assert "previous_mongo_write_ms" not in first
+    assert second["previous_mongo_write_ms"] >= 0
+    assert all("write_id" not in metadata for metadata in (first, second))
@@ -0,0 +1,142 @@
+import asyncio
+
+import pytest
+
+from backend.db.models.conversation import Conversation
+from backend.services.turn_router import AGENT, CHAT, TurnRouter
+
+INTRO = "היי, אני כאן כדי להקשיב. מה מביא אותך לכאן היום?"
+
+
+def conversation_with(*turns, user_message):
+    """A conversation of ``(role, content)`` turns ending with ``user_message``."""
+    conversation = Conversation(session_id="router-test")
+    conversation.add_message(INTRO, "assistant")
+    for role, content in turns:
+        conversation.add_message(content, role)
+    conversation.add_message(user_message, "user")
+    return conversation
+
+
+def route(conversation, classifier=None, router=None):
+    router = router or TurnRouter(min_user_messages_for_story=2)
+    user_message = conversation.messages[-1].content
+    return asyncio.run(router.route(conversation, user_message, classifier=classifier))
+
+
+class Classifier:
+    def __init__(self, answer=None, error=None):
+        self.answer = answer
+        self.error = error
+        self.calls = []
+
+    async def ainvoke(self, inputs, config=None):
+        self.calls.append(inputs)
+        if self.error is not None:
+            raise self.error
+        return self.answer
+
+
+def test_the_opening_message_is_plain_chat():
+    conversation = Conversation(session_id="router-test")
+    conversation.add_message("שלום", "user")
+
+    assert route(conversation) == (CHAT, "opening")
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        "אני רוצה להתחבר",
+        "איך אני נכנסת? התחברי בבקשה",
+        "שכחתי את הסיסמה",
+        "ואיך להירשם?",
+        "can I log in?",
+        "my email is dana@example.com",
+    ],
+)
+def test_auth_requests_go_to_the_agent(message):
+    assert route(conversation_with(user_message=message)) == (AGENT, "auth")
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        "ממש התחברתי לסיפור שלה",
+        "היא התחברה אליי מהר",
+        "חבר שלי עזר לי",
+        "I emailed her yesterday",
+    ],
+)
+def test_words_that_only_contain_an_auth_word_stay_in_chat(message):
+    assert route(conversation_with(user_message=message)) == (CHAT, "too_early_for_story")
+
+
+def test_a_login_the_assistant_started_is_continued():
+    conversation = conversation_with(
+        ("user", "אני רוצה להתחבר"),
+        ("assistant", "בשמחה. מה כתובת המייל שלך?"),
+        user_message="רגע, אני בודקת",
+    )
+
+    assert route(conversation) == (AGENT, "auth_followup")
+
+
+def test_consent_to_a_story_offer_goes_to_the_agent():
+    conversation = conversation_with(
+        ("user", "קשה לי מאוד בזמן האחרון"),
+        ("assistant", "רוצה לשמוע איך מישהי אחרת התמודדה עם זה? יש לי סיפור"),
+        user_message="כן, אשמח",
+    )
+
+    assert route(conversation) == (AGENT, "story_consent")
+
+
+def test_consent_must_be_a_whole_word():
+    conversation = conversation_with(
+        ("user", "קשה לי מאוד בזמן האחרון"),
+        ("assistant", "רוצה לשמוע איך מישהי אחרת התמודדה עם זה? יש לי סיפור"),
+        user_message="לכן אני לא ישנה בלילות",
+    )
+
+    assert route(conversation) == (CHAT, "no_tool_needed")
+
+
+def test_stories_are_not_offered_too_early():
+    conversation = conversation_with(user_message="ספרי לי סיפור")
+
+    assert route(conversation) == (CHAT, "too_early_for_story")
+
+
+def test_a_story_request_is_left_to_the_classifier():
+    conversation = conversation_with(("user", "קשה לי"), user_message="יש לך סיפור על זה?")
+    classifier = Classifier(answer="yes")
+
+    assert route(conversation, classifier) == (AGENT, "classifier")
+    assert classifier.calls == [{"last_assistant": INTRO, "user_message": "יש לך סיפור על זה?"}]
+    assert route(conversation, Classifier(answer="no")) == (CHAT, "classifier")
+
+
+def test_undecided_turns_go_to_the_agent_without_a_classifier():
+    conversation = conversation_with(("user", "קשה לי"), user_message="יש לך סיפור על זה?")
+
+    assert route(conversation) == (AGENT, "unclassified")
+    assert route(conversation, Classifier(error=RuntimeError("timeout"))) == (AGENT, "classifier_error")
+
+
+def test_stats_count_turns_per_path_and_reason():
+    router = TurnRouter(min_user_messages_for_story=2)
+    route(conversation_with(user_message="אני רוצה להתחבר"), router=router)
+    route(conversation_with(user_message="היה לי יום קשה"), router=router)
+    route(conversation_with(("user", "קשה לי"), user_message="היה לי יום קשה"), router=router)
+
+    stats = router.get_stats()
+
+    assert stats["total"] == 3
+    assert stats["paths"][AGENT] == {"turns": 1, "share": 1 / 3}
+    assert stats["paths"][CHAT]["turns"] == 2
+    assert stats["reasons"] == {
+        "agent:auth": 1,
+        "chat:too_early_for_story": 1,
+        "chat:no_tool_needed": 1,
+    }
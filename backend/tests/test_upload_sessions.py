@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import ClientDisconnect
+
+from backend.db.models.upload_session import UploadSession
+from backend.db.models.vault_item import VaultItem
+from backend.main import app
+from backend.services import upload_sessions
+from backend.services.storage import get_storage
+from backend.services.upload_sessions import (
+    SESSION_PREFIX,
+    OffsetMismatchError,
+    complete_session,
+    create_session,
+    write_chunk,
+)
+from backend.services.vault_blobs import blob_name
+from backend.services.vault_uploads import STAGING_PREFIX, UploadError
+from backend.utils.jwt_handler import create_token
+
+OWNER = "owner@example.com"
+CONTENT = b"a long recording, in three pieces"
+CONTENT_HASH = hashlib.sha256(CONTENT).hexdigest()
+
+
+async def chunks(*pieces):
+    for piece in pieces:
+        yield piece
+
+
+def new_session(size=len(CONTENT)):
+    return create_session(OWNER, "records", "talk.m4a", "audio/mp4", size)
+
+
+def stored_parts(session_id):
+    return get_storage().list_objects(f"{SESSION_PREFIX}{session_id}/")
+
+
+async def send_all(session_id):
+    offset = 0
+    for piece in (CONTENT[:10], CONTENT[10:20], CONTENT[20:]):
+        offset = await write_chunk(session_id, OWNER, offset, chunks(piece))
+    return offset
+
+
+def test_chunks_are_assembled_into_one_vault_item(mongo):
+    session = new_session()
+
+    async def run():
+        assert await send_all(session.session_id) == len(CONTENT)
+        first = await complete_session(session.session_id, OWNER)
+        again = await complete_session(session.session_id, OWNER)
+        return first, again
+
+    first, again = asyncio.run(run())
+
+    assert first.id == again.id == session.item_id
+    item = VaultItem.objects.get(id=first.id)
+    assert (item.content_hash, item.object_name) == (CONTENT_HASH, blob_name(CONTENT_HASH))
+    assert stored_parts(session.session_id) == []
+    assert UploadSession.objects.get(pk=session.session_id).status == "done"
+
+
+def test_a_chunk_at_the_wrong_offset_is_refused(mongo):
+    session = new_session()
+
+    async def run():
+        await write_chunk(session.session_id, OWNER, 0, chunks(CONTENT[:10]))
+        with pytest.raises(OffsetMismatchError) as behind:
+            await write_chunk(session.session_id, OWNER, 0, chunks(CONTENT[:10]))
+        with pytest.raises(OffsetMismatchError) as ahead:
+            await write_chunk(session.session_id, OWNER, 20, chunks(CONTENT[20:]))
+        return behind.value.offset, ahead.value.offset
+
+    assert asyncio.run(run()) == (10, 10)
+    assert len(stored_parts(session.session_id)) == 1
+
+
+def test_the_api_answers_an_offset_conflict_with_the_current_offset(mongo):
+    session = new_session()
+    client = TestClient(app)
+    headers = {"Authorization": f"Bearer {create_token(OWNER)}"}
+
+    response = client.put(f"/vault/sessions/{session.session_id}?offset=0", content=CONTENT[:10], headers=headers)
+    assert response.json()["offset"] == 10
+
+    response = client.put(f"/vault/sessions/{session.session_id}?offset=0", content=CONTENT[:10], headers=headers)
+    assert response.status_code == 409
+    assert response.json()["detail"]["offset"] == 10
+
+
+def test_the_slower_of_two_chunks_at_one_offset_is_discarded(mongo):
+    session = new_session()
+
+    async def run():
+        async def slow_chunks():
+            yield CONTENT[:5]
+            # A retry of the same chunk arrives and is stored first
+            await write_chunk(session.session_id, OWNER, 0, chunks(CONTENT[:10]))
+            yield CONTENT[5:10]
+
+        with pytest.raises(OffsetMismatchError) as conflict:
+            await write_chunk(session.session_id, OWNER, 0, slow_chunks())
+        return conflict.value.offset
+
+    assert asyncio.run(run()) == 10
+    session = UploadSession.objects.get(pk=session.session_id)
+    assert session.offset == 10
+    assert [part["name"] for part in session.parts] == [stored["name"] for stored in stored_parts(session.session_id)]
+
+
+def test_the_bytes_before_a_disconnect_are_kept(mongo):
+    session = new_session()
+
+    async def run():
+        async def dropped():
+            yield CONTENT[:7]
+            raise ClientDisconnect()
+
+        offset = await write_chunk(session.session_id, OWNER, 0, dropped())
+        await write_chunk(session.session_id, OWNER, offset, chunks(CONTENT[offset:]))
+        return await complete_session(session.session_id, OWNER)
+
+    item = asyncio.run(run())
+
+    assert item.content_hash == CONTENT_HASH
+
+
+def test_a_failed_completion_can_be_retried(mongo, monkeypatch):
+    session = new_session()
+    store_blob = upload_sessions.store_blob
+
+    async def unavailable(staged_name, content_hash):
+        raise ConnectionError("storage unavailable")
+
+    async def run():
+        await send_all(session.session_id)
+        monkeypatch.setattr(upload_sessions, "store_blob", unavailable)
+        with pytest.raises(ConnectionError):
+            await complete_session(session.session_id, OWNER)
+
+        assert UploadSession.objects.get(pk=session.session_id).status == "open"
+        assert get_storage().describe(f"{STAGING_PREFIX}{session.item_id}") is None
+
+        monkeypatch.setattr(upload_sessions, "store_blob", store_blob)
+        return await complete_session(session.session_id, OWNER)
+
+    item = asyncio.run(run())
+
+    assert item.content_hash == CONTENT_HASH
+    assert VaultItem.objects(owner=OWNER).count() == 1
+
+
+def test_an_interrupted_completion_is_taken_over_once_its_lease_ends(mongo):
+    session = new_session()
+
+    async def run():
+        await send_all(session.session_id)
+        # A worker claimed the session and died before finishing it
+        assert upload_sessions.claim_session(session.session_id, OWNER) is not None
+        with pytest.raises(UploadError, match="already being completed"):
+            await complete_session(session.session_id, OWNER)
+
+        UploadSession.objects(pk=session.session_id).update_one(
+            set__lease_until=datetime.now(tz=timezone.utc) - timedelta(seconds=1)
+        )
+        return await complete_session(session.session_id, OWNER)
+
+    item = asyncio.run(run())
+
+    assert item.id == session.item_id
+    assert UploadSession.objects.get(pk=session.session_id).status == "done"
+
+
+def test_an_incomplete_session_cannot_be_completed(mongo):
+    session = new_session()
+
+    async def run():
+        await write_chunk(session.session_id, OWNER, 0, chunks(CONTENT[:10]))
+        with pytest.raises(UploadError, match=f"Only 10 of {len(CONTENT)} bytes"):
+            await complete_session(session.session_id, OWNER)
+
+    asyncio.run(run())
+
+    assert UploadSession.objects.get(pk=session.session_id).status == "open"
@@ -0,0 +1,84 @@
+import asyncio
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+from backend.db.models.vault_blob import VaultBlob
+from backend.services import vault_blobs
+from backend.services.storage import get_storage
+from backend.services.vault_blobs import blob_name, delete_claimed_blob, release, release_blob, store_blob
+
+CONTENT = b"the same photo"
+CONTENT_HASH = hashlib.sha256(CONTENT).hexdigest()
+
+
+def stage(name, content=CONTENT):
+    writer = get_storage().open_writer(name)
+    writer.write(content)
+    writer.close()
+    return name
+
+
+def blob_exists():
+    return get_storage().describe(blob_name(CONTENT_HASH)) is not None
+
+
+def test_identical_uploads_share_one_blob(mongo):
+    async def run():
+        first = await store_blob(stage("uploads/.incoming/a"), CONTENT_HASH)
+        second = await store_blob(stage("uploads/.incoming/b"), CONTENT_HASH)
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert first["name"] == second["name"] == blob_name(CONTENT_HASH)
+    assert VaultBlob.objects.get(pk=CONTENT_HASH).ref_count == 2
+    assert get_storage().describe("uploads/.incoming/b") is None
+
+    asyncio.run(release(CONTENT_HASH))
+    assert blob_exists()
+    asyncio.run(release(CONTENT_HASH))
+    assert not blob_exists()
+    assert VaultBlob.objects(pk=CONTENT_HASH).count() == 0
+
+
+def test_storing_while_the_last_reference_is_released_keeps_the_blob(mongo):
+    async def run():
+        await store_blob(stage("uploads/.incoming/a"), CONTENT_HASH)
+
+        # The release has claimed the record but not deleted the object yet
+        assert await vault_blobs.run_db(release_blob, CONTENT_HASH)
+        storing = asyncio.create_task(store_blob(stage("uploads/.incoming/b"), CONTENT_HASH))
+        await asyncio.sleep(0.2)
+        assert not storing.done()
+        assert get_storage().describe("uploads/.incoming/b") is not None
+
+        # The release finishes; only then is the new upload moved into place
+        get_storage().delete(blob_name(CONTENT_HASH))
+        delete_claimed_blob(CONTENT_HASH)
+        return await storing
+
+    stored = asyncio.run(run())
+
+    assert stored["name"] == blob_name(CONTENT_HASH)
+    assert blob_exists()
+    blob = VaultBlob.objects.get(pk=CONTENT_HASH)
+    assert (blob.ref_count, blob.deleting) == (1, False)
+
+
+def test_a_release_abandoned_by_a_crashed_worker_is_taken_over(mongo):
+    async def run():
+        await store_blob(stage("uploads/.incoming/a"), CONTENT_HASH)
+        assert await vault_blobs.run_db(release_blob, CONTENT_HASH)
+        # The worker died before deleting anything
+        VaultBlob.objects(pk=CONTENT_HASH).update(
+            set__updated_at=datetime.now(tz=timezone.utc) - timedelta(seconds=vault_blobs.DELETE_CLAIM_SECONDS + 1)
+        )
+        return await store_blob(stage("uploads/.incoming/b"), CONTENT_HASH)
+
+    stored = asyncio.run(run())
+
+    assert stored["name"] == blob_name(CONTENT_HASH)
+    blob = VaultBlob.objects.get(pk=CONTENT_HASH)
+    assert (blob.ref_count, blob.deleting) == (1, False)
+    assert blob_exists()
+
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from backend.services.storage import get_storage
+from backend.services.vault_index import InvalidCursorError, backfill, list_items, new_item_id, register_item
+
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def add_item(owner, filename, minutes, category="images"):
+    stored = {"name": f"blobs/{filename}", "size": 1, "content_type": "image/png", "generation": 1}
+    return register_item(
+        new_item_id(), owner, category, filename, stored, created_at=START + timedelta(minutes=minutes)
+    )
+
+
+def filenames(items):
+    return [item.filename for item in items]
+
+
+def test_listings_only_show_the_owners_files(mongo):
+    add_item("a@example.com", "a1.png", 1)
+    add_item("b@example.com", "b1.png", 2)
+    add_item(None, "anonymous.png", 3)
+    add_item("a@example.com", "a2.png", 4, category="videos")
+
+    assert filenames(list_items("a@example.com", "images")[0]) == ["a1.png"]
+    assert filenames(list_items("b@example.com", "images")[0]) == ["b1.png"]
+    assert filenames(list_items(None, "images")[0]) == ["anonymous.png"]
+
+
+def collect_pages(owner, sort, limit):
+    seen, cursor = [], None
+    while True:
+        items, cursor = list_items(owner, "images", sort=sort, limit=limit, cursor=cursor)
+        seen.extend(items)
+        if cursor is None:
+            return seen
+
+
+@pytest.mark.parametrize(
+    "sort, expected",
+    [
+        ("newest", ["f4.png", "f3.png", "f2.png", "f1.png", "f0.png"]),
+        ("oldest", ["f0.png", "f1.png", "f2.png", "f3.png", "f4.png"]),
+        ("name", ["f0.png", "f1.png", "f2.png", "f3.png", "f4.png"]),
+    ],
+)
+def test_pages_follow_each_other(mongo, sort, expected):
+    for i in range(5):
+        add_item("a@example.com", f"f{i}.png", i)
+    add_item("b@example.com", "other.png", 10)
+
+    assert filenames(collect_pages("a@example.com", sort, limit=2)) == expected
+
+
+def test_items_with_the_same_sort_value_are_not_skipped(mongo):
+    added = [add_item("a@example.com", "same.png", 0) for _ in range(5)]
+
+    seen = collect_pages("a@example.com", "newest", limit=2)
+
+    assert sorted(item.id for item in seen) == sorted(item.id for item in added)
+
+
+def test_cursors_are_bound_to_their_sort_order(mongo):
+    for i in range(3):
+        add_item("a@example.com", f"f{i}.png", i)
+    _, cursor = list_items("a@example.com", "images", sort="newest", limit=1)
+
+    with pytest.raises(InvalidCursorError):
+        list_items("a@example.com", "images", sort="name", cursor=cursor)
+
+
+def test_backfill_gives_legacy_files_to_the_chosen_owner(mongo):
+    writer = get_storage().open_writer("uploads/images/legacy.png", "image/png")
+    writer.write(b"legacy")
+    writer.close()
+
+    assert backfill(owner="a@example.com") == 1
+    assert backfill(owner="a@example.com") == 0
+    assert filenames(list_items("a@example.com", "images")[0]) == ["legacy.png"]
+    assert list_items(None, "images")[0] == []
@@ -0,0 +1,93 @@
+import asyncio
+
+import jwt
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.db.models.media_job import MediaJob
+from backend.db.models.vault_item import VaultItem
+from backend.main import app
+from backend.services.storage import get_storage
+from backend.services.vault_uploads import (
+    STAGING_PREFIX,
+    _start_progress,
+    complete_direct_uploads,
+    create_direct_uploads,
+    get_upload_progress,
+)
+from backend.utils.jwt_handler import create_token
+
+
+def create_upload(owner, content=b"hello"):
+    (upload,) = asyncio.run(create_direct_uploads("images", [{"filename": "a.png", "content_type": "image/png"}], owner))
+    item_id = jwt.decode(upload["upload_token"], options={"verify_signature": False})["item"]
+    writer = get_storage().open_writer(f"{STAGING_PREFIX}{item_id}")
+    writer.write(content)
+    writer.close()
+    return upload["upload_token"]
+
+
+def test_upload_tokens_are_not_sign_in_tokens(mongo):
+    (upload,) = asyncio.run(create_direct_uploads("images", [{"filename": "a.png"}], "user@example.com"))
+    client = TestClient(app)
+
+    response = client.get("/vault/images", headers={"Authorization": f"Bearer {upload['upload_token']}"})
+    assert response.status_code == 401
+
+    (result,) = asyncio.run(complete_direct_uploads([create_token("user@example.com")], "user@example.com"))
+    assert result["status"] == "failed"
+
+
+@pytest.mark.parametrize(
+    "method, path",
+    [
+        ("POST", "/vault/items?category=images"),
+        ("POST", "/vault/uploads"),
+        ("POST", "/vault/uploads/complete"),
+        ("GET", "/vault/uploads/upload-1"),
+        ("POST", "/vault/sessions"),
+        ("GET", "/vault/sessions/session-1"),
+        ("PUT", "/vault/sessions/session-1?offset=0"),
+        ("POST", "/vault/sessions/session-1/complete"),
+        ("GET", "/vault/images"),
+    ],
+)
+def test_vault_endpoints_require_a_signed_in_user(mongo, method, path):
+    response = TestClient(app).request(method, path)
+
+    assert response.status_code == 401
+    assert response.headers["www-authenticate"] == "Bearer"
+
+
+def test_uploads_are_completed_only_by_their_owner(mongo):
+    token = create_upload("owner@example.com")
+
+    (result,) = asyncio.run(complete_direct_uploads([token], "other@example.com"))
+    assert result["status"] == "failed"
+
+    (result,) = asyncio.run(complete_direct_uploads([token], "owner@example.com"))
+    assert result["status"] == "uploaded"
+    assert result["filename"] == "a.png"
+
+
+def test_completion_registers_the_upload_without_reading_it_back(mongo, monkeypatch):
+    token = create_upload("owner@example.com")
+    monkeypatch.setattr(type(get_storage()), "hash_object", lambda self, name: pytest.fail("read back"))
+
+    (first,) = asyncio.run(complete_direct_uploads([token], "owner@example.com"))
+    (again,) = asyncio.run(complete_direct_uploads([token], "owner@example.com"))
+
+    assert first["status"] == again["status"] == "uploaded"
+    assert first["id"] == again["id"]
+    item = VaultItem.objects.get(id=first["id"])
+    assert item.object_name == f"{STAGING_PREFIX}{first['id']}"
+    assert item.content_hash is None
+    assert [job.kind for job in MediaJob.objects(item_id=item.id)] == ["hash"]
+
+
+def test_upload_progress_is_visible_to_its_owner_only():
+    _start_progress("upload-1", "owner@example.com")
+
+    assert get_upload_progress("upload-1", "owner@example.com") is not None
+    assert get_upload_progress("upload-1", "other@example.com") is None
+    assert get_upload_progress("upload-1", None) is None
@@ -1,17 +1,17 @@
-from pydantic import BaseModel, Field
-from typing import Dict, List, Any
+from contextvars import ContextVar
+from typing import Dict, Any
 from langchain.tools import Tool
 
-from pydantic import BaseModel, Field
-from typing import Dict, List, Any
-from langchain.tools import Tool
+from backend.config.settings import get_settings
+from backend.services.story_index import get_story_retriever
+
+# Conversation of the turn being processed, set by ChatbotService
+current_conversation = ContextVar("current_conversation", default=None)
 
-from typing import Dict, Any
-from langchain.tools import Tool
 
 class StoryFilterTool:
     """Tool for fetching stories based on conversation context."""
-    
+
     name = "fetch_relatable_story"
     description = """כלי לאחזור סיפורים רלוונטיים שניתן להזדהות איתם מהמאגר עבור המשתמשת.
 
@@ -20,47 +20,99 @@ class StoryFilterTool:
     2. הצעת למשתמשת באופן מפורש לשמוע סיפור של מישהי אחרת (למשל: "רוצה לשמוע איך זה היה אצל מישהי אחרת?" או "אני יכולה לשתף אותך בסיפור שאולי תתחברי אליו?")
     3. המשתמשת הסכימה במפורש לקבל את הסיפור
 
-    לאחר הקריאה לכלי, המערכת תשלח לך את כל האופציות הזמינות ואתה תבחר את הסיפור המתאים ביותר למצב של המשתמשת בהתבסס על השיחה.
+    הקלט לכלי הוא תיאור קצר של המצב שהמשתמשת מתארת. המערכת תשלח לך את הסיפורים הדומים ביותר שטרם הוצגו לה, ואתה תבחר את הסיפור המתאים ביותר למצב של המשתמשת בהתבסס על השיחה.
+
+    אחרי שבחרת סיפור, קרא לכלי mark_story_shared עם המזהה (id) שלו, כדי שלא יוצע לה שוב.
 
     לאחר שיתוף הסיפור, תמיד שאל אם הסיפור מהדהד אצל המשתמשת או אם היא מזדהה עם חלקים ממנו.
     """
-    
-    def run(self, *args, **kwargs) -> Dict[str, Any]:
+
+    def __init__(self, retriever=None):
+        self.retriever = retriever
+
+    def run(self, query: str = "", *args, **kwargs) -> Dict[str, Any]:
         """
-        Execute the story fetching process (placeholder).
-        
-        Note: This method ignores any parameters passed to it and always
-        returns the same sample stories.
+        Find the stories most similar to the situation and the conversation.
+
+        Args:
+            query: The agent's description of the user's situation
         """
-        # Mock implementation that returns a simple structure with sample stories
+        settings = get_settings()
+        retriever = self.retriever or get_story_retriever()
+        conversation = current_conversation.get()
+
+        # Search with the user's own recent words as well as the agent's summary
+        parts = [query] if isinstance(query, str) else []
+        excluded = []
+        if conversation is not None:
+            user_messages = [m.content for m in conversation.messages if m.role == "user"]
+            parts.extend(user_messages[-settings.STORY_QUERY_RECENT_MESSAGES:])
+            excluded = list(conversation.recommended_story_ids)
+
+        results = retriever.search(
+            "\n".join(parts), k=settings.MAX_STORIES_TO_RETURN, exclude_ids=excluded
+        )
+        if not results:
+            return {"stories": [], "message": "No new stories are available for this conversation."}
+
+        # Only the story the agent picks is recorded (see StorySharedTool), so
+        # the other candidates can still be offered later
         return {
-            "Find the best maching stories to the user ": "Story fetching will be implemented later. Here are some sample stories:",
             "stories": [
                 {
-                    "id": "story1",
-                    "title": "Finding My Voice",
-                    "content": "I was always asked to check in throughout the day. At first, I thought it was sweet that he wanted to know I was safe. But over time, I noticed I'd feel anxious if I couldn't respond right away. I started planning my day around when I could text back, and eventually realized I was missing out on being present in my own life.",
-                    "reflection_question": "Have you ever adjusted your schedule or activities to avoid someone's disappointment or anger?"
-                },
-                {
-                    "id": "story2",
-                    "title": "The Invisible Boundary",
-                    "content": "Whenever we had disagreements about what was said, somehow my memory was always wrong. I started recording conversations just to make sure I wasn't losing my mind. When I played back a conversation that proved my point, he got angry and said I was manipulative for recording him without consent.",
-                    "reflection_question": "Have you ever doubted your own memories or perceptions after a conversation?"
-                },
-                {
-                    "id": "story3",
-                    "title": "Gradual Distance",
-                    "content": "I didn't notice at first, but my circle got smaller every month. There was always a reason: 'Your friend is flirting with me.' 'Your mom is too critical of us.' Eventually, it was just us. When I finally reconnected with my best friend, she said she'd been trying to reach me for months but I never responded to her messages.",
-                    "reflection_question": "Has your social circle changed significantly since being in your relationship?"
+                    "id": story["id"],
+                    "title": story.get("title", ""),
+                    "content": story.get("content", ""),
+                    "reflection_question": story.get("reflection_question", ""),
                 }
+                for story, _ in results
             ]
         }
-    
+
+    def get_langchain_tool(self):
+        """Return this tool in a format compatible with LangChain."""
+        return Tool(
+            name=self.name,
+            description=self.description,
+            func=self.run
+        )
+
+
+class StorySharedTool:
+    """Tool recording the story the agent chose to share."""
+
+    name = "mark_story_shared"
+    description = """כלי לסימון סיפור ששותף עם המשתמשת, כדי שלא יוצע לה שוב בהמשך השיחה.
+
+    השתמש בכלי מיד אחרי שבחרת סיפור מתוך התוצאות של fetch_relatable_story. הקלט לכלי הוא המזהה (id) של הסיפור שבחרת בלבד.
+    """
+
+    def __init__(self, retriever=None):
+        self.retriever = retriever
+
+    def run(self, story_id: str = "", *args, **kwargs) -> Dict[str, Any]:
+        """
+        Record a story as shared in the current conversation.
+
+        Args:
+            story_id: The id of the story the agent shared
+        """
+        retriever = self.retriever or get_story_retriever()
+        story_id = story_id.strip().strip('"') if isinstance(story_id, str) else ""
+        try:
+            retriever.get_index().get_story(story_id)
+        except KeyError:
+            return {"success": False, "message": f"Unknown story id: {story_id}"}
+
+        conversation = current_conversation.get()
+        if conversation is not None:
+            conversation.add_recommended_stories([story_id])
+        return {"success": True}
+
     def get_langchain_tool(self):
         """Return this tool in a format compatible with LangChain."""
         return Tool(
             name=self.name,
             description=self.description,
             func=self.run
-        )
\ No newline at end of file
+        )
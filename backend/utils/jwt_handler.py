@@ -1,19 +1,24 @@
 import jwt
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
-import os
 
+from backend.config.settings import get_settings
 
-load_dotenv()
-SECRET_KEY = ("SECRET_KEY")
 ALGORITHM = "HS256"
 
+def get_secret_key():
+    """Key that signs tokens, from JWT_SECRET_KEY."""
+    secret_key = get_settings().JWT_SECRET_KEY
+    if not secret_key:
+        raise RuntimeError("JWT_SECRET_KEY is not set")
+    return secret_key
+
 def create_token(email: str):
     payload = {
         "sub": email,
         "exp": datetime.utcnow() + timedelta(hours=2)
     }
-    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+    return jwt.encode(payload, get_secret_key(), algorithm=ALGORITHM)
 
 def decode_token(token: str):
-    return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    # Tokens issued for other purposes carry an audience and are rejected here
+    return jwt.decode(token, get_secret_key(), algorithms=[ALGORITHM], options={"require": ["exp", "sub"]})
@@ -1,6 +1,7 @@
 // src/components/chat/ChatFileUpload.tsx
 import { useState, useEffect } from "react";
 import { Button } from "../../components/ui/button";
+import { useAuth } from "../../contexts/AuthContext";
 import {
   X,
   Image,
@@ -35,6 +36,7 @@ export const ChatFileUpload = ({
   showUploadUI,
   initialCategory = "images",
 }: ChatFileUploadProps) => {
+  const { token } = useAuth();
   const [activeTab, setActiveTab] = useState<"images" | "videos" | "records">(
     initialCategory
   );
@@ -147,6 +149,7 @@ export const ChatFileUpload = ({
       // Upload to server
       const response = await fetch("http://localhost:8000/vault/items", {
         method: "POST",
+        headers: { Authorization: `Bearer ${token}` },
         body: formData,
       });
 
@@ -21,6 +21,9 @@ export const SafePage = () => {
   const [vaultFiles, setVaultFiles] = useState<VaultFile[]>([]);
   const [sort, setSort] = useState("desc");
   const [isFetching, setIsFetching] = useState(false);
+  // Cursor of the next page of the listing, null once everything is loaded
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
   const { showAlert } = useAlert();
 
   // Define the type for the entire category information object
@@ -57,14 +60,27 @@ export const SafePage = () => {
     if (isUnlocked) {
       fetchVaultFiles();
     }
-  }, [category, isUnlocked]);
+  }, [category, isUnlocked, sort]);
+
+  // The server returns the files a page at a time, in the selected order
+  const fetchVaultPage = async (cursor: string | null) => {
+    const params = new URLSearchParams({
+      sort: sort === "desc" ? "newest" : "oldest",
+    });
+    if (cursor) params.set("cursor", cursor);
+    const res = await fetch(
+      `http://localhost:8000/vault/${category}?${params.toString()}`,
+      { headers: { Authorization: `Bearer ${token}` } }
+    );
+    const data = await res.json();
+    setNextCursor(data.next_cursor ?? null);
+    return data.files as VaultFile[];
+  };
 
   const fetchVaultFiles = async () => {
     setIsFetching(true);
     try {
-      const res = await fetch(`http://localhost:8000/vault/${category}`);
-      const data = await res.json();
-      setVaultFiles(data.files);
+      setVaultFiles(await fetchVaultPage(null));
     } catch (err) {
       console.error(err);
     } finally {
@@ -72,6 +88,19 @@ export const SafePage = () => {
     }
   };
 
+  const loadMoreFiles = async () => {
+    if (!nextCursor) return;
+    setIsLoadingMore(true);
+    try {
+      const page = await fetchVaultPage(nextCursor);
+      setVaultFiles((current) => [...current, ...page]);
+    } catch (err) {
+      console.error(err);
+    } finally {
+      setIsLoadingMore(false);
+    }
+  };
+
   const handleUnlock = () => {
     if (safeCode === validSafeCode) {
       setIsUnlocked(true);
@@ -93,6 +122,7 @@ export const SafePage = () => {
     try {
       const res = await fetch("http://localhost:8000/vault/items", {
         method: "POST",
+        headers: { Authorization: `Bearer ${token}` },
         body: formData,
       });
       const data = await res.json();
@@ -353,7 +383,7 @@ export const SafePage = () => {
             <h3 className="text-base sm:text-lg font-medium">{info.label}</h3>
             <p className="text-xs sm:text-sm text-gray-500">
               {vaultFiles.length > 0 && category === key
-                ? `${vaultFiles.length} קבצים`
+                ? `${vaultFiles.length}${nextCursor ? "+" : ""} קבצים`
                 : "לחצי לצפייה"}
             </p>
           </button>
@@ -407,7 +437,7 @@ export const SafePage = () => {
           <div className="grid grid-cols-2 sm:grid-cols-3 md:grid-cols-4 gap-2 sm:gap-3 md:gap-4">
             {sortedFiles.map((file) => (
               <motion.div
-                key={file.filename}
+                key={file.id}
                 initial={{ opacity: 0, scale: 0.95 }}
                 animate={{ opacity: 1, scale: 1 }}
                 transition={{ duration: 0.3 }}
@@ -441,6 +471,25 @@ export const SafePage = () => {
             ))}
           </div>
         )}
+
+        {!isFetching && nextCursor && (
+          <div className="text-center mt-4 sm:mt-6">
+            <Button
+              variant="outline"
+              onClick={loadMoreFiles}
+              disabled={isLoadingMore}
+              className="border-main text-main text-xs sm:text-sm"
+            >
+              {isLoadingMore ? (
+                <span className="flex items-center gap-2">
+                  <Loader2 className="animate-spin size-3 sm:size-4" /> טוען...
+                </span>
+              ) : (
+                "טעינת קבצים נוספים"
+              )}
+            </Button>
+          </div>
+        )}
       </div>
 
       {/* Upload dialog (modal) */}
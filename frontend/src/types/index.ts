@@ -16,6 +16,7 @@ export interface BlogPost {
 }
 
 export interface VaultFile {
+  id: string;
   filename: string;
   url: string;
   timestamp: string;